@@ -0,0 +1,3 @@
+"""
+Benchmarks of the TorchSlime framework. They are not included in the distribution.
+"""
@@ -0,0 +1,147 @@
+"""
+Step memory benchmark.
+
+It trains a CPU dense prediction model on large batches for a few steps with ``ctx.run.release_step`` on and off, and reports the
+peak RSS of the process and the RSS before each batch is fetched (i.e., the memory held by the previous step during data
+loading). Each setting runs in a fresh interpreter. The final loss is reported as well, and it should be the same.
+
+Usage:
+    python -m benchmarks.memory
+"""
+from typing import Dict, Sequence
+import argparse
+import json
+import subprocess
+import sys
+
+BATCH_SIZE = 128
+STEPS = 10
+SHAPE = (3, 128, 128)
+
+
+def build_data():
+    import torch
+    from torch.utils.data import DataLoader, TensorDataset
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(STEPS * BATCH_SIZE, *SHAPE, generator=generator)
+    return DataLoader(TensorDataset(x, x), batch_size=BATCH_SIZE)
+
+
+def build_model():
+    # dense prediction model, whose outputs are as large as the inputs
+    import torch
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(SHAPE[0], 8, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(8, SHAPE[0], 3, padding=1)
+    )
+
+
+class FetchProbe:
+    """
+    Iterable wrapper of the DataLoader that records the RSS before each batch is fetched. It is not a generator, because
+    the generator frame would keep the previous batch alive.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.rss = []
+        self._iterator = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self._iterator = iter(self.loader)
+        return self
+
+    def __next__(self):
+        from torchslime.util.memory import current_rss
+        self.rss.append(current_rss())
+        return next(self._iterator)
+
+
+def run_setting(release: bool) -> Dict:
+    """Run a single setting in the current process.
+    """
+    import torch
+    from torchslime.core.proxy import Proxy
+    from torchslime.core.handler import DisplayHandler, HandlerContainer, LRDecayHandler
+    from torchslime.callback import Callback
+    from torchslime.util import is_nothing
+    from torchslime.util.memory import peak_rss
+    torch.set_num_threads(1)
+
+    def patch(container: HandlerContainer):
+        container[:] = [handler for handler in container if isinstance(handler, DisplayHandler) is False]
+        for handler in container:
+            if isinstance(handler, HandlerContainer):
+                patch(handler)
+
+    class LossRecorder(Callback):
+        def __init__(self, losses):
+            super().__init__()
+            self.losses = losses
+
+        def epoch_end(self, ctx):
+            self.losses.append(float(ctx.epoch.train_loss))
+
+    model = build_model()
+    proxy = Proxy(model, 'cpu')
+    proxy.build(loss=torch.nn.MSELoss(), optimizer=torch.optim.SGD(model.parameters(), lr=0.01))
+    # train without the validation part
+    epoch_iteration = proxy.run.train[1]
+    end = [i for i, handler in enumerate(epoch_iteration) if isinstance(handler, LRDecayHandler)][0]
+    epoch_iteration[:] = epoch_iteration[:end + 1] + [epoch_iteration[-1]]
+    patch(proxy.run.train)
+    proxy.run.release_step = release
+
+    data = FetchProbe(build_data())
+    losses = []
+    proxy.train(data, 1, callbacks=[LossRecorder(losses)])
+    # the first fetch happens before any step
+    fetch_rss = [rss for rss in data.rss[1:] if is_nothing(rss) is False]
+    return {
+        'release_step': release,
+        'peak_rss_mb': peak_rss() / 2 ** 20,
+        'fetch_rss_mb': max(fetch_rss) / 2 ** 20 if len(fetch_rss) > 0 else -1,
+        'loss': losses[-1] if len(losses) > 0 else None
+    }
+
+
+def run() -> Dict[str, Dict]:
+    """Run each setting in a fresh interpreter.
+    """
+    results = {}
+    for release in ['on', 'off']:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.memory', '--setting', release],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        results[release] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='TorchSlime step memory benchmark.')
+    parser.add_argument('--setting', default=None, choices=['on', 'off'], help='run a single setting and print JSON.')
+    args = parser.parse_args(argv)
+
+    if args.setting is not None:
+        print(json.dumps(run_setting(args.setting == 'on')))
+        return 0
+
+    results = run()
+    print('{0:<8} {1:>14} {2:>14} {3:>12}'.format('release', 'peak RSS/MB', 'fetch RSS/MB', 'loss'))
+    for setting, result in results.items():
+        print('{0:<8} {1:>14.1f} {2:>14.1f} {3:>12}'.format(
+            setting, result['peak_rss_mb'], result['fetch_rss_mb'], result['loss']
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
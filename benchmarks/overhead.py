@@ -0,0 +1,307 @@
+"""
+Framework overhead benchmark.
+
+Each scenario runs Proxy.train/eval/predict on a tiny CPU model with synthetic data, and the same work is done by a
+hand-written PyTorch loop. The difference is reported as the per-step framework overhead. Every scenario runs in a
+fresh interpreter, so the peak RSS is measured per scenario.
+
+Usage:
+    python -m benchmarks.overhead --save baseline.json
+    python -m benchmarks.overhead --baseline baseline.json --threshold 0.2
+"""
+from typing import Callable, Dict, Sequence
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+SCENARIOS = ['train', 'eval', 'predict', 'callbacks', 'metrics', 'display', 'grad_acc']
+
+BATCH_SIZE = 32
+STEPS = 200
+IN_FEATURES = 16
+OUT_FEATURES = 4
+GRAD_ACC = 4
+NUM_CALLBACKS = 5
+NUM_METRICS = 2
+
+
+@contextlib.contextmanager
+def silent_stdout():
+    """Redirect stdout at the file descriptor level, because the console output functions bind sys.stdout as
+    default arguments.
+    """
+    sys.stdout.flush()
+    fd = sys.stdout.fileno()
+    saved = os.dup(fd)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), fd)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, fd)
+            os.close(saved)
+
+
+def peak_rss_kb() -> int:
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return rss // 1024 if sys.platform == 'darwin' else rss
+    except ImportError:
+        return -1
+
+
+class AllocProbe:
+    """
+    Record the bytes allocated in each step (the tracemalloc peak since the previous step end).
+    """
+
+    def __init__(self):
+        self.allocs = []
+        self.enabled = False
+
+    def start(self):
+        self.allocs.clear()
+        self.enabled = tracemalloc.is_tracing()
+        if self.enabled:
+            tracemalloc.reset_peak()
+
+    def __call__(self, *_):
+        if self.enabled:
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocs.append(peak - current)
+            tracemalloc.reset_peak()
+
+    def mean(self) -> float:
+        return sum(self.allocs) / len(self.allocs) if len(self.allocs) > 0 else 0.0
+
+
+def build_data():
+    import torch
+    from torch.utils.data import DataLoader, TensorDataset
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(STEPS * BATCH_SIZE, IN_FEATURES, generator=generator)
+    y = torch.randint(0, OUT_FEATURES, (STEPS * BATCH_SIZE,), generator=generator)
+    return DataLoader(TensorDataset(x, y), batch_size=BATCH_SIZE)
+
+
+def build_model():
+    import torch
+    torch.manual_seed(0)
+    return torch.nn.Linear(IN_FEATURES, OUT_FEATURES)
+
+
+def accuracy(y_pred, y_true) -> float:
+    return (y_pred.argmax(1) == y_true).float().mean().item()
+
+
+def raw_loop(scenario: str, data, model, probe: AllocProbe) -> Callable[[], None]:
+    """The hand-written equivalent of the scenario.
+    """
+    import torch
+    loss_func = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+    mode = scenario if scenario in ['eval', 'predict'] else 'train'
+    grad_acc = GRAD_ACC if scenario == 'grad_acc' else 1
+
+    def run():
+        model.train(mode == 'train')
+        with torch.set_grad_enabled(mode == 'train'):
+            total = len(data)
+            for current, (x, y) in enumerate(data):
+                y_pred = model(x)
+                if mode != 'predict':
+                    loss = loss_func(y_pred, y)
+                    float(loss)
+                if mode == 'train':
+                    (loss / grad_acc).backward()
+                    if (current + 1) % grad_acc == 0 or current + 1 == total:
+                        optimizer.step()
+                        optimizer.zero_grad()
+                if scenario == 'metrics':
+                    for _ in range(NUM_METRICS):
+                        accuracy(y_pred, y)
+                probe()
+    return run
+
+
+def proxy_loop(scenario: str, data, model, probe: AllocProbe) -> Callable[[], None]:
+    """Run the scenario with Proxy.
+    """
+    import torch
+    from torchslime.core.proxy import Proxy
+    from torchslime.core.handler import DisplayHandler, Handler, HandlerContainer, IterationHandler, LRDecayHandler
+    from torchslime.callback import Callback
+    from torchslime.metric import Metric
+
+    class Accuracy(Metric):
+        def get(self, ctx):
+            return accuracy(ctx.step.y_pred, ctx.step.y_true)
+
+    class ProbeHandler(Handler):
+        def handle(self, ctx):
+            probe()
+
+    def patch(container: HandlerContainer):
+        # remove the display handlers and append the probe to the iteration handlers
+        if scenario != 'display':
+            container[:] = [handler for handler in container if isinstance(handler, DisplayHandler) is False]
+        for handler in container:
+            if isinstance(handler, HandlerContainer):
+                patch(handler)
+        if isinstance(container, IterationHandler):
+            container.append(ProbeHandler())
+
+    proxy = Proxy(model, 'cpu')
+    proxy.build(
+        loss=torch.nn.CrossEntropyLoss(),
+        metrics=[Accuracy('acc_{0}'.format(i)) for i in range(NUM_METRICS)] if scenario == 'metrics' else None,
+        optimizer=torch.optim.SGD(model.parameters(), lr=0.01)
+    )
+    mode = scenario if scenario in ['eval', 'predict'] else 'train'
+    # train without the validation part
+    if mode == 'train':
+        epoch_iteration = proxy.run.train[1]
+        end = [i for i, handler in enumerate(epoch_iteration) if isinstance(handler, LRDecayHandler)][0]
+        epoch_iteration[:] = epoch_iteration[:end + 1] + [epoch_iteration[-1]]
+    patch(proxy.run[mode])
+    callbacks = [Callback() for _ in range(NUM_CALLBACKS)] if scenario == 'callbacks' else None
+
+    def run():
+        if mode == 'train':
+            proxy.train(data, 1, callbacks=callbacks, grad_acc=GRAD_ACC if scenario == 'grad_acc' else 1)
+        elif mode == 'eval':
+            proxy.eval(data, callbacks=callbacks)
+        else:
+            proxy.predict(data, callbacks=callbacks)
+    return run
+
+
+def measure(run: Callable[[], None], probe: AllocProbe, repeat: int) -> Dict:
+    # warmup
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    probe.start()
+    run()
+    tracemalloc.stop()
+    return {'time': min(times), 'alloc_bytes_per_step': probe.mean()}
+
+
+def run_scenario(scenario: str, repeat: int = 5) -> Dict:
+    """Run a single scenario in the current process.
+    """
+    import torch
+    torch.set_num_threads(1)
+    data = build_data()
+    with silent_stdout():
+        raw_probe, proxy_probe = AllocProbe(), AllocProbe()
+        raw = measure(raw_loop(scenario, data, build_model(), raw_probe), raw_probe, repeat)
+        framework = measure(proxy_loop(scenario, data, build_model(), proxy_probe), proxy_probe, repeat)
+    steps = len(data)
+    return {
+        'scenario': scenario,
+        'steps': steps,
+        'overhead_us': (framework['time'] - raw['time']) / steps * 1e6,
+        'steps_per_sec': steps / framework['time'],
+        'raw_steps_per_sec': steps / raw['time'],
+        'alloc_bytes_per_step': framework['alloc_bytes_per_step'],
+        'raw_alloc_bytes_per_step': raw['alloc_bytes_per_step'],
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def run(scenarios: Sequence[str] = None, repeat: int = 5) -> Dict[str, Dict]:
+    """Run scenarios, each in a fresh interpreter.
+    """
+    results = {}
+    for scenario in (scenarios if scenarios is not None else SCENARIOS):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.overhead', '--scenario', scenario, '--repeat', str(repeat)],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        results[scenario] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float, min_delta_us: float) -> list:
+    """Compare the results with the baseline, and return the regression messages.
+    """
+    regressions = []
+    for scenario, result in results.items():
+        if scenario not in baseline:
+            continue
+        base = baseline[scenario]
+        limit = max(base['overhead_us'] * (1 + threshold), base['overhead_us'] + min_delta_us)
+        if result['overhead_us'] > limit:
+            regressions.append('{0}: overhead {1:.1f}us > {2:.1f}us (baseline {3:.1f}us)'.format(
+                scenario, result['overhead_us'], limit, base['overhead_us']
+            ))
+        limit = base['alloc_bytes_per_step'] * (1 + threshold)
+        if result['alloc_bytes_per_step'] > limit and result['alloc_bytes_per_step'] - base['alloc_bytes_per_step'] > 1024:
+            regressions.append('{0}: allocation {1:.0f}B/step > {2:.0f}B/step (baseline {3:.0f}B/step)'.format(
+                scenario, result['alloc_bytes_per_step'], limit, base['alloc_bytes_per_step']
+            ))
+    return regressions
+
+
+def report(results: Dict[str, Dict]):
+    print('{0:<10} {1:>12} {2:>12} {3:>12} {4:>14} {5:>12}'.format(
+        'scenario', 'overhead/us', 'steps/s', 'raw steps/s', 'alloc B/step', 'peak RSS/KB'
+    ))
+    for scenario, result in results.items():
+        print('{0:<10} {1:>12.1f} {2:>12.1f} {3:>12.1f} {4:>14.0f} {5:>12}'.format(
+            scenario,
+            result['overhead_us'],
+            result['steps_per_sec'],
+            result['raw_steps_per_sec'],
+            result['alloc_bytes_per_step'],
+            result['peak_rss_kb']
+        ))
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='TorchSlime framework overhead benchmark.')
+    parser.add_argument('--scenario', default=None, help='run a single scenario in this process and print JSON.')
+    parser.add_argument('--scenarios', nargs='*', default=None, choices=SCENARIOS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', default=None, help='save the results as a JSON baseline.')
+    parser.add_argument('--baseline', default=None, help='JSON baseline to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression.')
+    parser.add_argument('--min-delta-us', type=float, default=5.0, help='allowed absolute overhead regression.')
+    args = parser.parse_args(argv)
+
+    if args.scenario is not None:
+        print(json.dumps(run_scenario(args.scenario, args.repeat)))
+        return 0
+
+    results = run(args.scenarios, args.repeat)
+    report(results)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_us)
+        for message in regressions:
+            print('REGRESSION', message)
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Startup benchmark that measures the cold import time of each torchslime subpackage.
+
+Each module is imported in a fresh interpreter, so the result is not affected by the modules that are already
+imported. Run it with ``python -m benchmarks.startup``.
+"""
+from typing import Dict, Sequence
+import subprocess
+import sys
+import json
+
+MODULES = [
+    'torchslime',
+    'torchslime.log',
+    'torchslime.util',
+    'torchslime.util.formatter',
+    'torchslime.util.terminal',
+    'torchslime.module',
+    'torchslime.core',
+    'torchslime.core.context',
+    'torchslime.core.handler',
+    'torchslime.data',
+    'torchslime.metric',
+    'torchslime.callback',
+    'torchslime.callback.common',
+    'torchslime.core.proxy',
+    'torchslime.runtime'
+]
+
+_SNIPPET = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'time': time.perf_counter() - start, 'torch': 'torch' in sys.modules}}))
+'''
+
+
+def measure(module: str, repeat: int = 5) -> Dict:
+    """Measure the import time (in seconds) of a module in fresh interpreters, and return the best result.
+    """
+    times = []
+    torch_imported = False
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _SNIPPET.format(module=module)],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result['time'])
+        torch_imported = result['torch']
+    return {'module': module, 'time': min(times), 'torch': torch_imported}
+
+
+def run(modules: Sequence[str] = None, repeat: int = 5):
+    results = [measure(module, repeat) for module in (modules if modules is not None else MODULES)]
+    for result in results:
+        print('{0:<32} {1:>9.2f} ms  {2}'.format(
+            result['module'], result['time'] * 1000, 'torch' if result['torch'] else '-'
+        ))
+    return results
+
+
+if __name__ == '__main__':
+    run()
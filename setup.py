@@ -6,7 +6,7 @@ README = 'README.md'
 setup(
     name='torchslime',
     version=__version__,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=False,
     entry_points={},
     install_requires=[],
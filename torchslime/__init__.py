@@ -1,5 +1,18 @@
-from torchslime.core import Proxy
-from torchslime.core.context import Context
+import importlib
+# the util package is torch-free, and importing it first keeps the util-log import order.
+from . import util
 
 
 __version__ = '0.1.0'
+
+# the framework entries are loaded lazily (PEP 562), so the light subpackages can be imported without torch.
+_LAZY_ATTRS = {
+    'Proxy': 'torchslime.core.proxy',
+    'Context': 'torchslime.core.context'
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -1,12 +1,93 @@
 from ..core.context import Context
-from ..util import BaseList
-from typing import Union, Sequence
+from ..util import BaseList, NOTHING, is_nothing
+from typing import Dict, Union, Sequence
+from torch import Tensor
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+import copy
+
+
+class StateSnapshot:
+    """
+    Copy of the state dict of a module or an optimizer, which provides ``state_dict`` like the original object.
+    """
+
+    def __init__(self, state: Dict):
+        self.state = state
+
+    def state_dict(self) -> Dict:
+        return self.state
+
+
+def freeze(obj):
+    """Copy an object so it is not changed by the training thread: tensors are detached and cloned, and modules and
+    optimizers are copied as their state dicts.
+    """
+    if isinstance(obj, Tensor):
+        return obj.detach().clone()
+    elif isinstance(obj, (int, float, str, bool, type(None))) or is_nothing(obj):
+        return obj
+    elif isinstance(obj, dict):
+        return type(obj)((key, freeze(value)) for key, value in obj.items())
+    elif isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        # namedtuple
+        return type(obj)(*(freeze(item) for item in obj))
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(freeze(item) for item in obj)
+    elif callable(getattr(obj, 'state_dict', None)):
+        return StateSnapshot(freeze(obj.state_dict()))
+    try:
+        return copy.deepcopy(obj)
+    except Exception:
+        # objects that cannot be copied are shared
+        return obj
+
+
+class ContextSnapshot:
+    """
+    Immutable copy of some context fields(e.g., 'epoch.current' or 'model'), which is passed to the async
+    callbacks instead of the context. Missing fields are NOTHING. The keyword arguments are set as extra values that
+    the callback computes from the context in the training thread.
+    """
+
+    def __init__(self, ctx: Context = NOTHING, fields: Sequence[str] = (), **values):
+        for field in fields:
+            node = self
+            attrs = field.split('.')
+            for attr in attrs[:-1]:
+                if attr not in node.__dict__:
+                    node.__dict__[attr] = ContextSnapshot()
+                node = node.__dict__[attr]
+            value = ctx
+            for attr in attrs:
+                value = getattr(value, attr, NOTHING)
+            node.__dict__[attrs[-1]] = freeze(value)
+        for key, value in values.items():
+            self.__dict__[key] = freeze(value)
+
+    def __getattr__(self, _):
+        return NOTHING
+
+    def __setattr__(self, name, _):
+        raise AttributeError('The context snapshot is immutable, and {0} cannot be set.'.format(name))
 
 
 class Callback():
     """
     Callback for running operations(training, evaluation, prediction, etc.).
     """
+
+    # step context attributes(e.g., 'y_pred') that the callback needs after the step ends. The step tensors are
+    # released at the end of each step unless a callback declares them here.
+    retain_step: Sequence[str] = ()
+    # async-safe callbacks run on the callback thread with a ContextSnapshot of ``snapshot_fields`` instead of the
+    # context, so they should only read these fields and should not depend on other callbacks.
+    async_safe: bool = False
+    snapshot_fields: Sequence[str] = (
+        'epoch.current', 'epoch.total', 'epoch.train_loss', 'epoch.train_metrics', 'epoch.eval_loss',
+        'epoch.eval_metrics', 'step.current', 'step.total', 'step.loss', 'step.metrics'
+    )
+
     def __init__(self):
         super().__init__()
 
@@ -28,6 +109,19 @@ class Callback():
     def epoch_end(self, ctx: Context):
         pass
 
+    def has_hook(self, hook: str) -> bool:
+        """Whether the callback overrides the hook, i.e., the hook is not the empty default.
+        """
+        return getattr(type(self), hook) is not getattr(Callback, hook)
+
+    def snapshot(self, ctx: Context, hook: str) -> ContextSnapshot:
+        """Take the snapshot that the hook of an async-safe callback gets. It runs in the training thread.
+        """
+        return ContextSnapshot(ctx, self.snapshot_fields)
+
+
+# names of the callback hooks
+CALLBACK_HOOKS = ('begin', 'end', 'step_begin', 'step_end', 'epoch_begin', 'epoch_end')
 
 # callback or sequence of callbacks
 C_SEQ = Union[Callback, Sequence[Callback]]
@@ -36,32 +130,113 @@ C_SEQ = Union[Callback, Sequence[Callback]]
 class CallbackContainer(Callback, BaseList):
     """
     Maintaining a list that contains callbacks, combination mode.
+
+    Each hook dispatches to a precomputed list of the callbacks that override it, which is rebuilt when the list
+    changes. The synchronous callbacks run in order in the training thread. The hooks of the async-safe callbacks run in
+    order on a callback thread, and the training thread blocks when ``max_pending`` hooks are queued. All the
+    queued hooks are finished at ``end``, and the exceptions of the async hooks are raised in the training thread
+    at the next hook.
     """
 
-    def __init__(self, callbacks: C_SEQ = None):
+    def __init__(self, callbacks: C_SEQ = None, max_pending: int = 16):
         super().__init__()
         BaseList.__init__(self, callbacks)
+        self.max_pending = max_pending
+        # one worker, so the async hooks run in order
+        self.executor = NOTHING
+        self.slots = BoundedSemaphore(max_pending)
+        self.pending = []
+        self.lock = Lock()
+        # hook name -> [(callback, async_safe)] of the callbacks that override the hook
+        self.table = NOTHING
+
+    @property
+    def retain_step(self) -> Sequence[str]:
+        return tuple(set(name for run_callback in self for name in run_callback.retain_step))
+
+    def build_table(self) -> Dict:
+        self.table = {
+            hook: [
+                (getattr(run_callback, hook), run_callback, run_callback.async_safe)
+                for run_callback in self if run_callback.has_hook(hook)
+            ] for hook in CALLBACK_HOOKS
+        }
+        return self.table
+
+    def has_hook(self, hook: str) -> bool:
+        table = self.table if is_nothing(self.table) is False else self.build_table()
+        return len(table[hook]) > 0
+
+    def dispatch(self, hook: str, ctx: Context):
+        table = self.table if is_nothing(self.table) is False else self.build_table()
+        if is_nothing(self.executor) is False:
+            self.check_errors()
+        for func, run_callback, async_safe in table[hook]:
+            if async_safe is False:
+                func(ctx)
+            else:
+                self.submit(func, run_callback.snapshot(ctx, hook))
+
+    def submit(self, func, snapshot: ContextSnapshot):
+        if is_nothing(self.executor) is True:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='callback')
+        # backpressure
+        self.slots.acquire()
+        future = self.executor.submit(func, snapshot)
+        with self.lock:
+            self.pending.append(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        self.slots.release()
+
+    def check_errors(self):
+        with self.lock:
+            finished = [future for future in self.pending if future.done()]
+            self.pending = [future for future in self.pending if future.done() is False]
+        for future in finished:
+            # raise the exceptions of the async hooks
+            future.result()
+
+    def flush(self):
+        """Wait for all the queued async hooks.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
 
     def begin(self, ctx: Context):
-        for run_callback in self:
-            run_callback.begin(ctx)
-    
+        self.dispatch('begin', ctx)
+
     def end(self, ctx: Context):
-        for run_callback in self:
-            run_callback.end(ctx)
-    
+        self.dispatch('end', ctx)
+        self.flush()
+
     def step_begin(self, ctx: Context):
-        for run_callback in self:
-            run_callback.step_begin(ctx)
-    
+        self.dispatch('step_begin', ctx)
+
     def step_end(self, ctx: Context):
-        for run_callback in self:
-            run_callback.step_end(ctx)
-    
+        self.dispatch('step_end', ctx)
+
     def epoch_begin(self, ctx: Context):
-        for run_callback in self:
-            run_callback.epoch_begin(ctx)
-    
+        self.dispatch('epoch_begin', ctx)
+
     def epoch_end(self, ctx: Context):
-        for run_callback in self:
-            run_callback.epoch_end(ctx)
+        self.dispatch('epoch_end', ctx)
+
+
+def _invalidate(name: str):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        # the dispatch table is rebuilt when the callback list changes
+        self.table = NOTHING
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ['append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse', '__setitem__',
+              '__delitem__', '__iadd__', '__imul__']:
+    setattr(CallbackContainer, _name, _invalidate(_name))
@@ -1,12 +1,14 @@
 import os
 
-from torchslime.util import is_nothing
-from . import Callback
+from torchslime.util import NOTHING, is_nothing
+from . import Callback, ContextSnapshot
 from ..core.context import Context
+from ..core.status import TrainStatus
 from ..log.directory import get_checkpoint_path, join_path, get_metric_path, safe_makedirs
 from ..log import logger
 import torch
-from typing import Sequence, Union, Callable
+from typing import Dict, Sequence, Union, Callable
+from time import time
 import json
 
 EPOCH_SEQ = Union[int, Sequence[int]]
@@ -14,6 +16,9 @@ EPOCH_SEQ = Union[int, Sequence[int]]
 
 class SaveCheckpoint(Callback):
 
+    # the checkpoint is copied in the training thread and written in the callback thread
+    async_safe = True
+
     def __init__(
         self,
         save_per: EPOCH_SEQ,
@@ -42,20 +47,37 @@ class SaveCheckpoint(Callback):
         self.save_options = list(map(lambda item: item[0], filter(lambda item: item[1] is True, self.save_options)))
         assert len(self.save_options) > 0, 'You should choose at least one item to be saved when using the "SaveCheckpoint" Callback.'
     
+    def snapshot(self, ctx: Context, hook: str) -> ContextSnapshot:
+        fields = ['epoch.current']
+        if hook == 'epoch_end' and self.should_save(ctx):
+            fields += ['model'] if 'model' in self.save_options else []
+            fields += ['run.optimizer'] if 'optimizer' in self.save_options else []
+            # the name function may read any context field, so it is resolved in the training thread
+            return ContextSnapshot(ctx, fields, checkpoint_name=self.get_checkpoint_name(ctx))
+        return ContextSnapshot(ctx, fields)
+
+    def get_checkpoint_name(self, ctx: Context) -> str:
+        if isinstance(self.checkpoint_name, str):
+            return self.checkpoint_name
+        elif callable(self.checkpoint_name):
+            return self.checkpoint_name(ctx)
+        return 'checkpoint_{0}.pth'.format(ctx.epoch.current + 1)
+
+    def should_save(self, ctx: Context) -> bool:
+        return (isinstance(self.save_per, (list, tuple)) and (ctx.epoch.current + 1) in self.save_per)\
+            or (ctx.epoch.current + 1) % self.save_per == 0
+
     def epoch_end(self, ctx: Context):
-        if (isinstance(self.save_per, (list, tuple)) and (ctx.epoch.current + 1) in self.save_per)\
-            or (ctx.epoch.current + 1) % self.save_per == 0:
+        if self.should_save(ctx):
             if len(self.save_options) > 1:
                 item = self.save_dict(ctx, self.save_options)
             else:
                 item = self.save_single(ctx, self.save_options[0])
             
-            if isinstance(self.checkpoint_name, str):
-                checkpoint_name = self.checkpoint_name
-            elif callable(self.checkpoint_name):
-                checkpoint_name = self.checkpoint_name(ctx)
+            if isinstance(ctx, ContextSnapshot):
+                checkpoint_name = ctx.checkpoint_name
             else:
-                checkpoint_name = 'checkpoint_{0}.pth'.format(ctx.epoch.current + 1)
+                checkpoint_name = self.get_checkpoint_name(ctx)
             torch.save(item, join_path(self.checkpoint_path, checkpoint_name))
 
     def save_dict(self, ctx: Context, save_options):
@@ -80,6 +102,12 @@ class SaveCheckpoint(Callback):
 
 class SaveMetrics(Callback):
 
+    # the metric file is written in the callback thread
+    async_safe = True
+    snapshot_fields = (
+        'epoch.current', 'epoch.train_loss', 'epoch.train_metrics', 'epoch.eval_loss', 'epoch.eval_metrics'
+    )
+
     def __init__(self, save_train: bool = True, save_eval: bool = True, save_per: EPOCH_SEQ = 1):
         super().__init__()
         self.metric_path = get_metric_path()
@@ -124,3 +152,144 @@ class SaveMetrics(Callback):
         with open(self.metric_path, 'w') as f:
             json.dump(history, f, indent=4)
         return len(history)
+
+
+def epoch_results(ctx: Context) -> Dict:
+    """Get the train and validation loss and metrics of the epoch, with the same keys as SaveMetrics.
+    """
+    item = {}
+    if is_nothing(ctx.epoch.train_metrics) is False:
+        item.update(**ctx.epoch.train_metrics)
+    if is_nothing(ctx.epoch.train_loss) is False:
+        item.update(loss=ctx.epoch.train_loss)
+    if is_nothing(ctx.epoch.eval_metrics) is False:
+        item.update(**ctx.epoch.eval_metrics)
+    if is_nothing(ctx.epoch.eval_loss) is False:
+        item.update(val_loss=ctx.epoch.eval_loss)
+    return item
+
+
+class EarlyStopping(Callback):
+    """
+    Stop the training when the monitored value has not improved for ``patience`` epochs.
+
+    Args:
+        monitor (str, optional): monitored key of the epoch results, e.g., 'val_loss', 'loss' or 'val_acc'.
+            Defaults to 'val_loss'.
+        mode (str, optional): 'min' or 'max'. Defaults to 'min'.
+        patience (int, optional): epochs without improvement before stopping. Defaults to 3.
+        min_delta (float, optional): min change that counts as an improvement. Defaults to 0.
+        restore_best (bool, optional): keep a CPU copy of the best weights, and load them when the training ends.
+            Defaults to False.
+    """
+
+    def __init__(
+        self,
+        monitor: str = 'val_loss',
+        mode: str = 'min',
+        patience: int = 3,
+        min_delta: float = 0.,
+        restore_best: bool = False
+    ):
+        super().__init__()
+        if mode not in ['min', 'max']:
+            raise ValueError('Unsupported mode: {0}, which should be \'min\' or \'max\'.'.format(mode))
+        self.monitor = monitor
+        self.mode = mode
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best = restore_best
+        self.begin(NOTHING)
+
+    def begin(self, ctx: Context):
+        self.best = NOTHING
+        self.best_epoch = NOTHING
+        self.best_state = NOTHING
+        self.wait = 0
+
+    def improved(self, value) -> bool:
+        if is_nothing(self.best) is True:
+            return True
+        return value < self.best - self.min_delta if self.mode == 'min' else value > self.best + self.min_delta
+
+    def epoch_end(self, ctx: Context):
+        value = epoch_results(ctx).get(self.monitor, NOTHING)
+        if is_nothing(value) is True:
+            logger.warn('EarlyStopping: the monitored value \'{0}\' is not found.'.format(self.monitor))
+            return
+        if self.improved(value) is True:
+            self.best, self.best_epoch, self.wait = value, ctx.epoch.current, 0
+            if self.restore_best is True:
+                self.best_state = {
+                    key: tensor.detach().to('cpu', copy=True) for key, tensor in ctx.model.state_dict().items()
+                }
+            return
+        self.wait += 1
+        if self.wait >= self.patience:
+            ctx.run.control.stop_run('{0} has not improved for {1} epochs (best {2:.5f} at epoch {3}).'.format(
+                self.monitor, self.wait, self.best, self.best_epoch + 1
+            ))
+
+    def end(self, ctx: Context):
+        if self.restore_best is True and is_nothing(self.best_state) is False:
+            ctx.model.load_state_dict(self.best_state)
+            logger.info('The best weights(epoch {0}) are restored.'.format(self.best_epoch + 1))
+            self.best_state = NOTHING
+
+
+class MaxSteps(Callback):
+    """
+    Stop the training after ``max_steps`` training steps, counted across epochs.
+    """
+
+    def __init__(self, max_steps: int):
+        super().__init__()
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def begin(self, ctx: Context):
+        self.steps = 0
+
+    def step_end(self, ctx: Context):
+        if isinstance(ctx.status, TrainStatus) is False:
+            return
+        self.steps += 1
+        if self.steps >= self.max_steps:
+            ctx.run.control.stop_run('{0} training steps are reached.'.format(self.max_steps))
+
+
+class TimeBudget(Callback):
+    """
+    Stop the training when the wall-clock budget is used up.
+
+    Args:
+        seconds (float): the time budget.
+        predict_epoch (bool, optional): also stop at the end of an epoch if the next epoch is expected(by the
+            duration of the last epoch) to exceed the budget. Defaults to True.
+    """
+
+    def __init__(self, seconds: float, predict_epoch: bool = True):
+        super().__init__()
+        self.seconds = seconds
+        self.predict_epoch = predict_epoch
+        self.start = NOTHING
+        self.epoch_start = NOTHING
+
+    def begin(self, ctx: Context):
+        self.start = time()
+
+    def epoch_begin(self, ctx: Context):
+        self.epoch_start = time()
+
+    def step_end(self, ctx: Context):
+        if is_nothing(self.start) is False and time() - self.start >= self.seconds:
+            ctx.run.control.stop_run('the time budget({0:.1f}s) is used up.'.format(self.seconds))
+
+    def epoch_end(self, ctx: Context):
+        if is_nothing(self.start) is True or is_nothing(self.epoch_start) is True or self.predict_epoch is False:
+            return
+        now = time()
+        if now - self.start + (now - self.epoch_start) > self.seconds and ctx.run.control.run_stop is False:
+            ctx.run.control.stop_run('the next epoch is expected to exceed the time budget({0:.1f}s).'.format(
+                self.seconds
+            ))
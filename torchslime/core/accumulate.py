@@ -0,0 +1,186 @@
+"""
+Epoch-level output accumulator that collects the predictions and targets of an evaluation epoch into preallocated
+buffers, for metrics that need the whole epoch (e.g., AUC, ranking metrics and calibration).
+"""
+from typing import Any, Callable, Dict
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from .context import Context
+from torch import Tensor
+import torch
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+def _map(func: Callable[[Tensor], Any], obj):
+    """Apply the function to the tensors in a (nested) list, tuple or dict. Other objects are mapped to NOTHING.
+    """
+    if isinstance(obj, Tensor):
+        return func(obj)
+    elif isinstance(obj, dict):
+        return {key: _map(func, value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_map(func, item) for item in obj]
+    return NOTHING
+
+
+def _zip(func: Callable[[Tensor, Tensor], Any], buffers, obj):
+    """Apply the function to the buffers and the tensors at the same positions.
+    """
+    if isinstance(buffers, Tensor):
+        return func(buffers, obj)
+    elif isinstance(buffers, dict):
+        return {key: _zip(func, value, obj[key]) for key, value in buffers.items()}
+    elif isinstance(buffers, list):
+        return [_zip(func, value, item) for value, item in zip(buffers, obj)]
+    return NOTHING
+
+
+class OutputAccumulator:
+    """
+    Accumulate ``ctx.step.y_pred`` and ``ctx.step.y_true`` of an epoch in place. The buffers are preallocated from
+    ``len(dataset)`` and the shapes of the first batch, and the filled part is set to ``ctx.epoch.outputs`` at the end
+    of the iteration, which the epoch metrics and the epoch end callbacks can use.
+
+    Args:
+        dtype (optional): dtype of the floating point outputs, e.g., ``torch.float16``. Defaults to None(unchanged).
+        topk (int, optional): keep only the top-k values and indices along the last dim of the predictions.
+            Defaults to None.
+        targets (bool, optional): accumulate the targets as well. Defaults to True.
+        memory_budget (int, optional): max bytes of the buffers in RAM. Buffers beyond it are allocated as memmap
+            files. Defaults to None(no limit).
+        spill_dir (str, optional): directory of the memmap files. Defaults to a temp directory.
+    """
+
+    def __init__(
+        self,
+        dtype=None,
+        topk: int = None,
+        targets: bool = True,
+        memory_budget: int = None,
+        spill_dir: str = None
+    ):
+        super().__init__()
+        self.dtype = dtype
+        self.topk = topk
+        self.targets = targets
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.buffers: Dict = NOTHING
+        # number of samples filled
+        self.count = 0
+        # number of samples allocated
+        self.capacity = 0
+        self._spill_path = NOTHING
+
+    def clear(self, ctx: Context):
+        self.buffers = NOTHING
+        self.count = 0
+        self.capacity = 0
+        self.remove_spill()
+        ctx.epoch.outputs = NOTHING
+
+    def update(self, ctx: Context):
+        outputs = {'y_pred': self.transform(ctx.step.y_pred)}
+        if self.targets is True:
+            outputs['y_true'] = self.transform(ctx.step.y_true, target=True)
+        batch_size = ctx.step.batch_size
+        if is_nothing(batch_size) is True:
+            logger.warn('The batch size of the step is unknown, and the outputs are not accumulated.')
+            return
+        if is_nothing(self.buffers) is True:
+            self.allocate(outputs, self.estimate_total(ctx, batch_size))
+        elif self.count + batch_size > self.capacity:
+            # the dataset length is unknown or inaccurate(e.g., iterable datasets)
+            self.grow(max(self.capacity * 2, self.count + batch_size))
+        start, end = self.count, self.count + batch_size
+        _zip(lambda buffer, tensor: buffer[start:end].copy_(tensor), self.buffers, outputs)
+        self.count = end
+
+    def finish(self, ctx: Context):
+        if is_nothing(self.buffers) is True:
+            return
+        count = self.count
+        ctx.epoch.outputs = _map(lambda buffer: buffer[:count], self.buffers)
+
+    def transform(self, obj, target: bool = False):
+        """Detach and move the step outputs to CPU with the configured dtype(and top-k).
+        """
+        def convert(tensor: Tensor):
+            tensor = tensor.detach()
+            if target is False and self.topk is not None and tensor.is_floating_point() and tensor.dim() >= 2:
+                values, indices = tensor.topk(min(self.topk, tensor.size(-1)), dim=-1)
+                return {'values': convert_dtype(values), 'indices': indices.cpu()}
+            return convert_dtype(tensor)
+
+        def convert_dtype(tensor: Tensor):
+            return tensor.to(
+                device='cpu',
+                dtype=self.dtype if self.dtype is not None and tensor.is_floating_point() else None
+            )
+        return _map(convert, obj)
+
+    @staticmethod
+    def estimate_total(ctx: Context, batch_size: int) -> int:
+        try:
+            # number of samples of the map-style dataset
+            return len(ctx.dataset.dataset)
+        except Exception:
+            pass
+        total = ctx.step.total
+        if is_nothing(total) is True:
+            # estimated steps of streaming datasets
+            total = ctx.step.total_hint
+        return total * batch_size if isinstance(total, int) and total > 0 else batch_size
+
+    def allocate(self, outputs, total: int):
+        nbytes = 0
+
+        def measure(tensor: Tensor):
+            nonlocal nbytes
+            nbytes += total * tensor[0:1].nelement() * tensor.element_size()
+
+        _map(measure, outputs)
+        spill = self.memory_budget is not None and nbytes > self.memory_budget
+        if spill is True:
+            logger.info('The output buffers ({0:.1f}MB) exceed the memory budget, and memmap files are used.'.format(
+                nbytes / 2 ** 20
+            ))
+        self.buffers = _map(lambda tensor: self.empty(tensor, total, spill), outputs)
+        self.capacity = total
+
+    def grow(self, total: int):
+        logger.debug('The output buffers grow from {0} to {1} samples.'.format(self.capacity, total))
+        spill = is_nothing(self._spill_path) is False
+
+        def grow_buffer(buffer: Tensor):
+            result = self.empty(buffer, total, spill)
+            result[:self.count].copy_(buffer[:self.count])
+            return result
+        self.buffers = _map(grow_buffer, self.buffers)
+        self.capacity = total
+
+    def empty(self, tensor: Tensor, total: int, spill: bool) -> Tensor:
+        shape = (total, *tensor.shape[1:])
+        if spill is False:
+            return torch.empty(shape, dtype=tensor.dtype)
+        try:
+            np_dtype = torch.empty(0, dtype=tensor.dtype).numpy().dtype
+        except TypeError:
+            # dtypes that numpy does not support(e.g., bfloat16) are stored as float32
+            np_dtype = np.float32
+        if is_nothing(self._spill_path) is True:
+            self._spill_path = tempfile.mkdtemp(prefix='torchslime_outputs_', dir=self.spill_dir)
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self._spill_path)
+        os.close(fd)
+        return torch.from_numpy(np.lib.format.open_memmap(path, mode='w+', dtype=np_dtype, shape=shape))
+
+    def remove_spill(self):
+        if is_nothing(self._spill_path) is False:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = NOTHING
+
+    def __del__(self):
+        self.remove_spill()
@@ -0,0 +1,189 @@
+"""
+Batch size and DataLoader worker autotuner.
+"""
+from typing import Any, Dict, List, Sequence
+from ..data import ConstantProvider
+from ..util import NOTHING, is_nothing
+from ..util.memory import current_rss
+from ..log import logger
+from .context import Context
+from torch.utils.data import DataLoader, Dataset
+import torch
+import copy
+import time
+
+
+class TunedProvider(ConstantProvider):
+    """
+    Constant data provider built by the autotuner, with the chosen configuration and all the trial records.
+    """
+
+    def __init__(self, dataset: DataLoader, config: Dict, trials: List[Dict]):
+        super().__init__(dataset)
+        self.config = config
+        self.trials = trials
+
+
+def _is_oom(e: Exception) -> bool:
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+class Autotuner:
+    """
+    Run short timed trials of the training step and choose the highest-throughput DataLoader configuration under a
+    memory ceiling.
+
+    The search is coordinate-wise: the batch size is increased first until OOM, the memory ceiling or a throughput
+    plateau, and then ``num_workers`` (with ``prefetch_factor``) and ``torch.set_num_threads`` are searched with the
+    chosen batch size. The model and optimizer states are restored after the search.
+    """
+
+    def __init__(
+        self,
+        batch_sizes: Sequence[int] = (16, 32, 64, 128, 256, 512),
+        num_workers: Sequence[int] = (0, 2, 4, 8),
+        prefetch_factors: Sequence[int] = (2, 4),
+        threads: Sequence[int] = None,
+        memory_limit: int = None,
+        steps: int = 20,
+        warmup: int = 3,
+        plateau: float = 0.05,
+        loader_options: Dict = None
+    ):
+        self.batch_sizes = batch_sizes
+        self.num_workers = num_workers
+        self.prefetch_factors = prefetch_factors
+        self.threads = threads
+        # memory ceiling in bytes(accelerator allocated memory, or process RSS on CPU)
+        self.memory_limit = memory_limit
+        self.steps = steps
+        self.warmup = warmup
+        # relative throughput gain below which the search stops
+        self.plateau = plateau
+        self.loader_options = loader_options if loader_options is not None else {}
+        self.trials = []
+
+    def tune(self, ctx: Context, dataset: Dataset) -> TunedProvider:
+        ctx.ctx_check(['model', 'run.loss'], silent=False)
+        # save states that the trials change
+        model_state = copy.deepcopy(ctx.model.state_dict())
+        optimizer_state = copy.deepcopy(ctx.run.optimizer.state_dict()) if ctx.ctx_check('run.optimizer') else NOTHING
+        origin_threads = torch.get_num_threads()
+        self.trials = []
+
+        try:
+            config = {'batch_size': self.batch_sizes[0], 'num_workers': 0, 'prefetch_factor': NOTHING,
+                      'threads': origin_threads}
+            best = NOTHING
+            # batch size
+            for batch_size in self.batch_sizes:
+                result = self.trial(ctx, dataset, {**config, 'batch_size': batch_size})
+                if self.better(result, best) is False:
+                    break
+                best = result
+            if is_nothing(best) is True:
+                logger.warn('Autotuner: all the batch size trials failed, and the smallest batch size is used.')
+                best = {'config': config, 'throughput': 0}
+            # workers and prefetch factor
+            for num_workers in self.num_workers:
+                for prefetch_factor in (self.prefetch_factors if num_workers > 0 else [NOTHING]):
+                    if num_workers == best['config']['num_workers'] and prefetch_factor == best['config']['prefetch_factor']:
+                        continue
+                    result = self.trial(ctx, dataset, {
+                        **best['config'], 'num_workers': num_workers, 'prefetch_factor': prefetch_factor
+                    })
+                    if self.better(result, best) is True:
+                        best = result
+            # intra-op threads
+            for threads in (self.threads if self.threads is not None else []):
+                if threads == best['config']['threads']:
+                    continue
+                result = self.trial(ctx, dataset, {**best['config'], 'threads': threads})
+                if self.better(result, best) is True:
+                    best = result
+        finally:
+            ctx.model.load_state_dict(model_state)
+            if is_nothing(optimizer_state) is False:
+                ctx.run.optimizer.load_state_dict(optimizer_state)
+                ctx.run.optimizer.zero_grad()
+            ctx.step.initialize()
+
+        config = best['config']
+        torch.set_num_threads(config['threads'])
+        logger.info('Autotuner chose {0}, throughput: {1:.1f} samples/s.'.format(
+            {key: value for key, value in config.items() if is_nothing(value) is False}, best['throughput']
+        ))
+        return TunedProvider(self.build_loader(dataset, config), config, self.trials)
+
+    def better(self, result: Dict, best: Dict) -> bool:
+        if result['status'] != 'ok':
+            return False
+        if is_nothing(best) is True:
+            return True
+        return result['throughput'] > best['throughput'] * (1 + self.plateau)
+
+    def build_loader(self, dataset: Dataset, config: Dict) -> DataLoader:
+        options = {**self.loader_options, 'batch_size': config['batch_size'], 'num_workers': config['num_workers']}
+        options.setdefault('shuffle', True)
+        if config['num_workers'] > 0 and is_nothing(config['prefetch_factor']) is False:
+            options['prefetch_factor'] = config['prefetch_factor']
+        return DataLoader(dataset, **options)
+
+    def trial(self, ctx: Context, dataset: Dataset, config: Dict) -> Dict[str, Any]:
+        """Run a timed trial of the training step with the config.
+        """
+        handler = ctx.handler
+        step = handler.Container([
+            handler.Forward(),
+            handler.Loss(),
+            handler.Optimizer([handler.Backward()])
+        ])
+        handler.Status('train')(ctx)
+        torch.set_num_threads(config['threads'])
+        cuda = is_nothing(ctx.device) is False and ctx.device is not None and torch.device(ctx.device).type == 'cuda'
+        if cuda is True:
+            torch.cuda.reset_peak_memory_stats(ctx.device)
+
+        result = {'config': config, 'status': 'ok', 'throughput': 0, 'memory': NOTHING}
+        total = self.warmup + self.steps
+        samples, memory = 0, 0
+        start = NOTHING
+        try:
+            with torch.set_grad_enabled(True):
+                loader = self.build_loader(dataset, config)
+                for current, batch in enumerate(loader):
+                    if current == self.warmup:
+                        if cuda is True:
+                            torch.cuda.synchronize(ctx.device)
+                        start = time.perf_counter()
+                    ctx.step.from_dict({'batch': batch, 'current': current, 'total': total})
+                    step(ctx)
+                    if current >= self.warmup:
+                        samples += ctx.step.batch_size if is_nothing(ctx.step.batch_size) is False else 0
+                    rss = current_rss()
+                    memory = max(memory, rss if is_nothing(rss) is False else 0)
+                    if current + 1 >= total:
+                        break
+            if cuda is True:
+                torch.cuda.synchronize(ctx.device)
+                memory = torch.cuda.max_memory_allocated(ctx.device)
+            if is_nothing(start) is True:
+                result['status'] = 'too few batches'
+            else:
+                result['throughput'] = samples / (time.perf_counter() - start)
+            result['memory'] = memory
+            if self.memory_limit is not None and memory > self.memory_limit:
+                result['status'] = 'memory limit exceeded'
+        except Exception as e:
+            if _is_oom(e) is False:
+                raise
+            result['status'] = 'oom'
+        finally:
+            ctx.step.initialize()
+            if ctx.ctx_check('run.optimizer') is True:
+                ctx.run.optimizer.zero_grad()
+            if cuda is True:
+                torch.cuda.empty_cache()
+        logger.debug('Autotuner trial: {0}'.format(result))
+        self.trials.append(result)
+        return result
@@ -0,0 +1,165 @@
+"""
+Background validation that runs the validation handlers on a snapshot of the model weights in a worker thread, so
+the next training epoch starts immediately.
+"""
+from typing import Callable, List
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from .context import Context
+from .control import LoopControl
+from torch.nn import Module
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import copy
+import torch
+
+
+class BackgroundValidator:
+    """
+    Validate the weight snapshots of the finished epochs in a worker thread.
+
+    The jobs run one by one in the order of the epochs. When a job is finished, the epoch end handlers of its epoch
+    are run in the training thread with the epoch context of that epoch and the validation results, so the callbacks
+    (e.g., ``SaveMetrics``) get the correct epoch attribution. The latest results are also kept in
+    ``ctx.epoch.eval_loss`` and ``ctx.epoch.eval_metrics``.
+
+    No callback runs in the worker thread: the step callbacks of the validation iteration are skipped, and the
+    epoch end callbacks run in the training thread as above. The memory monitor does not cover the validation, whose
+    peaks would mix with the training profile.
+
+    Args:
+        device (optional): device of the snapshots, e.g., 'cpu' to validate without accelerator memory.
+            Defaults to None(the device of the model).
+        max_pending (int, optional): max jobs in flight, each of which holds a model snapshot. The training waits
+            for the oldest job when it is reached. Defaults to 1.
+    """
+
+    def __init__(self, device=None, max_pending: int = 1):
+        super().__init__()
+        self.device = device
+        self.max_pending = max(max_pending, 1)
+        # one worker, so the jobs run in order
+        self.executor = NOTHING
+        # idle model snapshots
+        self.snapshots: List[Module] = []
+        # pending jobs: (epoch state, validation context, deferred handlers, future)
+        self.jobs = deque()
+
+    def snapshot(self, ctx: Context) -> Module:
+        if len(self.snapshots) > 0:
+            model = self.snapshots.pop()
+            model.load_state_dict(ctx.model.state_dict())
+            return model
+        model = copy.deepcopy(ctx.model)
+        for param in model.parameters():
+            param.grad = None
+            param.requires_grad_(False)
+        return model.to(self.device) if self.device is not None else model
+
+    def submit(self, ctx: Context, run: Callable[[Context], None], deferred: Callable[[Context], None]):
+        """Run ``run`` on a validation context with the model snapshot, and ``deferred`` on the training context when
+        it is finished.
+        """
+        while len(self.jobs) >= self.max_pending:
+            self.deliver(ctx, block=True, count=1)
+        if is_nothing(self.executor) is True:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='background-val')
+
+        val_ctx = Context()
+        # the run settings are shared(a shallow copy), except the states of the training thread: the warmup, the
+        # loop control, the memory monitor and the callbacks
+        val_ctx.run.from_dict(ctx.run.__dict__)
+        val_ctx.run.warmup = NOTHING
+        val_ctx.run.control = LoopControl()
+        val_ctx.run.memory_monitor = NOTHING
+        val_ctx.run.callbacks = NOTHING
+        val_ctx.model = self.snapshot(ctx)
+        val_ctx.device = self.device if self.device is not None else ctx.device
+        val_ctx.epoch.from_dict({'total': ctx.epoch.total, 'current': ctx.epoch.current})
+        # the epoch state of the training epoch, restored when the epoch end handlers run
+        state = dict(ctx.epoch.__dict__)
+        future = self.executor.submit(self.validate, val_ctx, run)
+        self.jobs.append((state, val_ctx, deferred, future))
+
+    @staticmethod
+    def validate(val_ctx: Context, run: Callable[[Context], None]):
+        run(val_ctx)
+        if val_ctx.device is not None and is_nothing(val_ctx.device) is False and \
+                torch.device(val_ctx.device).type == 'cuda':
+            torch.cuda.synchronize(val_ctx.device)
+
+    def deliver(self, ctx: Context, block: bool = False, count: int = None):
+        """Run the epoch end handlers of the finished jobs in order. Wait for the jobs if ``block`` is True.
+        """
+        delivered = 0
+        while len(self.jobs) > 0 and (count is None or delivered < count):
+            state, val_ctx, deferred, future = self.jobs[0]
+            if block is False and future.done() is False:
+                break
+            self.jobs.popleft()
+            # exceptions of the validation are raised here
+            future.result()
+            self.snapshots.append(val_ctx.model)
+            delivered += 1
+            results = {'eval_loss': val_ctx.epoch.eval_loss, 'eval_metrics': val_ctx.epoch.eval_metrics}
+            if is_nothing(val_ctx.epoch.eval_metrics) is False:
+                logger.info('Validation of epoch {0}: {1}'.format(
+                    state.get('current', 0) + 1, ' '.join(val_ctx.status.get_avg_loss_and_metrics(val_ctx))
+                ))
+            current = ctx.epoch.__dict__
+            ctx.epoch.__dict__ = dict(state, **results)
+            try:
+                deferred(ctx)
+            finally:
+                ctx.epoch.__dict__ = current
+                ctx.epoch.from_dict(results)
+
+    def flush(self, ctx: Context):
+        self.deliver(ctx, block=True)
+
+    def attach(self, container):
+        """Move the validation handlers(from the 'val' status handler to the epoch end) of the epoch iteration
+        into a background validation handler, together with the epoch end handlers that run when the validation is
+        finished, and add a flush handler after the epoch iteration.
+        """
+        from . import handler
+
+        def strip(items):
+            for index in reversed(range(len(items))):
+                item = items[index]
+                if isinstance(item, (handler.DisplayHandler, handler.StepBeginHandler, handler.StepEndHandler)):
+                    # the progress output of the worker thread would mix with the training output, and the step
+                    # callbacks would run concurrently with the training ones
+                    del items[index]
+                elif isinstance(item, handler.MemoryHandler):
+                    # the memory monitor belongs to the training thread
+                    strip(item)
+                    items[index:index + 1] = list(item)
+                elif isinstance(item, handler.HandlerContainer):
+                    strip(item)
+
+        # reversed, so the inserted flush handlers do not shift the indexes
+        for index in reversed(range(len(container))):
+            item = container[index]
+            if isinstance(item, handler.EpochIterationHandler) is False:
+                if isinstance(item, handler.HandlerContainer) and \
+                        isinstance(item, handler.BackgroundValHandler) is False:
+                    self.attach(item)
+                continue
+            if any(isinstance(child, handler.BackgroundValHandler) for child in item):
+                continue
+            starts = [
+                i for i, child in enumerate(item)
+                if isinstance(child, handler.StatusHandler) and child.status == 'val'
+            ]
+            if len(starts) == 0:
+                continue
+            tail = list(item[starts[0]:])
+            deferred = [child for child in tail if isinstance(child, handler.EpochEndHandler)]
+            # the memory summary stays in the training thread
+            kept = [child for child in tail if isinstance(child, handler.MemorySummaryHandler)]
+            moved = set(id(child) for child in deferred + kept)
+            background = [child for child in tail if id(child) not in moved]
+            strip(background)
+            item[starts[0]:] = kept + [handler.BackgroundValHandler(background, deferred)]
+            container.insert(index + 1, handler.BackgroundFlushHandler())
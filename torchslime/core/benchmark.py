@@ -0,0 +1,163 @@
+"""
+Inference latency benchmark through the forward path of the predict pipeline.
+"""
+from typing import Any, Callable, Dict, List, Sequence, Union
+from ..util import NOTHING, is_nothing
+from ..util.memory import current_rss, peak_rss
+from ..log import logger
+from ..log import directory
+from .context import Context
+import torch
+import time
+import json
+
+# input spec: per-sample shape, a nested sequence or dict of shapes, or a function that builds the batch.
+INPUT_SPEC = Union[Sequence[int], Sequence[Any], Dict[str, Any], Callable[[int], Any]]
+
+
+def _is_shape(spec) -> bool:
+    return isinstance(spec, (list, tuple)) and all(isinstance(item, int) for item in spec)
+
+
+def build_input(spec, batch_size: int, dtype=None):
+    """Build a random input from the spec, with the batch dim prepended.
+    """
+    if _is_shape(spec):
+        return torch.randn(batch_size, *spec, dtype=dtype)
+    elif isinstance(spec, dict):
+        return {key: build_input(value, batch_size, dtype) for key, value in spec.items()}
+    elif isinstance(spec, (list, tuple)):
+        return type(spec)(build_input(item, batch_size, dtype) for item in spec)
+    return spec
+
+
+def build_batch(input_spec: INPUT_SPEC, batch_size: int):
+    """Build a batch as the DataLoader yields. A callable spec builds the whole batch, while the other specs build the
+    model input at index 0 of the batch, which the default IndexParser takes.
+    """
+    if callable(input_spec):
+        return input_spec(batch_size)
+    return (build_input(input_spec, batch_size),)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear interpolated percentile of sorted values.
+    """
+    if len(values) == 0:
+        return NOTHING
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RSSPeak:
+    """
+    Peak RSS of a benchmark config on CPU. The process peak RSS is a life-time high-water mark, so it is taken only
+    if the config raises it, otherwise the max RSS sampled after the forward passes of the config is used.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.baseline = current_rss()
+        self.process_peak = peak_rss()
+        self.peak = self.baseline
+
+    def sample(self):
+        rss = current_rss()
+        if is_nothing(rss) is False and (is_nothing(self.peak) is True or rss > self.peak):
+            self.peak = rss
+
+    def result(self):
+        peak = peak_rss()
+        if is_nothing(peak) is False and is_nothing(self.process_peak) is False and peak > self.process_peak:
+            return peak
+        return self.peak
+
+
+def benchmark_inference(
+    ctx: Context,
+    input_spec: INPUT_SPEC,
+    batch_sizes: Sequence[int] = (1,),
+    threads: Sequence[int] = None,
+    warmup: int = 10,
+    iterations: int = 100,
+    save: bool = True
+) -> List[Dict]:
+    """Run warmup and timed forward passes (ForwardHandler under no-grad with the predict status) for each batch size
+    and thread count, and report the latency percentiles, throughput and peak memory of each config. The peak memory
+    is the accelerator peak allocated memory, or the peak RSS of the config on CPU(see ``RSSPeak``), and
+    ``memory_delta`` is the growth of it over the memory before the config. Both are None if the memory cannot be
+    measured.
+    """
+    handler = ctx.handler
+    forward = handler.Forward()
+    # the model modes are restored after the benchmark
+    modes = [(module, module.training) for module in ctx.model.modules()]
+    handler.Status('predict')(ctx)
+    cuda = is_nothing(ctx.device) is False and ctx.device is not None and torch.device(ctx.device).type == 'cuda'
+    origin_threads = torch.get_num_threads()
+    threads = [origin_threads] if threads is None else threads
+    inference_mode = ctx.run.inference_mode is True
+
+    results = []
+    try:
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            for batch_size in batch_sizes:
+                ctx.step.batch = build_batch(input_spec, batch_size)
+                if cuda is True:
+                    torch.cuda.synchronize(ctx.device)
+                    baseline = torch.cuda.memory_allocated(ctx.device)
+                    torch.cuda.reset_peak_memory_stats(ctx.device)
+                else:
+                    rss = RSSPeak()
+                    baseline = rss.baseline
+                latencies = []
+                with torch.inference_mode() if inference_mode is True else torch.no_grad():
+                    for i in range(warmup + iterations):
+                        start = time.perf_counter()
+                        forward(ctx)
+                        if cuda is True:
+                            torch.cuda.synchronize(ctx.device)
+                        if i >= warmup:
+                            latencies.append(time.perf_counter() - start)
+                        if cuda is False:
+                            rss.sample()
+                peak_memory = torch.cuda.max_memory_allocated(ctx.device) if cuda is True else rss.result()
+                latencies.sort()
+                mean = sum(latencies) / len(latencies) if len(latencies) > 0 else NOTHING
+                results.append({
+                    'batch_size': batch_size,
+                    'threads': num_threads,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p90_ms': percentile(latencies, 90) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'mean_ms': mean * 1000,
+                    'throughput': batch_size / mean,
+                    # accelerator peak memory, or the peak RSS of the config on CPU(None if it cannot be measured,
+                    # so the results stay JSON serializable)
+                    'peak_memory': peak_memory if is_nothing(peak_memory) is False else None,
+                    'memory_delta': peak_memory - baseline if is_nothing(peak_memory) is False and \
+                        is_nothing(baseline) is False else None,
+                    'device': str(ctx.device)
+                })
+                logger.info(
+                    'batch_size: {batch_size} threads: {threads} p50: {p50_ms:.3f}ms p90: {p90_ms:.3f}ms '
+                    'p99: {p99_ms:.3f}ms throughput: {throughput:.1f}/s'.format(**results[-1])
+                )
+    finally:
+        torch.set_num_threads(origin_threads)
+        for module, training in modes:
+            module.training = training
+        # step data of the benchmark should not be left in the context
+        ctx.step.initialize()
+
+    if save is True:
+        if is_nothing(directory.NAMESPACE) is True:
+            logger.warn('The log namespace is not set, and the inference benchmark result is not saved.')
+        else:
+            directory.safe_makedirs(directory.get_namespace_path())
+            with open(directory.get_benchmark_path(), 'w') as f:
+                json.dump(results, f, indent=4)
+    return results
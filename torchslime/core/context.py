@@ -4,10 +4,20 @@ from torch import device
 from torch.optim.optimizer import Optimizer
 from torch.utils.data import DataLoader
 from ..util.type import NUMBER
-from typing import Any, Sequence, Union, Dict, Tuple
+from typing import Any, Sequence, Union, Dict, Tuple, TYPE_CHECKING
 from ..log import logger
 from abc import abstractmethod
 
+if TYPE_CHECKING:
+    # the optional components are imported by the Proxy builders(or the data providers) that create them
+    from .accumulate import OutputAccumulator
+    from .background import BackgroundValidator
+    from .featcache import FeatureCache
+    from .memory import MemoryMonitor
+    from .microbatch import MicroBatcher
+    from .warmup import LoaderWarmup
+    from ..data.importance import ImportanceSampler
+
 
 class Context(Base):
     """
@@ -90,8 +100,19 @@ class TempContext(Base):
 
 class StepContext(TempContext):
 
+    # step attributes that hold tensors(and possibly the autograd graph)
+    TENSOR_ATTRS = ('x', 'y_pred', 'y_true', 'loss', 'extra', 'batch', 'indices')
+
     def __init__(self):
         super().__init__()
+
+    def release(self, retain: Sequence[str] = ()):
+        """Release the references of the step tensors except the retained ones, so they can be freed before the next
+        batch is loaded.
+        """
+        for name in self.TENSOR_ATTRS:
+            if name not in retain:
+                self.__dict__[name] = NOTHING
     
     def initialize(self):
         """
@@ -111,14 +132,33 @@ class StepContext(TempContext):
         self.extra: Any = NOTHING
         # current iteration step
         self.current: int = NOTHING
-        # total steps of iteration
+        # total steps of iteration(NOTHING before the last step of streaming datasets)
         self.total: int = NOTHING
+        # estimated total steps of streaming datasets(0 if unknown)
+        self.total_hint: int = NOTHING
         # timestamp at the beginning of the step
         self.time: Union[int, float] = NOTHING
         # tuple of current step and total steps, it's used for progress visualization in the console
         self.progress: Tuple[int, int] = NOTHING
         # original batch data of the iteration of dataloader
         self.batch: Any = NOTHING
+        # dataset indices of the samples in the step(only when the batches are ``IndexedBatch``)
+        self.indices: Any = NOTHING
+        # number of samples in the step, used to weight the average loss and metrics
+        self.batch_size: int = NOTHING
+        # time blocked in fetching the batch of the step
+        self.data_time: float = NOTHING
+        # smoothed (exponential moving average) step time of the previous steps
+        self.step_time: float = NOTHING
+        # throughput of the previous steps in the iteration
+        self.samples_per_sec: float = NOTHING
+        self.steps_per_sec: float = NOTHING
+        # fraction of time blocked in fetching data in the iteration
+        self.data_wait: float = NOTHING
+        # loss weight of the current micro-batch(only when micro-batching is used)
+        self.micro_weight: float = NOTHING
+        # memory records of the phases in the step(only when the memory monitor is set)
+        self.memory: Dict = NOTHING
 
 
 class EpochContext(TempContext):
@@ -142,14 +182,38 @@ class EpochContext(TempContext):
         self.train_loss = NOTHING
         # average eval loss in one epoch
         self.eval_loss = NOTHING
+        # throughput summaries of the iterations in one epoch, with the status name as key
+        self.throughput: Dict = NOTHING
+        # memory peaks of the phases in one epoch(only when the memory monitor is set)
+        self.memory: Dict = NOTHING
+        # outputs(y_pred and y_true) accumulated in one epoch(only when the output accumulator is set)
+        self.outputs: Dict = NOTHING
 
 
 class RunContext(TempContext):
 
     def __init__(self):
         super().__init__()
+
+    def __getattr__(self, name):
+        # build the lazy attribute on first access
+        lazy = self.__dict__.get('_lazy', {})
+        if name in lazy:
+            lazy.pop(name)()
+            return self.__dict__.get(name, NOTHING)
+        return NOTHING
+
+    def lazy_build(self, **builders):
+        """Register builders of attributes, which are called when the attributes are accessed for the first time.
+        The builders should set the corresponding attributes.
+        """
+        for name, builder in builders.items():
+            self.__delattr__(name)
+            self._lazy[name] = builder
     
     def initialize(self):
+        # lazy attribute builders
+        self._lazy = {}
         # handler containers that define the process of training, evaluating and predicting.
         from .handler import HandlerContainer
         self.train: HandlerContainer = NOTHING
@@ -170,6 +234,9 @@ class RunContext(TempContext):
         from ..data import DataProvider
         self.train_provider: DataProvider = NOTHING
         self.eval_provider: DataProvider = NOTHING
+        # tensor transfer engine that moves batches to the device
+        from ..util.transfer import TensorTransfer
+        self.transfer: TensorTransfer = TensorTransfer()
         # data parser
         from ..data import DataParser, IndexParser
         # the data parser should be set to IndexParser as default
@@ -180,6 +247,29 @@ class RunContext(TempContext):
         # metric container
         from ..metric import MetricContainer
         self.metrics: MetricContainer = NOTHING
+        # metrics computed on the accumulated outputs at the end of the epoch
+        self.epoch_metrics: MetricContainer = NOTHING
+        # epoch output accumulator(optional)
+        self.accumulator: 'OutputAccumulator' = NOTHING
+        # micro-batcher that splits the batches in training(optional)
+        self.micro_batch: 'MicroBatcher' = NOTHING
+        # feature cache of the frozen submodule(optional)
+        self.feature_cache: 'FeatureCache' = NOTHING
+        # use torch.inference_mode instead of disabling grad in eval and predict
+        self.inference_mode: bool = False
+        # background validator that validates the weight snapshots in a worker thread(optional)
+        self.background_val: 'BackgroundValidator' = NOTHING
+        # importance sampler that weights the training loss and records the per-sample losses(optional)
+        self.importance: 'ImportanceSampler' = NOTHING
+        # warmup of the dataset iterator of the next phase(optional)
+        self.warmup: 'LoaderWarmup' = NOTHING
+        # loop control signals that stop the iteration or the run
+        from .control import LoopControl
+        self.control: LoopControl = LoopControl()
+        # release the step tensors at the end of each step
+        self.release_step: bool = True
+        # memory monitor(optional)
+        self.memory_monitor: 'MemoryMonitor' = NOTHING
 
 
 class HandlerContext(TempContext):
@@ -200,6 +290,10 @@ class HandlerContext(TempContext):
         self.Optimizer = handler.OptimizerHandler
         self.Metrics = handler.MetricsHandler
         self.Average = handler.AverageHandler
+        self.Accumulate = handler.AccumulateHandler
+        self.MicroBatch = handler.MicroBatchHandler
+        self.BackgroundVal = handler.BackgroundValHandler
+        self.BackgroundFlush = handler.BackgroundFlushHandler
         self.Display = handler.DisplayHandler
         self.Dataset = handler.DatasetHandler
         self.Status = handler.StatusHandler
@@ -210,6 +304,8 @@ class HandlerContext(TempContext):
         self.StepEnd = handler.StepEndHandler
         self.EpochBegin = handler.EpochBeginHandler
         self.EpochEnd = handler.EpochEndHandler
+        self.Memory = handler.MemoryHandler
+        self.MemorySummary = handler.MemorySummaryHandler
 
 
 class CustomContext(TempContext):
@@ -0,0 +1,46 @@
+"""
+Control signals that stop the step and epoch loops, set by callbacks or handlers.
+"""
+from ..log import logger
+
+
+class LoopControl:
+    """
+    Loop control signals, which are checked by the iteration handlers after each step and by the epoch iteration
+    handler after each epoch. The remaining handlers of the epoch(e.g., validation and the epoch end callbacks) and
+    the end callbacks still run, so a stopped run ends cleanly.
+
+    The signals should be set in the training thread, i.e., by synchronous callbacks or handlers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        # stop the current iteration after the current step
+        self.iteration_stop = False
+        # stop the epoch loop after the current epoch
+        self.run_stop = False
+        self.reason = ''
+
+    def stop_epoch(self, reason: str = ''):
+        """Stop the current iteration(the current phase of the epoch) after the current step.
+        """
+        self.iteration_stop = True
+        self.reason = reason
+        logger.info('Stop epoch: {0}'.format(reason) if reason else 'Stop epoch.')
+
+    def stop_run(self, reason: str = ''):
+        """Stop the current iteration after the current step, and the run after the current epoch.
+        """
+        self.iteration_stop = True
+        self.run_stop = True
+        self.reason = reason
+        logger.info('Stop run: {0}'.format(reason) if reason else 'Stop run.')
+
+    def consume_iteration_stop(self) -> bool:
+        """Return whether the iteration should stop, and clear the signal.
+        """
+        stop, self.iteration_stop = self.iteration_stop, False
+        return stop
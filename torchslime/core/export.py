@@ -0,0 +1,123 @@
+"""
+Export the model to TorchScript or ONNX for the lightweight predict runtime (``torchslime.runtime``).
+"""
+from typing import Dict
+from ..data import IndexParser
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from ..runtime import PredictEngine, flatten_input, meta_path
+from .context import Context
+from torch import Tensor
+from torch.nn import Module
+import torch
+import json
+
+EXPORT_FORMATS = ['torchscript', 'onnx']
+
+
+class PackedInput(Module):
+    """
+    Take the flattened graph inputs as positional arguments, and call the model with the input structure that the
+    data parser gives, i.e., a single tensor or a tuple.
+    """
+
+    def __init__(self, model: Module, packed: bool):
+        super().__init__()
+        self.model = model
+        self.packed = packed
+
+    def forward(self, *inputs):
+        return self.model(tuple(inputs) if self.packed else inputs[0])
+
+
+def _max_abs_diff(expected, actual) -> float:
+    if isinstance(expected, Tensor):
+        return float((expected.float() - actual.float()).abs().max()) if expected.numel() > 0 else 0.0
+    elif isinstance(expected, (list, tuple)):
+        return max([_max_abs_diff(item, other) for item, other in zip(expected, actual)], default=0.0)
+    elif isinstance(expected, dict):
+        return max([_max_abs_diff(value, actual[key]) for key, value in expected.items()], default=0.0)
+    return 0.0
+
+
+def export(
+    ctx: Context,
+    path: str,
+    example_batch,
+    format: str = 'torchscript',
+    method: str = 'trace',
+    opset_version: int = None,
+    check: bool = True,
+    tolerance: float = 1e-4
+) -> Dict:
+    """Export the model with the example batch, write the metadata that the runtime needs, and check the parity of
+    the exported model with the eager model.
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError('Unsupported export format: {0}, which should be one of {1}.'.format(format, EXPORT_FORMATS))
+    ctx.ctx_check(['model', 'run.data_parser', 'run.transfer'], silent=False)
+    # take the model input in the same way as ForwardHandler
+    ctx.step.batch = example_batch
+    try:
+        x, _, _ = ctx.run.data_parser(ctx)
+    finally:
+        ctx.step.initialize()
+    x = ctx.run.transfer(x, ctx.device)
+    inputs = tuple(flatten_input(x))
+    model = PackedInput(ctx.model, isinstance(x, (list, tuple))).eval()
+
+    with torch.no_grad():
+        if format == 'torchscript':
+            if method == 'script' and model.packed is True:
+                logger.warn('Scripting does not support the packed model input, and tracing is used instead.')
+                method = 'trace'
+            if method == 'script':
+                # the single input is passed to the model as it is
+                graph = torch.jit.script(ctx.model.eval())
+            else:
+                graph = torch.jit.trace(model, inputs, check_trace=False)
+            torch.jit.save(torch.jit.freeze(graph), path)
+        else:
+            names = ['input_{0}'.format(i) for i in range(len(inputs))]
+            torch.onnx.export(
+                model, inputs, path,
+                input_names=names,
+                # the batch dim is dynamic
+                dynamic_axes={name: {0: 'batch'} for name in names},
+                opset_version=opset_version,
+                dynamo=False
+            )
+
+    parser = ctx.run.data_parser
+    meta = {
+        'format': format,
+        # IndexParser indexes of the model input, or None for custom DataParsers
+        'x': parser.x if isinstance(parser, IndexParser) else None,
+        'inputs': len(inputs),
+        'dtype': str(ctx.run.transfer.dtype).replace('torch.', '') if ctx.run.transfer.dtype is not None else None,
+        'channels_last': ctx.run.transfer.memory_format is torch.channels_last,
+        'torch_version': torch.__version__
+    }
+    with open(meta_path(path), 'w') as f:
+        json.dump(meta, f, indent=4)
+    logger.info('The model is exported to {0} ({1}).'.format(path, format))
+
+    report = {'path': path, 'format': format, 'max_abs_diff': NOTHING, 'parity': NOTHING}
+    if check is True:
+        try:
+            # the engine is called with the model input directly, so the parser is not used
+            engine = PredictEngine(
+                path, str(ctx.device) if is_nothing(ctx.device) is False else 'cpu', parser=lambda batch: batch
+            )
+        except ImportError as e:
+            logger.warn('{0} The parity check is skipped.'.format(str(e)))
+            return report
+        with torch.no_grad():
+            expected = ctx.model.eval()(x)
+        report['max_abs_diff'] = _max_abs_diff(expected, engine(x))
+        report['parity'] = report['max_abs_diff'] <= tolerance
+        if report['parity'] is True:
+            logger.info('Parity check passed, max abs diff: {0:.3g}.'.format(report['max_abs_diff']))
+        else:
+            logger.warn('Parity check failed, max abs diff: {0:.3g} > {1:.3g}.'.format(report['max_abs_diff'], tolerance))
+    return report
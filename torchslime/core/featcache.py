@@ -0,0 +1,365 @@
+"""
+Feature cache of a frozen submodule(e.g., the backbone in fine-tuning), whose outputs are recorded per sample on the
+first pass and fed to the rest of the model in later epochs, so the frozen forward is not recomputed.
+"""
+from typing import Any, Callable, Dict, Union
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from .context import Context
+from torch import Tensor
+from torch.nn import Module
+import torch
+import numpy as np
+import tempfile
+import shutil
+import os
+
+
+def _map(func: Callable[[Tensor], Any], obj):
+    """Apply the function to the tensors in a (nested) list, tuple or dict, keeping the container types.
+    """
+    if isinstance(obj, Tensor):
+        return func(obj)
+    elif isinstance(obj, dict):
+        return {key: _map(func, value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_map(func, item) for item in obj)
+    raise ValueError('The outputs of the cached module should be tensors, or lists, tuples and dicts of tensors, '
+                     'but got {0}.'.format(type(obj).__name__))
+
+
+def _zip(func: Callable[[Tensor, Tensor], Any], buffers, obj):
+    if isinstance(buffers, Tensor):
+        return func(buffers, obj)
+    elif isinstance(buffers, dict):
+        return {key: _zip(func, value, obj[key]) for key, value in buffers.items()}
+    return type(buffers)(_zip(func, value, item) for value, item in zip(buffers, obj))
+
+
+def _tensors(obj):
+    if isinstance(obj, Tensor):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from _tensors(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            yield from _tensors(item)
+
+
+def input_fingerprint(x, batch_size: int) -> Tensor:
+    """Per-sample fingerprints of the inputs: the plain and the position-weighted sums of each tensor, so random
+    crops, flips and noise change the fingerprints. Return NOTHING if the inputs have no batched tensor.
+    """
+    prints = []
+    for tensor in _tensors(x):
+        if tensor.dim() == 0 or tensor.shape[0] != batch_size or tensor.numel() == 0:
+            continue
+        flat = tensor.detach().reshape(batch_size, -1).double()
+        position = torch.linspace(1, 2, flat.shape[1], dtype=flat.dtype, device=flat.device)
+        prints.append(torch.stack([flat.sum(dim=1), (flat * position).sum(dim=1)], dim=1))
+    return torch.cat(prints, dim=1).cpu() if len(prints) > 0 else NOTHING
+
+
+class FeatureStore:
+    """
+    Per-sample features of a phase, indexed by the dataset indices. The buffers are allocated in RAM, or all of them
+    as memmap files when their estimated size(from the first batch and the dataset length) exceeds the memory budget.
+    """
+
+    def __init__(self, memory_budget: int = None, spill_dir: str = None, dtype=None):
+        super().__init__()
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.dtype = dtype
+        self.buffers = NOTHING
+        # the original dtypes of the outputs, which the features are cast back to
+        self.dtypes = NOTHING
+        self.filled: Tensor = NOTHING
+        self.fingerprints: Tensor = NOTHING
+        self.capacity = 0
+        # the weights(version key and checksum) the features are computed with
+        self.version = NOTHING
+        self.checksum = NOTHING
+        # disabled when the inputs of the phase are found to be stochastic
+        self.disabled = False
+        self._spill_path = NOTHING
+
+    def contains(self, indices: Tensor) -> bool:
+        if is_nothing(self.filled) is True or len(indices) == 0 or int(indices.max()) >= self.capacity:
+            return False
+        return bool(self.filled[indices].all())
+
+    def get(self, indices: Tensor):
+        return _zip(lambda buffer, dtype: buffer[indices].to(dtype), self.buffers, self.dtypes)
+
+    def put(self, indices: Tensor, outputs, fingerprints: Tensor, total: int):
+        if is_nothing(self.dtypes) is True:
+            self.dtypes = _map(lambda tensor: tensor.dtype, outputs)
+        outputs = _map(lambda tensor: tensor.detach().to(
+            device='cpu', dtype=self.dtype if self.dtype is not None and tensor.is_floating_point() else None
+        ), outputs)
+        required = int(indices.max()) + 1
+        if is_nothing(self.buffers) is True:
+            self.allocate(outputs, max(total, required))
+        elif required > self.capacity:
+            # the dataset length is unknown
+            self.grow(max(self.capacity * 2, required))
+        _zip(lambda buffer, tensor: buffer.index_copy_(0, indices, tensor.to(buffer.dtype)), self.buffers, outputs)
+        if is_nothing(fingerprints) is False:
+            if self.fingerprints.shape[1] != fingerprints.shape[1]:
+                self.fingerprints = torch.zeros(self.capacity, fingerprints.shape[1], dtype=torch.float64)
+            self.fingerprints[indices] = fingerprints
+        self.filled[indices] = True
+
+    def matches(self, indices: Tensor, fingerprints: Tensor) -> bool:
+        if is_nothing(fingerprints) is True:
+            return True
+        if self.fingerprints.shape[1] != fingerprints.shape[1]:
+            return False
+        return torch.allclose(self.fingerprints[indices], fingerprints, rtol=1e-5, atol=1e-6)
+
+    def allocate(self, outputs, total: int):
+        nbytes = sum(total * tensor[0:1].nelement() * tensor.element_size() for tensor in _tensors(outputs))
+        spill = self.memory_budget is not None and nbytes > self.memory_budget
+        if spill is True:
+            logger.info('The feature cache ({0:.1f}MB) exceeds the memory budget, and memmap files are used.'.format(
+                nbytes / 2 ** 20
+            ))
+        self.buffers = _map(lambda tensor: self.empty(tensor, total, spill), outputs)
+        self.filled = torch.zeros(total, dtype=torch.bool)
+        self.fingerprints = torch.zeros(total, 0, dtype=torch.float64)
+        self.capacity = total
+
+    def grow(self, total: int):
+        spill = is_nothing(self._spill_path) is False
+        count = self.capacity
+
+        def grow_buffer(buffer: Tensor):
+            result = self.empty(buffer, total, spill)
+            result[:count].copy_(buffer[:count])
+            return result
+        self.buffers = _map(grow_buffer, self.buffers)
+        self.filled = torch.cat([self.filled, torch.zeros(total - count, dtype=torch.bool)])
+        self.fingerprints = torch.cat([
+            self.fingerprints, self.fingerprints.new_zeros(total - count, self.fingerprints.shape[1])
+        ])
+        self.capacity = total
+
+    def empty(self, tensor: Tensor, total: int, spill: bool) -> Tensor:
+        shape = (total, *tensor.shape[1:])
+        if spill is False:
+            return torch.empty(shape, dtype=tensor.dtype)
+        try:
+            np_dtype = torch.empty(0, dtype=tensor.dtype).numpy().dtype
+        except TypeError:
+            # dtypes that numpy does not support(e.g., bfloat16) are stored as float32
+            np_dtype = np.float32
+        if is_nothing(self._spill_path) is True:
+            self._spill_path = tempfile.mkdtemp(prefix='torchslime_features_', dir=self.spill_dir)
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self._spill_path)
+        os.close(fd)
+        return torch.from_numpy(np.lib.format.open_memmap(path, mode='w+', dtype=np_dtype, shape=shape))
+
+    def clear(self):
+        self.buffers = NOTHING
+        self.dtypes = NOTHING
+        self.filled = NOTHING
+        self.fingerprints = NOTHING
+        self.capacity = 0
+        self.version = NOTHING
+        self.checksum = NOTHING
+        if is_nothing(self._spill_path) is False:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = NOTHING
+
+    def __del__(self):
+        self.clear()
+
+
+class FeatureCache:
+    """
+    Cache the outputs of a frozen submodule per sample. On a batch whose samples are all cached, the forward of the
+    submodule is replaced by the cached features, and the rest of the model runs as usual. Each phase(train, val,
+    eval and predict) has its own store.
+
+    The batches should carry the dataset indices(``IndexedBatch``, e.g., from ``IndexedDataset`` with
+    ``IndexedCollate``, or ``ImportanceProvider``), otherwise the model runs without the cache. The cache is
+    bypassed when:
+
+    * the submodule has parameters that require grad in training(it is not frozen).
+    * the inputs of the same samples change between epochs(checked by per-sample fingerprints, e.g., random
+      augmentation), unless ``augmented`` is True, with which the features of the first pass are reused.
+
+    The features are recomputed when the weights or buffers of the submodule change.
+
+    Args:
+        module (Union[str, Module]): the frozen submodule, or its name in the model.
+        memory_budget (int, optional): max bytes of the features of a phase in RAM. If the estimated size of a phase
+            exceeds it, all the features of the phase are stored in memmap files. Defaults to None(no limit).
+        spill_dir (str, optional): directory of the memmap files. Defaults to a temp directory.
+        dtype (optional): storage dtype of the floating point features, e.g., ``torch.float16``. The features are cast
+            back to the output dtypes of the submodule when they are fed to the model. Defaults to None(unchanged).
+        augmented (bool, optional): reuse the cached features even if the inputs change between epochs.
+            Defaults to False.
+        eval_mode (bool, optional): run the submodule in eval mode when the features are computed(fixed batch norm
+            statistics and no dropout), which a frozen submodule usually needs. If False, the cache is bypassed while
+            the submodule is in training mode. Defaults to True.
+    """
+
+    def __init__(
+        self,
+        module: Union[str, Module],
+        memory_budget: int = None,
+        spill_dir: str = None,
+        dtype=None,
+        augmented: bool = False,
+        eval_mode: bool = True
+    ):
+        super().__init__()
+        self.module = module
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.dtype = dtype
+        self.augmented = augmented
+        self.eval_mode = eval_mode
+        # phase name -> FeatureStore
+        self.stores: Dict[str, FeatureStore] = {}
+        # cache hits and misses(in batches)
+        self.hits = 0
+        self.misses = 0
+        self._warned = set()
+
+    def resolve(self, model: Module) -> Module:
+        """Get the submodule of the model. A given module is resolved to its name on the first call, so the model
+        copies(e.g., the snapshots of the background validation) get their own submodules.
+        """
+        if isinstance(self.module, Module):
+            names = [name for name, module in model.named_modules() if module is self.module]
+            if len(names) == 0:
+                raise ValueError('The cached module is not a submodule of the model.')
+            self.module = names[0]
+        return model.get_submodule(self.module)
+
+    def warn_once(self, key: str, message: str):
+        if key not in self._warned:
+            self._warned.add(key)
+            logger.warn(message)
+
+    def forward(self, ctx: Context, x):
+        """Run the model with the cached features of the submodule if possible.
+        """
+        indices = ctx.step.indices
+        module = self.resolve(ctx.model)
+        phase = str(ctx.status)
+        if is_nothing(indices) is True:
+            self.warn_once('indices', 'The batches have no sample indices(IndexedBatch), and the feature cache is '
+                                      'not used.')
+            return ctx.model(x)
+        if torch.is_grad_enabled() and any(param.requires_grad for param in module.parameters()):
+            self.warn_once('grad', 'The cached module has parameters that require grad, and the feature cache is '
+                                   'not used in training.')
+            return ctx.model(x)
+        if self.eval_mode is False and module.training is True:
+            return ctx.model(x)
+
+        store = self.stores.setdefault(phase, FeatureStore(self.memory_budget, self.spill_dir, self.dtype))
+        if store.disabled is True:
+            return ctx.model(x)
+        self.check_version(module, store, phase)
+        indices = indices.cpu()
+        fingerprints = input_fingerprint(x, len(indices)) if self.augmented is False else NOTHING
+        if store.contains(indices) is True:
+            if store.matches(indices, fingerprints) is True:
+                self.hits += 1
+                features = ctx.run.transfer(store.get(indices), ctx.device)
+                # the forward of the submodule is replaced with the cached features(an instance attribute)
+                module.forward = lambda *args, **kwargs: features
+                try:
+                    return ctx.model(x)
+                finally:
+                    del module.forward
+            store.disabled = True
+            store.clear()
+            logger.warn('The inputs of the same samples change between epochs in phase {0}(e.g., random '
+                        'augmentation), and the feature cache is disabled. Set augmented=True to reuse the features of '
+                        'the first pass.'.format(phase))
+            return ctx.model(x)
+
+        self.misses += 1
+        outputs = []
+        handle = module.register_forward_hook(lambda _, __, output: outputs.append(output))
+        modes = [(item, item.training) for item in module.modules()] if module.training is True else []
+        if len(modes) > 0:
+            module.eval()
+        try:
+            y_pred = ctx.model(x)
+        finally:
+            handle.remove()
+            for item, training in modes:
+                item.training = training
+        if len(outputs) != 1:
+            store.disabled = True
+            self.warn_once('calls', 'The cached module is called {0} times in a forward, and the feature cache is '
+                                    'disabled.'.format(len(outputs)))
+            return y_pred
+        store.put(indices, outputs[0], fingerprints, self.estimate_total(ctx))
+        return y_pred
+
+    def check_version(self, module: Module, store: FeatureStore, phase: str):
+        """Clear the store if the weights or buffers of the submodule change. The cheap version key(in-place
+        modification counters and storages) is checked first, and the checksum confirms the change, so reloading
+        the same weights(e.g., into the snapshots of the background validation) keeps the features.
+        """
+        version = self.version_key(module)
+        if version == store.version:
+            return
+        checksum = self.checksum(module)
+        if is_nothing(store.checksum) is False and (
+            len(checksum) != len(store.checksum) or torch.equal(checksum, store.checksum) is False
+        ):
+            logger.info('The weights of the cached module change, and the feature cache of phase {0} is '
+                        'cleared.'.format(phase))
+            store.clear()
+        store.version = version
+        store.checksum = checksum
+
+    @staticmethod
+    def version_key(module: Module):
+        key = []
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            try:
+                key.append((tensor.data_ptr(), tensor._version))
+            except RuntimeError:
+                # inference tensors have no version counter
+                key.append((tensor.data_ptr(), 0))
+        return tuple(key)
+
+    @staticmethod
+    def checksum(module: Module) -> Tensor:
+        tensors = [tensor.detach() for tensor in list(module.parameters()) + list(module.buffers())]
+        if len(tensors) == 0:
+            return torch.zeros(0, dtype=torch.float64)
+        return torch.stack([tensor.double().sum() for tensor in tensors]).cpu()
+
+    @staticmethod
+    def estimate_total(ctx: Context) -> int:
+        try:
+            # number of samples of the map-style dataset
+            return len(ctx.dataset.dataset)
+        except Exception:
+            return 0
+
+    def clear(self):
+        for store in self.stores.values():
+            store.clear()
+        self.stores = {}
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'samples': {phase: int(store.filled.sum()) if is_nothing(store.filled) is False else 0
+                        for phase, store in self.stores.items()}
+        }
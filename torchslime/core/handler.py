@@ -1,11 +1,13 @@
 from abc import abstractmethod
 from typing import Dict, Sequence, Union
-from ..util import BaseList, IterTool, NOTHING, is_nothing, safe_divide, type_cast, InvocationDebug, SmartWrapper
+from ..util import BaseList, IterTool, NOTHING, is_nothing, safe_divide, InvocationDebug, SmartWrapper, \
+    get_batch_size, detach
 import torchslime.util.terminal as Cursor
-from ..util.formatter import progress_format, eta_format
+from ..util.formatter import progress_format, eta_format, period_time_format
 from .context import Context
 from ..log import logger
-from torch import set_grad_enabled
+from torch import set_grad_enabled, inference_mode, is_grad_enabled
+from time import time
 
 
 def TorchGrad(func):
@@ -15,8 +17,15 @@ def TorchGrad(func):
     @SmartWrapper(func)
     def grad_switch(self, ctx: Context):
         # only when context status is in ['TRAIN'] is the grad enabled
-        with set_grad_enabled(str(ctx.status) in ['TRAIN']):
-            func(self, ctx)
+        train = str(ctx.status) in ['TRAIN']
+        # inference mode(no version counter and view tracking) for eval and predict if it is set, but not for the
+        # validation during training
+        if train is False and str(ctx.status) != 'VAL' and ctx.run.inference_mode is True:
+            with inference_mode():
+                func(self, ctx)
+        else:
+            with set_grad_enabled(train):
+                func(self, ctx)
     return grad_switch
 
 
@@ -34,6 +43,12 @@ class Handler:
     def __call__(self, ctx: Context):
         self.handle(ctx)
 
+    def prunable(self, ctx: Context) -> bool:
+        """Whether the handler does nothing in the current run, so it can be dropped from the compiled step
+        handlers.
+        """
+        return False
+
 
 class EmptyHandler(Handler):
     """Empty handler that does nothing when called.
@@ -65,6 +80,11 @@ class HandlerContainer(Handler, BaseList):
         for handler in self:
             handler(ctx)
 
+    def compile(self, ctx: Context) -> Sequence[Handler]:
+        """Get the handlers that are not prunable in the current run.
+        """
+        return [handler for handler in self if handler.prunable(ctx) is False]
+
 
 class EpochIterationHandler(HandlerContainer):
 
@@ -75,6 +95,9 @@ class EpochIterationHandler(HandlerContainer):
     def handle(self, ctx: Context):
         # context check
         ctx.ctx_check('epoch.total', silent=False)
+        control = ctx.run.control
+        if is_nothing(control) is False:
+            control.reset()
         # epoch loops
         for current in range(ctx.epoch.total):
             # set current epoch to the context
@@ -82,10 +105,54 @@ class EpochIterationHandler(HandlerContainer):
             # output epoch info. TODO: change logger operation to a handler?
             logger.log('Epoch %d' % (ctx.epoch.current + 1))
             super().handle(ctx)
+            # stopped by callbacks or handlers
+            if is_nothing(control) is False and control.run_stop is True:
+                break
+
+
+class IterationMeter:
+    """
+    Measure the time blocked in fetching data and the time spent in the handlers of each step, and compute the
+    throughput and the smoothed step time.
+    """
+
+    def __init__(self, smoothing: float = 0.1):
+        super().__init__()
+        # weight of the latest step in the exponential moving average
+        self.smoothing = smoothing
+        self.steps = 0
+        self.samples = 0
+        self.data_time = 0.
+        self.compute_time = 0.
+        self.step_time = NOTHING
+
+    def update(self, data_time: float, compute_time: float, samples):
+        self.steps += 1
+        self.samples += samples if is_nothing(samples) is False else 0
+        self.data_time += data_time
+        self.compute_time += compute_time
+        step_time = data_time + compute_time
+        self.step_time = step_time if is_nothing(self.step_time) else \
+            self.smoothing * step_time + (1 - self.smoothing) * self.step_time
+
+    def summary(self) -> Dict:
+        total_time = self.data_time + self.compute_time
+        return {
+            'steps': self.steps,
+            'samples': self.samples,
+            'time': total_time,
+            'samples_per_sec': safe_divide(self.samples, total_time),
+            'steps_per_sec': safe_divide(self.steps, total_time),
+            'data_wait': safe_divide(self.data_time, total_time),
+            'step_time': self.step_time
+        }
 
 
 class IterationHandler(HandlerContainer):
 
+    # data wait fraction above which the iteration is reported as input-bound
+    INPUT_BOUND = 0.5
+
     def __init__(self, handlers: C_SEQ = None):
         super().__init__(handlers)
 
@@ -94,16 +161,88 @@ class IterationHandler(HandlerContainer):
     def handle(self, ctx: Context):
         # context check
         if ctx.ctx_check('dataset') is True:
-            for batch, progress, time, current, total in IterTool(ctx.dataset, True, True, True, True):
+            meter = IterationMeter()
+            tool = IterTool(ctx.dataset, True, True, True, True)
+            iterator = iter(tool)
+            # the total steps of streams are unknown, so one batch is looked ahead to find the last step
+            sized = is_nothing(tool.length()) is False
+            ctx.step.total_hint = tool.length_hint() if sized is False else NOTHING
+            warmup = ctx.ctx_check('run.warmup')
+            # the step handlers of this run, compiled once per iteration
+            handlers = self.compile(ctx)
+            control = ctx.run.control
+            fetch_time = time()
+            # the iteration may be stopped before the first step(e.g., in the epoch begin callbacks)
+            stopped = is_nothing(control) is False and control.consume_iteration_stop() is True
+            pending = self.fetch(iterator) if stopped is False else None
+            while pending is not None:
+                batch, progress, step_time, current, total = pending
+                pending = None
+                if sized is False:
+                    pending = self.fetch(iterator)
+                    step_time = time()
+                    total = current + 1 if pending is None else NOTHING
+                    progress = (current, total)
                 ctx.step.from_dict({
                     'batch': batch, # original batch data of the dataset
                     'progress': progress, # progress of iteration(includes current step and total steps)
-                    'time': time, # time of the iter(current time)
+                    'time': step_time, # time of the iter(current time)
                     'current': current, # the current step
-                    'total': total # total steps of iteration
+                    'total': total, # total steps of iteration(NOTHING before the last step of streams)
+                    'data_time': step_time - fetch_time # time blocked in fetching the batch
                 })
+                # warm up the dataset iterator of the next phase in the tail of this phase
+                if warmup is True and is_nothing(total) is False and total - current <= ctx.run.warmup.steps:
+                    ctx.run.warmup.prepare(ctx)
                 # carry out the subsequent actions
-                super().handle(ctx)
+                for handler in handlers:
+                    handler(ctx)
+                # update throughput information
+                batch_size = ctx.step.batch_size if is_nothing(ctx.step.batch_size) is False else get_batch_size(batch)
+                meter.update(step_time - fetch_time, time() - step_time, batch_size)
+                # release the step tensors before the next batch is loaded
+                if ctx.run.release_step is True:
+                    del batch
+                    ctx.step.release(ctx.run.callbacks.retain_step if ctx.ctx_check('run.callbacks') else ())
+                summary = meter.summary()
+                ctx.step.from_dict({
+                    'step_time': summary['step_time'], # smoothed step time
+                    'samples_per_sec': summary['samples_per_sec'],
+                    'steps_per_sec': summary['steps_per_sec'],
+                    'data_wait': summary['data_wait'] # fraction of time blocked in fetching data
+                })
+                # stopped by callbacks or handlers
+                if is_nothing(control) is False and control.iteration_stop is True:
+                    break
+                fetch_time = time()
+                if sized is True:
+                    pending = self.fetch(iterator)
+            # the signal only applies to this iteration, even if it is set at the last step
+            if is_nothing(control) is False:
+                control.consume_iteration_stop()
+            self.report(ctx, meter)
+
+    @staticmethod
+    def fetch(iterator):
+        try:
+            return next(iterator)
+        except StopIteration:
+            return None
+
+    def report(self, ctx: Context, meter: IterationMeter):
+        if meter.steps == 0:
+            return
+        summary = meter.summary()
+        if is_nothing(ctx.epoch.throughput) is True:
+            ctx.epoch.throughput = {}
+        ctx.epoch.throughput[str(ctx.status)] = summary
+        msg = '{0} throughput: {1:.1f} samples/s, {2:.2f} steps/s, data wait: {3:.1f}%'.format(
+            str(ctx.status), summary['samples_per_sec'], summary['steps_per_sec'], summary['data_wait'] * 100
+        )
+        if summary['data_wait'] > self.INPUT_BOUND:
+            logger.warn(msg + ' (input-bound)')
+        else:
+            logger.info(msg)
 
 
 class ForwardHandler(Handler):
@@ -118,19 +257,29 @@ class ForwardHandler(Handler):
             'model',
             'device',
             'run.data_parser',
+            'run.transfer',
             'step'
         ], silent=False)
         # forward
         x, y_true, extra = ctx.run.data_parser(ctx)
-        y_pred = ctx.model(type_cast(x, ctx.device))
-        y_true = type_cast(y_true, ctx.device)
+        x = ctx.run.transfer(x, ctx.device)
+        if ctx.ctx_check('run.feature_cache') is True:
+            # the outputs of the frozen submodule are taken from(or recorded to) the feature cache
+            y_pred = ctx.run.feature_cache.forward(ctx, x)
+        else:
+            y_pred = ctx.model(x)
+        y_true = ctx.run.transfer(y_true, ctx.device)
+        # number of samples, inferred from the label first and then the input
+        batch_size = get_batch_size(y_true)
+        batch_size = get_batch_size(x) if is_nothing(batch_size) else batch_size
         # clone and update context info
         ctx.step.from_dict({
             # the result of the forward progress
             'x': x,
             'y_true': y_true,
             'y_pred': y_pred,
-            'extra': extra
+            'extra': extra,
+            'batch_size': batch_size
         })
 
 
@@ -144,7 +293,14 @@ class LossHandler(Handler):
         # context check
         if ctx.ctx_check('run.loss') is True:
             # compute loss
-            loss = ctx.run.loss(ctx.step.y_pred, ctx.step.y_true)
+            if is_nothing(ctx.step.indices) is False and ctx.ctx_check('run.importance') is True and \
+                    is_grad_enabled() is True:
+                # importance-weighted training loss, and the per-sample losses are recorded for the next sampling
+                loss = ctx.run.importance.weighted_loss(
+                    ctx.run.loss, ctx.step.y_pred, ctx.step.y_true, ctx.step.indices
+                )
+            else:
+                loss = ctx.run.loss(ctx.step.y_pred, ctx.step.y_true)
             ctx.step.loss = loss
 
 
@@ -157,10 +313,16 @@ class BackwardHandler(Handler):
     def handle(self, ctx: Context):
         # context check
         if ctx.ctx_check(['step.loss']) is True:
-            last = ctx.step.total % ctx.run.grad_acc
-            grad_acc = ctx.run.grad_acc if (ctx.step.total - ctx.step.current - 1) >= last else last
+            if is_nothing(ctx.step.total) is False:
+                last = ctx.step.total % ctx.run.grad_acc
+                grad_acc = ctx.run.grad_acc if (ctx.step.total - ctx.step.current - 1) >= last else last
+            else:
+                # the total steps of streams are unknown before the last step
+                grad_acc = ctx.run.grad_acc
+            # weight of the micro-batch(by sample count) if micro-batching is used
+            weight = ctx.step.micro_weight if is_nothing(ctx.step.micro_weight) is False else 1
             # backward
-            (ctx.step.loss / grad_acc).backward()
+            (ctx.step.loss * weight / grad_acc).backward()
 
 
 class OptimizerHandler(HandlerContainer):
@@ -175,7 +337,101 @@ class OptimizerHandler(HandlerContainer):
         if ctx.ctx_check(['run.optimizer']) is True and \
             ((ctx.step.current + 1) % ctx.run.grad_acc == 0 or ctx.step.current + 1 == ctx.step.total):
             ctx.run.optimizer.step()
-            ctx.run.optimizer.zero_grad()
+            # set the gradients to None instead of filling zeros, which saves memory and a kernel launch
+            ctx.run.optimizer.zero_grad(set_to_none=True)
+        # the graph has been consumed by backward, so the step outputs are detached to release it
+        ctx.step.loss = detach(ctx.step.loss)
+        ctx.step.y_pred = detach(ctx.step.y_pred)
+
+
+class MicroBatchHandler(HandlerContainer):
+    """
+    Run the wrapped handlers(forward, loss and backward) on the micro-batches of the step through the micro-batcher.
+    """
+
+    def __init__(self, handlers: C_SEQ = None):
+        super().__init__(handlers)
+
+    @InvocationDebug('MicroBatchHandler')
+    def handle(self, ctx: Context):
+        # micro-batching only applies when the gradients are computed
+        if ctx.ctx_check('run.micro_batch') is False or is_grad_enabled() is False:
+            super().handle(ctx)
+            return
+        ctx.run.micro_batch.run(ctx, super().handle)
+
+
+class BackgroundValHandler(HandlerContainer):
+    """
+    Run the wrapped validation handlers on a model snapshot through the background validator, and the deferred
+    epoch end handlers when the validation is finished.
+    """
+
+    def __init__(self, handlers: C_SEQ = None, deferred: C_SEQ = None):
+        super().__init__(handlers)
+        self.deferred = HandlerContainer(deferred)
+
+    @InvocationDebug('BackgroundValHandler')
+    def handle(self, ctx: Context):
+        if ctx.ctx_check('run.background_val') is False:
+            super().handle(ctx)
+            self.deferred(ctx)
+            return
+        if ctx.ctx_check('run.eval_provider') is False:
+            # nothing to validate
+            ctx.run.background_val.flush(ctx)
+            self.deferred(ctx)
+            return
+        ctx.run.background_val.submit(ctx, super().handle, self.deferred)
+        # deliver the finished jobs
+        ctx.run.background_val.deliver(ctx)
+
+
+class BackgroundFlushHandler(Handler):
+    """
+    Wait for the background validation jobs and run their epoch end handlers.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    @InvocationDebug('BackgroundFlushHandler')
+    def handle(self, ctx: Context):
+        if ctx.ctx_check('run.background_val') is True:
+            ctx.run.background_val.flush(ctx)
+
+
+class MemoryHandler(HandlerContainer):
+    """
+    Record the memory usage around the wrapped handlers through the memory monitor.
+    """
+
+    def __init__(self, phase: str, handlers: C_SEQ = None):
+        super().__init__(handlers)
+        self.phase = phase
+
+    @InvocationDebug('MemoryHandler')
+    def handle(self, ctx: Context):
+        if ctx.ctx_check('run.memory_monitor') is False:
+            super().handle(ctx)
+            return
+        ctx.run.memory_monitor.begin(ctx, self.phase)
+        super().handle(ctx)
+        ctx.run.memory_monitor.end(ctx, self.phase)
+
+
+class MemorySummaryHandler(Handler):
+    """
+    Summarize the memory peaks of the epoch and check memory leaks.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    @InvocationDebug('MemorySummaryHandler')
+    def handle(self, ctx: Context):
+        if ctx.ctx_check('run.memory_monitor') is True:
+            ctx.run.memory_monitor.epoch_end(ctx)
 
 
 class MetricsHandler(Handler):
@@ -215,9 +471,11 @@ class AverageHandler(Handler):
     def average(self, ctx: Context):
         # get inner context variables
         summary = ctx.status.get_avg_inner_ctx(ctx, self.INNER_KEY)
+        # weight the step by its number of samples, so the average is correct with uneven batch sizes
+        weight = ctx.step.batch_size if is_nothing(ctx.step.batch_size) is False else 1
         # get average loss and metrics
-        avg_loss = self._compute_avg_loss(summary, ctx.step.loss)
-        avg_metrics = self._compute_avg_metrics(summary, ctx.step.metrics)
+        avg_loss = self._compute_avg_loss(summary, ctx.step.loss, weight)
+        avg_metrics = self._compute_avg_metrics(summary, ctx.step.metrics, weight)
         ctx.status.set_avg_loss_and_metrics(ctx, avg_loss, avg_metrics)
 
     def clear(self, ctx: Context):
@@ -225,25 +483,25 @@ class AverageHandler(Handler):
         ctx.status.clear_avg_info(ctx, self.INNER_KEY)
 
     @staticmethod
-    def _compute_avg_loss(summary, loss):
+    def _compute_avg_loss(summary, loss, weight=1):
         if 'loss' in summary and 'count' in summary and is_nothing(loss) is False:
-            summary['loss'] += float(loss)
+            summary['loss'] += float(loss) * weight
             summary['count'].setdefault('loss', 0)
-            summary['count']['loss'] += 1
+            summary['count']['loss'] += weight
             return safe_divide(summary['loss'], summary['count']['loss'])
         else:
             return NOTHING
 
     @staticmethod
-    def _compute_avg_metrics(summary: Dict, metrics: Dict):
+    def _compute_avg_metrics(summary: Dict, metrics: Dict, weight=1):
         if 'metrics' in summary and 'count' in summary:
             temp = {}
             _metrics = summary['metrics']
             for key, value in metrics.items():
                 _metrics.setdefault(key, 0)
-                _metrics[key] += value
+                _metrics[key] += value * weight
                 summary['count'].setdefault(key, 0)
-                summary['count'][key] += 1
+                summary['count'][key] += weight
             for key, value in _metrics.items():
                 temp[key] = safe_divide(value, summary['count'].setdefault(key, 0))
             return temp
@@ -251,6 +509,35 @@ class AverageHandler(Handler):
             return NOTHING
 
 
+class AccumulateHandler(Handler):
+
+    def __init__(self, type: str = 'update'):
+        super().__init__()
+        type_supported = ['clear', 'update', 'end']
+        if type not in type_supported:
+            logger.warn('An unsupported accumulate handler type is set.')
+        self.type = type
+
+    @InvocationDebug('AccumulateHandler')
+    def handle(self, ctx: Context):
+        # context check
+        if ctx.ctx_check('run.accumulator') is False:
+            return
+        if self.type == 'clear':
+            ctx.run.accumulator.clear(ctx)
+        elif self.type == 'update':
+            ctx.run.accumulator.update(ctx)
+        elif self.type == 'end':
+            ctx.run.accumulator.finish(ctx)
+            # compute the metrics that need the whole epoch
+            if ctx.ctx_check('run.epoch_metrics') is True and is_nothing(ctx.epoch.outputs) is False:
+                metrics = ctx.run.epoch_metrics(ctx)
+                ctx.status.merge_metrics(ctx, metrics)
+                logger.info('{0} epoch metrics: {1}'.format(
+                    str(ctx.status), ' '.join('{0}: {1:.5f}'.format(key, value) for key, value in metrics.items())
+                ))
+
+
 class DisplayHandler(Handler):
 
     def __init__(self):
@@ -260,6 +547,12 @@ class DisplayHandler(Handler):
     def handle(self, ctx: Context):
         current = ctx.step.current
         total = ctx.step.total
+        progress = ctx.step.progress
+        if is_nothing(total) is True:
+            # streaming datasets: estimate with the length hint, which is exceeded in the worst case
+            hint = ctx.step.total_hint
+            total = max(hint, current + 2) if isinstance(hint, int) and hint > 0 else NOTHING
+            progress = (current, total)
 
         data = ' '.join(ctx.status.get_avg_loss_and_metrics(ctx))
 
@@ -267,17 +560,21 @@ class DisplayHandler(Handler):
             Cursor.refresh_print(
                 str(ctx.status),
                 # progress bar
-                progress_format(ctx.step.progress, newline=False),
+                progress_format(progress, newline=False),
                 # eta with color blue
                 '{0}ETA: {1}{2}'.format(
                     Cursor.single_color('b'),
-                    eta_format(ctx.step.time, total - current - 1),
+                    '--' if is_nothing(total) is True else (
+                        # use the smoothed step time if it has been measured
+                        eta_format(ctx.step.time, total - current - 1) if is_nothing(ctx.step.step_time) else \
+                            period_time_format(ctx.step.step_time * (total - current - 1))
+                    ),
                     Cursor.reset_style()
                 ),
                 # loss and metrics output
                 data,
                 # print new line if progress end
-                end='\n' if current + 1 == total else ''
+                end='\n' if current + 1 == ctx.step.total else ''
             )
 
 
@@ -290,6 +587,12 @@ class DatasetHandler(Handler):
     def handle(self, ctx: Context):
         # context check
         ctx.ctx_check('status', silent=False)
+        # use the dataset warmed up in the previous phase
+        if ctx.ctx_check('run.warmup') is True:
+            dataset = ctx.run.warmup.take(ctx)
+            if is_nothing(dataset) is False:
+                ctx.dataset = dataset
+                return
         # get dataset through status
         ctx.status.get_dataset(ctx)
 
@@ -371,6 +674,10 @@ class StepBeginHandler(Handler):
         ])
         ctx.run.callbacks.step_begin(ctx)
 
+    def prunable(self, ctx: Context) -> bool:
+        # no callback overrides the hook
+        return ctx.ctx_check('run.callbacks') is False or ctx.run.callbacks.has_hook('step_begin') is False
+
 
 class StepEndHandler(Handler):
 
@@ -385,6 +692,10 @@ class StepEndHandler(Handler):
         ])
         ctx.run.callbacks.step_end(ctx)
 
+    def prunable(self, ctx: Context) -> bool:
+        # no callback overrides the hook
+        return ctx.ctx_check('run.callbacks') is False or ctx.run.callbacks.has_hook('step_end') is False
+
 
 class EpochBeginHandler(Handler):
 
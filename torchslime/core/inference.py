@@ -0,0 +1,192 @@
+"""
+Inference optimization for CPU serving: int8 quantization, channels_last, TorchScript freezing and an accuracy
+comparison report against the fp32 model.
+"""
+from typing import Dict, Iterator, Sequence, Tuple
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from .context import Context
+from torch import Tensor
+from torch.nn import Module
+import torch
+import copy
+import time
+
+# layers that dynamic quantization supports
+DYNAMIC_LAYERS = (torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU, torch.nn.RNNCell, torch.nn.LSTMCell, torch.nn.GRUCell)
+
+
+def iter_inputs(ctx: Context, provider, max_batches: int = None) -> Iterator[Tuple]:
+    """Yield the transferred model inputs and labels of the provider, parsed by the data parser of the context.
+    """
+    dataset = provider(ctx)
+    try:
+        for index, batch in enumerate(dataset):
+            if max_batches is not None and index >= max_batches:
+                break
+            ctx.step.batch = batch
+            x, y_true, _ = ctx.run.data_parser(ctx)
+            yield ctx.run.transfer(x, ctx.device), ctx.run.transfer(y_true, ctx.device)
+    finally:
+        ctx.step.initialize()
+
+
+def _flatten(obj) -> Sequence[Tensor]:
+    if isinstance(obj, Tensor):
+        return [obj]
+    elif isinstance(obj, dict):
+        return [tensor for value in obj.values() for tensor in _flatten(value)]
+    elif isinstance(obj, (list, tuple)):
+        return [tensor for item in obj for tensor in _flatten(item)]
+    return []
+
+
+def quantize(
+    model: Module,
+    mode: str = 'dynamic',
+    layers: Sequence[type] = DYNAMIC_LAYERS,
+    calibration_inputs: Sequence = None,
+    backend: str = None
+) -> Module:
+    """Quantize the model to int8.
+
+    Args:
+        model (Module): fp32 model, which is not changed.
+        mode (str, optional): 'dynamic' quantizes the weights of ``layers`` and the activations on the fly. 'static'
+            quantizes the weights and activations (including Conv layers) through FX graph mode with the observed
+            ranges of ``calibration_inputs``. Defaults to 'dynamic'.
+        layers (Sequence[type], optional): layer types of dynamic quantization. Defaults to DYNAMIC_LAYERS.
+        calibration_inputs (Sequence, optional): model inputs of static quantization. Defaults to None.
+        backend (str, optional): quantized engine, e.g., 'x86', 'fbgemm' or 'qnnpack'. Defaults to the current one.
+    """
+    if backend is not None:
+        torch.backends.quantized.engine = backend
+    backend = torch.backends.quantized.engine
+    if mode == 'static' and (calibration_inputs is None or len(calibration_inputs) == 0):
+        logger.warn('Static quantization needs calibration inputs, and dynamic quantization is used instead.')
+        mode = 'dynamic'
+
+    if mode == 'dynamic':
+        return torch.ao.quantization.quantize_dynamic(model, set(layers), dtype=torch.qint8)
+    elif mode == 'static':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        prepared = prepare_fx(
+            copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), (calibration_inputs[0],)
+        )
+        with torch.inference_mode():
+            for x in calibration_inputs:
+                prepared(x)
+        return convert_fx(prepared)
+    logger.warn('An unsupported quantization mode is set, and the model is not quantized.')
+    return model
+
+
+def freeze(model: Module, example_input) -> Module:
+    """Trace the model with the example input and freeze it, so oneDNN can fuse the operators(e.g., Conv, BatchNorm
+    and ReLU) and fold the constants.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), (example_input,), check_trace=False)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def compare(
+    ctx: Context,
+    reference: Module,
+    optimized: Module,
+    inputs: Sequence[Tuple]
+) -> Dict:
+    """Compare the outputs, loss and latency of the optimized model with the reference model on the inputs.
+    """
+    report = {
+        'batches': len(inputs),
+        'max_abs_diff': 0.0,
+        'mean_abs_diff': NOTHING,
+        'top1_agreement': NOTHING,
+        'reference_loss': NOTHING,
+        'optimized_loss': NOTHING,
+        'reference_ms': NOTHING,
+        'optimized_ms': NOTHING
+    }
+    diff_sum, diff_count, agree, agree_count = 0.0, 0, 0, 0
+    losses = {'reference': [], 'optimized': []}
+    times = {'reference': 0.0, 'optimized': 0.0}
+    with torch.inference_mode():
+        # warmup, which is needed especially by the TorchScript profiling executor
+        for model in [reference, optimized]:
+            for x, _ in inputs[:2]:
+                model(x)
+        for x, y_true in inputs:
+            outputs = {}
+            for name, model in [('reference', reference), ('optimized', optimized)]:
+                start = time.perf_counter()
+                outputs[name] = model(x)
+                times[name] += time.perf_counter() - start
+                if ctx.ctx_check('run.loss') is True and is_nothing(y_true) is False:
+                    losses[name].append(float(ctx.run.loss(outputs[name], y_true)))
+            for ref, opt in zip(_flatten(outputs['reference']), _flatten(outputs['optimized'])):
+                if ref.is_floating_point() is False:
+                    continue
+                diff = (ref.float() - opt.float()).abs()
+                report['max_abs_diff'] = max(report['max_abs_diff'], float(diff.max()) if diff.numel() > 0 else 0.0)
+                diff_sum += float(diff.sum())
+                diff_count += diff.numel()
+                if ref.dim() == 2:
+                    agree += int((ref.argmax(-1) == opt.argmax(-1)).sum())
+                    agree_count += ref.size(0)
+    if len(inputs) > 0:
+        report['reference_ms'] = times['reference'] / len(inputs) * 1000
+        report['optimized_ms'] = times['optimized'] / len(inputs) * 1000
+    if diff_count > 0:
+        report['mean_abs_diff'] = diff_sum / diff_count
+    if agree_count > 0:
+        report['top1_agreement'] = agree / agree_count
+    for name in ['reference', 'optimized']:
+        if len(losses[name]) > 0:
+            report['{0}_loss'.format(name)] = sum(losses[name]) / len(losses[name])
+    return report
+
+
+def optimize_inference(
+    ctx: Context,
+    calibration=NOTHING,
+    quantization: str = 'dynamic',
+    layers: Sequence[type] = DYNAMIC_LAYERS,
+    channels_last: bool = False,
+    jit_freeze: bool = False,
+    max_batches: int = 16,
+    backend: str = None
+) -> Dict:
+    """Optimize the model of the context for CPU inference, and compare it with the fp32 model on the calibration
+    provider. The optimized model replaces ``ctx.model``, and ``torch.inference_mode`` is used in eval and predict.
+    """
+    reference = ctx.model.eval()
+    inputs = list(iter_inputs(ctx, calibration, max_batches)) if is_nothing(calibration) is False else []
+    model = reference
+    if quantization is not None:
+        model = quantize(model, quantization, layers, [x for x, _ in inputs], backend)
+    if channels_last is True:
+        # quantized or not, the channels_last model takes channels_last inputs
+        model = copy.deepcopy(model) if model is reference else model
+        model = model.to(memory_format=torch.channels_last)
+        ctx.run.transfer.memory_format = torch.channels_last
+        inputs = [(ctx.run.transfer(x, ctx.device), y_true) for x, y_true in inputs]
+    if jit_freeze is True:
+        if len(inputs) == 0:
+            logger.warn('TorchScript freezing needs an example input from the calibration provider, and it is skipped.')
+        else:
+            model = freeze(model, inputs[0][0])
+
+    report = NOTHING
+    if len(inputs) > 0:
+        report = compare(ctx, reference, model, inputs)
+        logger.info(
+            'Inference optimization: latency {reference_ms:.3f}ms -> {optimized_ms:.3f}ms per batch, '
+            'max abs diff: {max_abs_diff:.5f}, top1 agreement: {top1}, loss: {reference_loss} -> {optimized_loss}'.format(
+                top1=report['top1_agreement'], **report
+            )
+        )
+    ctx.model = model
+    ctx.run.inference_mode = True
+    return report
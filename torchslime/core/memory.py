@@ -0,0 +1,162 @@
+"""
+Memory monitor that records memory usage around the forward, backward and optimizer phases.
+"""
+from typing import Dict, List
+from ..util import NOTHING, is_nothing
+from ..util.memory import current_rss
+from ..log import logger
+from .context import Context
+from torch import Tensor
+import torch
+import tracemalloc
+
+
+class MemoryMonitor:
+    """
+    Record the process RSS, the tracemalloc peak (python heap, optional) and the CUDA allocator statistics around
+    each phase, and keep running peaks per epoch. A warning is logged when the epoch peaks keep growing, which
+    suggests a leak such as tensors with autograd history retained in the context or callback state.
+
+    PyTorch has no public statistics of the CPU allocator, so the CPU tensor memory is covered by the process RSS.
+
+    Args:
+        trace_python (bool, optional): start tracemalloc to record the python heap peaks. It slows down the
+            program. Defaults to False.
+        leak_epochs (int, optional): number of consecutive growing epochs that triggers the leak warning.
+            Defaults to 3.
+        leak_threshold (float, optional): min relative growth over these epochs that triggers the leak warning.
+            Defaults to 0.05.
+    """
+
+    def __init__(self, trace_python: bool = False, leak_epochs: int = 3, leak_threshold: float = 0.05):
+        super().__init__()
+        self.trace_python = trace_python
+        self.leak_epochs = leak_epochs
+        self.leak_threshold = leak_threshold
+        # running peaks of the current epoch, with the phase name as key
+        self.peaks: Dict[str, Dict] = {}
+        # peaks of the finished epochs
+        self.history: List[Dict] = []
+        self._baseline = {}
+
+    @staticmethod
+    def cuda_device(ctx: Context):
+        if is_nothing(ctx.device) is False and ctx.device is not None and torch.device(ctx.device).type == 'cuda':
+            return ctx.device
+        return NOTHING
+
+    def begin(self, ctx: Context, phase: str):
+        if self.trace_python is True and tracemalloc.is_tracing() is False:
+            tracemalloc.start()
+        if tracemalloc.is_tracing() is True:
+            tracemalloc.reset_peak()
+        device = self.cuda_device(ctx)
+        if is_nothing(device) is False:
+            torch.cuda.reset_peak_memory_stats(device)
+        self._baseline[phase] = self.snapshot(ctx)
+
+    def end(self, ctx: Context, phase: str):
+        record = self.snapshot(ctx)
+        if tracemalloc.is_tracing() is True:
+            record['python_peak'] = tracemalloc.get_traced_memory()[1]
+            # reset the peak, so the peak of the enclosing phase only covers the time after the inner phase.
+            tracemalloc.reset_peak()
+        device = self.cuda_device(ctx)
+        if is_nothing(device) is False:
+            record['cuda_peak'] = torch.cuda.max_memory_allocated(device)
+            torch.cuda.reset_peak_memory_stats(device)
+        baseline = self._baseline.get(phase, {})
+        record['rss_delta'] = record['rss'] - baseline.get('rss', record['rss'])
+
+        peaks = self.peaks.setdefault(phase, {})
+        for key, value in record.items():
+            if key != 'rss_delta':
+                peaks[key] = max(peaks.get(key, value), value)
+        peaks['rss_delta'] = max(peaks.get('rss_delta', record['rss_delta']), record['rss_delta'])
+        ctx.step.memory = dict(ctx.step.memory if is_nothing(ctx.step.memory) is False else {}, **{phase: record})
+
+    def snapshot(self, ctx: Context) -> Dict:
+        rss = current_rss()
+        record = {'rss': rss if is_nothing(rss) is False else 0}
+        device = self.cuda_device(ctx)
+        if is_nothing(device) is False:
+            record['cuda_allocated'] = torch.cuda.memory_allocated(device)
+            record['cuda_reserved'] = torch.cuda.memory_reserved(device)
+        return record
+
+    def epoch_end(self, ctx: Context):
+        if len(self.peaks) == 0:
+            return
+        ctx.epoch.memory = self.peaks
+        self.history.append(self.peaks)
+        self.peaks = {}
+        self.check_leak(ctx)
+
+    def check_leak(self, ctx: Context):
+        if len(self.history) <= self.leak_epochs:
+            return
+        for key in ['rss', 'cuda_allocated', 'python_peak']:
+            values = [
+                max([phase.get(key, 0) for phase in epoch.values()]) for epoch in self.history[-self.leak_epochs - 1:]
+            ]
+            growing = all(values[i] < values[i + 1] for i in range(len(values) - 1))
+            if growing is True and values[0] > 0 and (values[-1] - values[0]) / values[0] > self.leak_threshold:
+                logger.warn(
+                    'Memory peak ({0}) keeps growing in the last {1} epochs: {2}. It suggests a memory leak. {3}'.format(
+                        key, len(values), ', '.join('{0:.1f}MB'.format(value / 2 ** 20) for value in values),
+                        self.find_retained(ctx)
+                    )
+                )
+
+    @staticmethod
+    def find_retained(ctx: Context) -> str:
+        """Find tensors with autograd history retained in the step context(the fields kept by ``Callback.retain_step``
+        or set outside of ``StepContext.TENSOR_ATTRS``, since it runs after the step tensors are released), the
+        custom context and callback state.
+        """
+        def scan(obj, name, depth=0):
+            if isinstance(obj, Tensor):
+                return [name] if obj.grad_fn is not None else []
+            if depth > 2:
+                return []
+            if isinstance(obj, dict):
+                items = obj.items()
+            elif isinstance(obj, (list, tuple)):
+                items = enumerate(obj)
+            else:
+                return []
+            found = []
+            for key, value in items:
+                found += scan(value, '{0}[{1!r}]'.format(name, key), depth + 1)
+            return found
+
+        found = scan(dict(ctx.step.__dict__), 'ctx.step')
+        found += scan(dict(ctx.custom.__dict__), 'ctx.custom')
+        if is_nothing(ctx.run.callbacks) is False:
+            for callback in ctx.run.callbacks:
+                found += scan(dict(getattr(callback, '__dict__', {})), type(callback).__name__)
+        if len(found) == 0:
+            return 'Check whether tensors with autograd history are retained, e.g., appending the loss without detach.'
+        return 'Tensors with autograd history are retained in: {0}.'.format(', '.join(found[:10]))
+
+    def attach(self, container):
+        """Wrap the forward, backward and optimizer handlers in the container with memory handlers, and add a
+        memory summary handler at the end of each epoch.
+        """
+        from . import handler
+        for index, item in enumerate(container):
+            if isinstance(item, handler.HandlerContainer) and \
+                    isinstance(item, (handler.MemoryHandler, handler.BackgroundValHandler)) is False:
+                # the background validation runs in a worker thread, which is not monitored
+                self.attach(item)
+            if isinstance(item, handler.ForwardHandler):
+                container[index] = handler.MemoryHandler('forward', [item])
+            elif isinstance(item, handler.BackwardHandler):
+                container[index] = handler.MemoryHandler('backward', [item])
+            elif isinstance(item, handler.OptimizerHandler):
+                container[index] = handler.MemoryHandler('optimizer', [item])
+        # the summary handler is added to the containers that run iterations directly (before the epoch end callback)
+        if any(isinstance(item, handler.IterationHandler) for item in container) and \
+                any(isinstance(item, handler.MemorySummaryHandler) for item in container) is False:
+            ends = [index for index, item in enumerate(container) if isinstance(item, handler.EpochEndHandler)]
+            container.insert(ends[0] if len(ends) > 0 else len(container), handler.MemorySummaryHandler())
@@ -0,0 +1,213 @@
+"""
+Micro-batching that splits each loaded batch into chunks, and accumulates the gradients weighted by the number of
+samples, so large effective batches fit in limited memory without changing the data pipeline.
+"""
+from typing import List
+from ..util import NOTHING, is_nothing, get_batch_size, detach
+from ..log import logger
+from .context import Context
+from torch import Tensor
+import torch
+
+
+def split_batch(batch, size: int, total: int) -> List:
+    """Split the tensors whose first dim is ``total`` in a (nested) batch into chunks of ``size``. Other objects are
+    shared by all the chunks.
+    """
+    chunks = (total + size - 1) // size
+
+    def split(obj):
+        if isinstance(obj, Tensor) and obj.dim() > 0 and obj.size(0) == total:
+            return list(obj.split(size))
+        elif isinstance(obj, dict):
+            items = {key: split(value) for key, value in obj.items()}
+            return [type(obj)((key, value[i]) for key, value in items.items()) for i in range(chunks)]
+        elif isinstance(obj, tuple) and hasattr(obj, '_fields'):
+            # namedtuple
+            items = [split(item) for item in obj]
+            return [type(obj)(*(item[i] for item in items)) for i in range(chunks)]
+        elif isinstance(obj, (list, tuple)):
+            items = [split(item) for item in obj]
+            return [type(obj)(item[i] for item in items) for i in range(chunks)]
+        return [obj] * chunks
+    return split(batch)
+
+
+def concat_outputs(outputs: List):
+    """Concatenate the outputs of the chunks along the first dim. Non-tensor objects are taken from the first chunk.
+    """
+    first = outputs[0]
+    if isinstance(first, Tensor):
+        return torch.cat(outputs) if first.dim() > 0 else first
+    elif isinstance(first, dict):
+        return type(first)((key, concat_outputs([output[key] for output in outputs])) for key in first.keys())
+    elif isinstance(first, tuple) and hasattr(first, '_fields'):
+        return type(first)(*(concat_outputs(list(items)) for items in zip(*outputs)))
+    elif isinstance(first, (list, tuple)):
+        return type(first)(concat_outputs(list(items)) for items in zip(*outputs))
+    return first
+
+
+def _is_oom(e: Exception) -> bool:
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e).lower()
+
+
+class MicroBatcher:
+    """
+    Decide the micro-batch size of each step.
+
+    Args:
+        max_size (int, optional): max samples of a micro-batch. Defaults to None(the whole batch).
+        memory_limit (int, optional): memory ceiling in bytes(accelerator peak allocated memory, or process RSS on
+            CPU). The micro-batch size is halved when a step exceeds it. On CPU, the process peak RSS is used when the
+            step raises it, otherwise the RSS after the step(the CPU peak within a step is not recorded otherwise).
+            Defaults to None.
+        adaptive (bool, optional): halve the micro-batch size and retry the step on OOM errors. Defaults to True.
+    """
+
+    def __init__(self, max_size: int = None, memory_limit: int = None, adaptive: bool = True):
+        super().__init__()
+        self.max_size = max_size
+        self.memory_limit = memory_limit
+        self.adaptive = adaptive
+        # the current micro-batch size, which is reduced on OOM or when the memory limit is exceeded
+        self.size = max_size
+        # process peak RSS at the beginning of the step(CPU only)
+        self._peak_rss = NOTHING
+
+    def chunk_size(self, total: int) -> int:
+        return total if self.size is None else max(1, min(self.size, total))
+
+    def reduce(self, total: int, reason: str) -> bool:
+        """Halve the micro-batch size. Return False if it cannot be reduced.
+        """
+        current = self.chunk_size(total)
+        if current <= 1:
+            return False
+        self.size = current // 2
+        logger.warn('Micro-batch size is reduced from {0} to {1} ({2}).'.format(current, self.size, reason))
+        return True
+
+    @staticmethod
+    def cuda_device(ctx: Context):
+        if is_nothing(ctx.device) is False and ctx.device is not None and torch.device(ctx.device).type == 'cuda':
+            return ctx.device
+        return NOTHING
+
+    def begin(self, ctx: Context):
+        device = self.cuda_device(ctx)
+        if self.memory_limit is None:
+            return
+        if is_nothing(device) is False:
+            torch.cuda.reset_peak_memory_stats(device)
+        else:
+            from ..util.memory import peak_rss
+            self._peak_rss = peak_rss()
+
+    def end(self, ctx: Context, total: int):
+        if self.memory_limit is None:
+            return
+        device = self.cuda_device(ctx)
+        if is_nothing(device) is False:
+            memory = torch.cuda.max_memory_allocated(device)
+        else:
+            from ..util.memory import current_rss, peak_rss
+            # the process peak is a life-time high-water mark, so it is the peak of this step only if the step raised it
+            peak = peak_rss()
+            if is_nothing(peak) is False and is_nothing(self._peak_rss) is False and peak > self._peak_rss:
+                memory = peak
+            else:
+                memory = current_rss()
+            if is_nothing(memory) is True:
+                return
+        if memory > self.memory_limit:
+            self.reduce(total, 'memory {0:.1f}MB exceeds the limit {1:.1f}MB'.format(
+                memory / 2 ** 20, self.memory_limit / 2 ** 20
+            ))
+
+    def run(self, ctx: Context, step):
+        """Run the step on the micro-batches of ``ctx.step.batch``, and set the outputs(``x``, ``y_true``, ``y_pred``,
+        ``extra`` and the detached loss) of the whole batch to the step context, so the metrics, averages and
+        callbacks see the full logical batch. They are released at the end of the step as usual.
+        """
+        batch = ctx.step.batch
+        total = get_batch_size(batch)
+        if is_nothing(total) is True:
+            step(ctx)
+            return
+        self.begin(ctx)
+        while True:
+            size = self.chunk_size(total)
+            chunks = split_batch(batch, size, total)
+            done = 0
+            try:
+                outputs = []
+                for chunk in chunks:
+                    ctx.step.batch = chunk
+                    # weight of the chunk loss, so the accumulated gradients are the same as the whole batch
+                    ctx.step.micro_weight = get_batch_size(chunk) / total
+                    step(ctx)
+                    done += 1
+                    outputs.append({
+                        'x': ctx.step.x,
+                        'y_true': ctx.step.y_true,
+                        # the graph of the chunk is consumed by backward, and detaching releases it
+                        'y_pred': detach(ctx.step.y_pred),
+                        'extra': ctx.step.extra,
+                        'loss': detach(ctx.step.loss),
+                        'weight': ctx.step.micro_weight
+                    })
+                break
+            except Exception as e:
+                # the gradients of the finished chunks cannot be rolled back, so only the first chunk is retried
+                if self.adaptive is False or _is_oom(e) is False or done > 0 or self.reduce(total, 'OOM') is False:
+                    raise
+                ctx.step.release()
+                device = self.cuda_device(ctx)
+                if is_nothing(device) is False:
+                    torch.cuda.empty_cache()
+        self.end(ctx, total)
+
+        losses = [output['loss'] for output in outputs]
+        ctx.step.from_dict({
+            'batch': batch,
+            'x': concat_outputs([output['x'] for output in outputs]),
+            'y_true': concat_outputs([output['y_true'] for output in outputs]),
+            'y_pred': concat_outputs([output['y_pred'] for output in outputs]),
+            'extra': concat_outputs([output['extra'] for output in outputs]),
+            # the sample-weighted loss of the whole batch
+            'loss': sum(loss * output['weight'] for loss, output in zip(losses, outputs)) \
+                if all(isinstance(loss, Tensor) for loss in losses) else NOTHING,
+            'batch_size': total,
+            'micro_weight': NOTHING
+        })
+
+    def attach(self, container) -> bool:
+        """Move the forward and loss handlers into the optimizer handler, and wrap them together with the backward
+        handler with a micro-batch handler, so the three run on each micro-batch before the optimizer step. Return
+        whether a micro-batch handler is in place.
+        """
+        from . import handler
+
+        def unwrap(item):
+            # the handlers may be wrapped by the memory monitor
+            if isinstance(item, handler.MemoryHandler) and len(item) == 1:
+                return item[0]
+            return item
+
+        attached = False
+        for item in container:
+            if isinstance(item, handler.HandlerContainer) and isinstance(item, handler.MicroBatchHandler) is False:
+                attached = self.attach(item) or attached
+        forward = [item for item in container if isinstance(unwrap(item), handler.ForwardHandler)]
+        loss = [item for item in container if isinstance(unwrap(item), handler.LossHandler)]
+        optimizer = [unwrap(item) for item in container if isinstance(unwrap(item), handler.OptimizerHandler)]
+        if len(optimizer) == 1 and any(isinstance(item, handler.MicroBatchHandler) for item in optimizer[0]):
+            return True
+        if len(forward) != 1 or len(optimizer) != 1:
+            return attached
+        for item in forward + loss:
+            container.remove(item)
+        # the optimizer handler itself(inside the memory handler if wrapped) runs the micro-batches
+        optimizer[0][:] = [handler.MicroBatchHandler(forward + loss + list(optimizer[0]))]
+        return True
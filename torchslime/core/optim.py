@@ -0,0 +1,104 @@
+"""
+Optimizer registry that builds optimizers from names and options, with the multi-tensor(foreach) or fused
+implementations and automatic parameter groups.
+"""
+from typing import Dict, List
+from ..module import Registry
+from ..util import is_nothing
+from ..util.type import NUMBER
+from ..log import logger
+from torch.nn import Module
+from torch.optim import Optimizer
+import torch
+import inspect
+
+optimizer_registry = Registry('optimizer')
+
+# the optimizers in torch.optim, registered with lower-case names
+for _name in [
+    'SGD', 'Adam', 'AdamW', 'RMSprop', 'Adagrad', 'Adadelta', 'Adamax', 'RAdam', 'NAdam', 'ASGD', 'Rprop', 'LBFGS',
+    'SparseAdam', 'Adafactor'
+]:
+    if hasattr(torch.optim, _name):
+        optimizer_registry.register(_name.lower())(getattr(torch.optim, _name))
+
+# layers whose parameters are excluded from weight decay
+NO_DECAY_LAYERS = (
+    torch.nn.modules.batchnorm._NormBase,
+    torch.nn.LayerNorm,
+    torch.nn.GroupNorm,
+    torch.nn.LocalResponseNorm,
+    torch.nn.Embedding
+)
+
+
+def param_groups(model: Module, weight_decay: float, no_decay_layers=NO_DECAY_LAYERS) -> List[Dict]:
+    """Split the trainable parameters into a group with weight decay and a group without weight decay(biases,
+    normalization and embedding layers).
+    """
+    decay, no_decay = [], []
+    visited = set()
+    for module in model.modules():
+        for name, param in module.named_parameters(recurse=False):
+            if param.requires_grad is False or id(param) in visited:
+                continue
+            visited.add(id(param))
+            if isinstance(module, no_decay_layers) or name.endswith('bias') or param.dim() <= 1:
+                no_decay.append(param)
+            else:
+                decay.append(param)
+    groups = [{'params': decay, 'weight_decay': weight_decay}]
+    if len(no_decay) > 0:
+        groups.append({'params': no_decay, 'weight_decay': 0.0})
+    return groups
+
+
+def implementation_options(cls, params) -> Dict:
+    """Choose the fused implementation if all the parameters are on CUDA and the optimizer supports it, and the
+    multi-tensor(foreach) implementation otherwise.
+    """
+    parameters = inspect.signature(cls).parameters
+    if 'fused' in parameters and len(params) > 0 and \
+            all(param.is_cuda and param.is_floating_point() for param in params):
+        return {'fused': True}
+    if 'foreach' in parameters:
+        return {'foreach': True}
+    return {}
+
+
+def build_optimizer(model: Module, name: str, lr: NUMBER = None, options: Dict = None) -> Optimizer:
+    """Build the registered optimizer with the parameters of the model.
+
+    Args:
+        model (Module): the model.
+        name (str): registered optimizer name(case-insensitive), e.g., 'sgd' or 'adamw'.
+        lr (NUMBER, optional): learning rate. Defaults to the default of the optimizer.
+        options (Dict, optional): other options of the optimizer. Parameter groups are built when
+            ``weight_decay`` is set, unless ``param_groups`` is False. ``foreach`` and ``fused`` override the
+            automatic choice. Defaults to None.
+    """
+    cls = optimizer_registry.get(name.lower())
+    if is_nothing(cls) is True:
+        raise ValueError('Unsupported optimizer: {0}, which should be one of {1}.'.format(
+            name, list(optimizer_registry.modules.keys())
+        ))
+    options = dict(options) if options is not None else {}
+    groups = options.pop('param_groups', True)
+    weight_decay = options.get('weight_decay', 0)
+    if weight_decay and groups is True:
+        options.pop('weight_decay')
+        params = param_groups(model, weight_decay)
+    else:
+        params = [param for param in model.parameters() if param.requires_grad]
+
+    if 'foreach' not in options and 'fused' not in options:
+        flat = [param for group in params for param in group['params']] \
+            if len(params) > 0 and isinstance(params[0], dict) else params
+        options.update(implementation_options(cls, flat))
+    if lr is not None:
+        options['lr'] = lr
+    optimizer = cls(params, **options)
+    logger.debug('Optimizer built: {0} {1}'.format(cls.__name__, {
+        key: value for key, value in options.items() if key in ['lr', 'foreach', 'fused']
+    }))
+    return optimizer
@@ -0,0 +1,560 @@
+from typing import Any, Dict, Optional, Sequence, Union, TypeVar
+from ..data import ConstantProvider, DataParser, DataProvider, IndexParser
+from ..metric import M_SEQ, MetricContainer
+from ..callback import C_SEQ, CallbackContainer
+from ..util import NOTHING, get_device, MethodChaining, InvocationDebug, check_nothing, logger, is_nothing, count_params
+from ..util.type import NUMBER
+from ..util.transfer import TensorTransfer
+from .context import Context
+from torch.utils.data import DataLoader
+from torch.nn import Module
+from torch.optim import Optimizer
+
+
+T = TypeVar('T', bound='Proxy')
+DATASET = Union[DataLoader, DataProvider]
+
+
+class Proxy(Context):
+
+    def __init__(self, model, device=None):
+        # init context
+        super().__init__()
+        # set device
+        self.device = device if device is not None else get_device(model)
+        # set model and apply type cast
+        self.model = self.run.transfer(model, self.device)
+        # train, predict and eval process are built lazily on first use
+        self.run.lazy_build(
+            train=self.build_train,
+            predict=self.build_predict,
+            eval=self.build_eval
+        )
+
+    @InvocationDebug('Proxy.Train')
+    def train(
+        self,
+        train_dataset: DATASET,
+        total_epochs: int = 1,
+        eval_dataset: DATASET = NOTHING,
+        callbacks: C_SEQ = NOTHING,
+        grad_acc: int = 1,
+        log_option = None  # TODO: log system design
+    ):
+        self.build_total_epochs(total_epochs)
+        self.build_callbacks(callbacks)
+        self.build_dataset(train_dataset, 'train')
+        self.build_dataset(eval_dataset, 'eval')
+        self.build_grad_acc(grad_acc)
+        logger.info('Using device {0} to train.'.format(str(self.device)))
+        self.run.train(self)
+
+    @InvocationDebug('Proxy.Predict')
+    def predict(
+        self,
+        dataset: DATASET,
+        callbacks: C_SEQ = NOTHING,
+        log_option = None  # TODO: log system design
+    ):
+        self.build_callbacks(callbacks)
+        self.build_dataset(dataset, 'eval')
+        logger.info('Using device {0} to predict.'.format(str(self.device)))
+        self.run.predict(self)
+
+    @InvocationDebug('Proxy.Eval')
+    def eval(
+        self,
+        dataset: DATASET,
+        callbacks: C_SEQ = NOTHING,
+        log_option = None  # TODO: log system design
+    ):
+        self.build_callbacks(callbacks)
+        self.build_dataset(dataset, 'eval')
+        logger.info('Using device {0} to eval.'.format(str(self.device)))
+        self.run.eval(self)
+
+    @InvocationDebug('Proxy.BenchmarkInference')
+    def benchmark_inference(
+        self,
+        input_spec,
+        batch_sizes: Sequence[int] = (1,),
+        threads: Sequence[int] = None,
+        warmup: int = 10,
+        iterations: int = 100,
+        save: bool = True
+    ):
+        """Benchmark the inference latency through the forward path of the predict pipeline.
+
+        Args:
+            input_spec: per-sample input shape (or a nested list or dict of shapes), or a function that builds the
+                whole batch from the batch size.
+            batch_sizes (Sequence[int], optional): batch sizes to be benchmarked. Defaults to (1,).
+            threads (Sequence[int], optional): values of ``torch.set_num_threads``. Defaults to the current value.
+            warmup (int, optional): warmup iterations. Defaults to 10.
+            iterations (int, optional): timed iterations. Defaults to 100.
+            save (bool, optional): write the results as JSON into the log namespace. Defaults to True.
+
+        Returns:
+            list: p50/p90/p99 latency, throughput and peak memory of each batch size and thread count.
+        """
+        from .benchmark import benchmark_inference
+        return benchmark_inference(self, input_spec, batch_sizes, threads, warmup, iterations, save)
+
+    @InvocationDebug('Proxy.Autotune')
+    def autotune(
+        self,
+        dataset,
+        batch_sizes: Sequence[int] = (16, 32, 64, 128, 256, 512),
+        num_workers: Sequence[int] = (0, 2, 4, 8),
+        prefetch_factors: Sequence[int] = (2, 4),
+        threads: Sequence[int] = None,
+        memory_limit: int = None,
+        steps: int = 20,
+        loader_options: Optional[Dict] = None
+    ):
+        """Choose ``batch_size``, ``num_workers``, ``prefetch_factor`` and ``torch.set_num_threads`` through short
+        timed trials of the training step, and return a configured DataProvider for ``Proxy.train``.
+
+        Args:
+            dataset (Dataset): map-style dataset.
+            memory_limit (int, optional): memory ceiling in bytes. Defaults to None.
+            steps (int, optional): timed steps of each trial. Defaults to 20.
+            loader_options (Dict, optional): other DataLoader options, e.g., ``collate_fn``.
+        """
+        from .autotune import Autotuner
+        return Autotuner(
+            batch_sizes, num_workers, prefetch_factors, threads, memory_limit, steps, loader_options=loader_options
+        ).tune(self, dataset)
+
+    @InvocationDebug('Proxy.OptimizeInference')
+    def optimize_inference(
+        self,
+        calibration: DATASET = NOTHING,
+        quantization: Optional[str] = 'dynamic',
+        layers: Optional[Sequence[type]] = None,
+        channels_last: bool = False,
+        jit_freeze: bool = False,
+        max_batches: int = 16,
+        backend: Optional[str] = None
+    ):
+        """Optimize the model for CPU inference, and use ``torch.inference_mode`` in eval and predict. The optimized
+        model replaces ``self.model``, so it is meant for serving rather than further training.
+
+        Args:
+            calibration (DATASET, optional): data for static quantization, the example input of freezing and the
+                accuracy comparison with the fp32 model. Defaults to NOTHING.
+            quantization (str, optional): 'dynamic', 'static' or None. Defaults to 'dynamic'.
+            layers (Sequence[type], optional): layer types of dynamic quantization. Defaults to Linear and RNN layers.
+            channels_last (bool, optional): convert the model and inputs to channels_last. Defaults to False.
+            jit_freeze (bool, optional): trace and freeze the model with TorchScript. Defaults to False.
+            max_batches (int, optional): max calibration batches. Defaults to 16.
+            backend (str, optional): quantized engine. Defaults to the current one.
+
+        Returns:
+            Dict: comparison report(latency, output difference, top-1 agreement and loss) against the fp32 model.
+        """
+        from .inference import optimize_inference, DYNAMIC_LAYERS
+        if is_nothing(calibration) is False and isinstance(calibration, DataProvider) is False:
+            calibration = ConstantProvider(calibration)
+        return optimize_inference(
+            self, calibration, quantization, layers if layers is not None else DYNAMIC_LAYERS,
+            channels_last, jit_freeze, max_batches, backend
+        )
+
+    @InvocationDebug('Proxy.Export')
+    def export(
+        self,
+        path: str,
+        example_batch,
+        format: str = 'torchscript',
+        method: str = 'trace',
+        opset_version: Optional[int] = None,
+        check: bool = True,
+        tolerance: float = 1e-4
+    ):
+        """Export the model as a deployable artifact, which ``torchslime.runtime.PredictEngine`` runs with the same
+        data parsing and batching as ``Proxy.predict``.
+
+        Args:
+            path (str): output path. The metadata is written to ``path + '.meta.json'``.
+            example_batch: a batch as the DataLoader yields, from which the data parser takes the example input.
+            format (str, optional): 'torchscript' or 'onnx'. Defaults to 'torchscript'.
+            method (str, optional): 'trace' or 'script' for TorchScript. Defaults to 'trace'.
+            opset_version (int, optional): ONNX opset version. Defaults to None.
+            check (bool, optional): check the parity of the exported model with the eager model. Defaults to True.
+            tolerance (float, optional): max abs difference of the parity check. Defaults to 1e-4.
+
+        Returns:
+            Dict: export report with the parity check result.
+        """
+        from .export import export
+        return export(self, path, example_batch, format, method, opset_version, check, tolerance)
+
+    @InvocationDebug('Proxy.Summary')
+    def summary(self):
+        pass
+
+    @InvocationDebug('Proxy.CountParams')
+    def count_params(self, format: str = None, decimal: int = 2, log: bool = True):
+        result = count_params(self.model, format, decimal)
+        if log is True:
+            logger.info('Model parameters: {0}'.format(result))
+        return result
+
+    @InvocationDebug('Proxy.Build')
+    @MethodChaining
+    def build(
+        self,
+        loss = None,
+        metrics: M_SEQ = None,
+        optimizer: Union[str, Optimizer] = None,
+        lr: NUMBER = None,
+        lr_decay: Any = None,
+        optimizer_options: Optional[Dict] = None,
+        lr_decay_options: Optional[Dict] = None,
+        data_parser: Optional[DataParser] = None
+    ) -> T:
+        self.build_loss(loss)
+        self.build_metrics(metrics)
+        self.build_data_parser(data_parser)
+        self.build_optimizer(optimizer, lr, optimizer_options)
+        self.build_lr_decay(lr_decay, lr_decay_options)
+
+    @InvocationDebug('Proxy.TransferBuilder')
+    @MethodChaining
+    def build_transfer(self, dtype=None, memory_format=None, non_blocking: bool = False) -> T:
+        """Set how the batches (and the model) are transferred before the forward pass.
+
+        Args:
+            dtype (optional): dtype of floating point tensors. Defaults to None.
+            memory_format (optional): memory format, e.g., ``torch.channels_last``. Defaults to None.
+            non_blocking (bool, optional): asynchronous host-to-device copy. Defaults to False.
+        """
+        self.run.transfer = TensorTransfer(dtype, memory_format, non_blocking)
+        self.model = self.run.transfer(self.model, self.device)
+
+    @InvocationDebug('Proxy.MemoryMonitorBuilder')
+    @MethodChaining
+    def build_memory_monitor(self, trace_python: bool = False, leak_epochs: int = 3, leak_threshold: float = 0.05) -> T:
+        """Record the memory usage around the forward, backward and optimizer phases, keep running peaks per epoch
+        in ``ctx.epoch.memory`` and warn about memory leaks.
+        """
+        from .memory import MemoryMonitor
+        self.run.memory_monitor = MemoryMonitor(trace_python, leak_epochs, leak_threshold)
+        for pipeline in [self.run.train, self.run.predict, self.run.eval]:
+            self.run.memory_monitor.attach(pipeline)
+
+    @InvocationDebug('Proxy.MicroBatchBuilder')
+    @MethodChaining
+    def build_micro_batch(self, max_size: Optional[int] = None, memory_limit: Optional[int] = None, adaptive: bool = True) -> T:
+        """Split each training batch into micro-batches, which run forward, loss and backward one by one with the
+        gradients accumulated by sample count. Metrics, averages and callbacks see the whole batch.
+
+        Args:
+            max_size (int, optional): max samples of a micro-batch. Defaults to None(the whole batch).
+            memory_limit (int, optional): memory ceiling in bytes, above which the micro-batch size is halved.
+                Defaults to None.
+            adaptive (bool, optional): halve the micro-batch size and retry the step on OOM errors. Defaults to True.
+        """
+        from .microbatch import MicroBatcher
+        micro_batch = MicroBatcher(max_size, memory_limit, adaptive)
+        if micro_batch.attach(self.run.train) is False:
+            logger.warn('No forward and optimizer handlers are found in the train handlers, and micro-batching is not '
+                        'set.')
+            return
+        self.run.micro_batch = micro_batch
+
+    @InvocationDebug('Proxy.FeatureCacheBuilder')
+    @MethodChaining
+    def build_feature_cache(
+        self,
+        module: Union[str, Module],
+        memory_budget: int = None,
+        spill_dir: str = None,
+        dtype=None,
+        augmented: bool = False,
+        eval_mode: bool = True
+    ) -> T:
+        """Cache the outputs of a frozen submodule(e.g., the backbone in fine-tuning) per sample on the first pass,
+        and feed the cached features to the rest of the model in later epochs. The batches should carry the sample
+        indices(``IndexedBatch``, e.g., ``IndexedDataset`` with ``IndexedCollate``). The features are recomputed when
+        the submodule weights change, and the cache is not used if the inputs change between epochs(e.g., random
+        augmentation) unless ``augmented`` is True.
+
+        Args:
+            module (Union[str, Module]): the frozen submodule, or its name in the model.
+            memory_budget (int, optional): max bytes of the features of a phase in RAM. If the estimated size of a
+                phase exceeds it, all the features of the phase are stored in memmap files. Defaults to None(no limit).
+            spill_dir (str, optional): directory of the memmap files. Defaults to a temp directory.
+            dtype (optional): storage dtype of the floating point features, which are cast back to the output dtypes
+                when they are fed to the model. Defaults to None(unchanged).
+            augmented (bool, optional): reuse the cached features even if the inputs change between epochs.
+                Defaults to False.
+            eval_mode (bool, optional): run the submodule in eval mode when the features are computed.
+                Defaults to True.
+        """
+        from .featcache import FeatureCache
+        self.run.feature_cache = FeatureCache(module, memory_budget, spill_dir, dtype, augmented, eval_mode)
+
+    @InvocationDebug('Proxy.BackgroundValBuilder')
+    @MethodChaining
+    def build_background_val(self, device=None, max_pending: int = 1) -> T:
+        """Validate a snapshot of the model weights in a worker thread at the end of each epoch, and start the next
+        training epoch immediately. The epoch end callbacks of an epoch run when its validation is finished, with the
+        epoch context of that epoch, and all the jobs are finished before the end callbacks.
+
+        Args:
+            device (optional): device of the snapshots. Defaults to None(the device of the model).
+            max_pending (int, optional): max validation jobs in flight, each of which holds a model snapshot.
+                Defaults to 1.
+        """
+        from .background import BackgroundValidator
+        self.run.background_val = BackgroundValidator(device, max_pending)
+        self.run.background_val.attach(self.run.train)
+
+    @InvocationDebug('Proxy.WarmupBuilder')
+    @MethodChaining
+    def build_warmup(self, steps: int = 1) -> T:
+        """Create the dataset iterator of the next phase(validation, or the next training epoch) when ``steps``
+        steps of the current phase remain, so the workers start and prefetch while the current phase finishes. Use
+        ``persistent_workers=True`` in the DataLoaders to reuse the workers across epochs.
+
+        Args:
+            steps (int, optional): remaining steps at which the next iterator is created. Defaults to 1.
+        """
+        from .warmup import LoaderWarmup
+        self.run.warmup = LoaderWarmup(steps)
+
+    @InvocationDebug('Proxy.AccumulatorBuilder')
+    @MethodChaining
+    def build_accumulator(
+        self,
+        metrics: M_SEQ = None,
+        dtype=None,
+        topk: int = None,
+        targets: bool = True,
+        memory_budget: int = None,
+        spill_dir: str = None
+    ) -> T:
+        """Accumulate the predictions and targets of each evaluation(and validation) epoch into preallocated buffers,
+        which are set to ``ctx.epoch.outputs`` at the end of the iteration.
+
+        Args:
+            metrics (M_SEQ, optional): metrics computed on ``ctx.epoch.outputs`` at the end of the epoch, e.g., AUC.
+                Defaults to None.
+            dtype (optional): dtype of the floating point outputs, e.g., ``torch.float16``. Defaults to None.
+            topk (int, optional): keep only the top-k predictions along the last dim. Defaults to None.
+            targets (bool, optional): accumulate the targets as well. Defaults to True.
+            memory_budget (int, optional): max bytes of the buffers in RAM, beyond which memmap files are used.
+                Defaults to None.
+            spill_dir (str, optional): directory of the memmap files. Defaults to a temp directory.
+        """
+        from .accumulate import OutputAccumulator
+        self.run.accumulator = OutputAccumulator(dtype, topk, targets, memory_budget, spill_dir)
+        if metrics is not None:
+            self.run.epoch_metrics = check_nothing(metrics, MetricContainer(metrics))
+
+    @InvocationDebug('Proxy.TrainBuilder')
+    @MethodChaining
+    def build_train(self) -> T:
+        # get handler classes from context
+        handler = self.handler
+        # build training process using handlers
+        self.run.train = handler.Container([
+            # begin callback
+            handler.Begin(),
+            # epoch iter
+            handler.EpochIteration([
+                # epoch begin callback
+                handler.EpochBegin(),
+                # set status to 'train'
+                handler.Status('train'),
+                # get dataset
+                handler.Dataset(),
+                # clear average metrics
+                handler.Average('clear'),
+                # dataset iter
+                handler.Iteration([
+                    # step begin callback
+                    handler.StepBegin(),
+                    # forward
+                    handler.Forward(),
+                    # compute loss
+                    handler.Loss(),
+                    # backward and optimizer step
+                    handler.Optimizer([
+                        handler.Backward()
+                    ]),
+                    # compute metrics
+                    handler.Metrics(),
+                    # compute average metrics
+                    handler.Average('avg'),
+                    # display in console or in log files
+                    handler.Display(),
+                    # step end callback
+                    handler.StepEnd()
+                ]),
+                # apply learning rate decay
+                handler.LRDecay(),
+                # set status to 'val'
+                handler.Status('val'),
+                # get dataset
+                handler.Dataset(),
+                # clear average metrics
+                handler.Average('clear'),
+                # clear accumulated outputs
+                handler.Accumulate('clear'),
+                # dataset iter
+                handler.Iteration([
+                    # forward
+                    handler.Forward(),
+                    # compute loss
+                    handler.Loss(),
+                    # metrics
+                    handler.Metrics(),
+                    # compute average metrics
+                    handler.Average('avg'),
+                    # accumulate outputs
+                    handler.Accumulate('update'),
+                    # display in console or in log files
+                    handler.Display()
+                ]),
+                # compute epoch metrics with the accumulated outputs
+                handler.Accumulate('end'),
+                # epoch end callback
+                handler.EpochEnd()
+            ]),
+            # end callback
+            handler.End()
+        ])
+
+    @InvocationDebug('Proxy.PredictBuilder')
+    @MethodChaining
+    def build_predict(self) -> T:
+        # get handler classes from context
+        handler = self.handler
+        # build predicting process using handlers
+        self.run.predict = handler.Container([
+            # begin callback
+            handler.Begin(),
+            # set status to 'predict'
+            handler.Status('predict'),
+            # get dataset
+            handler.Dataset(),
+            # dataset iteration
+            handler.Iteration([
+                # step begin callback
+                handler.StepBegin(),
+                # forward
+                handler.Forward(),
+                # display
+                handler.Display(),
+                # step end callback
+                handler.StepEnd()
+            ]),
+            # end callback
+            handler.End()
+        ])
+
+    @InvocationDebug('Proxy.EvalBuilder')
+    @MethodChaining
+    def build_eval(self) -> T:
+        # get handler classes from context
+        handler = self.handler
+        # build evaluating process using handlers
+        self.run.eval = handler.Container([
+            # begin callback
+            handler.Begin(),
+            # set status to 'eval'
+            handler.Status('eval'),
+            # get dataset
+            handler.Dataset(),
+            # clear average metrics
+            handler.Average('clear'),
+            # clear accumulated outputs
+            handler.Accumulate('clear'),
+            # dataset iteration
+            handler.Iteration([
+                # step begin callback
+                handler.StepBegin(),
+                # forward
+                handler.Forward(),
+                # compute loss
+                handler.Loss(),
+                # compute metrics
+                handler.Metrics(),
+                # compute average metrics
+                handler.Average('avg'),
+                # accumulate outputs
+                handler.Accumulate('update'),
+                # display
+                handler.Display(),
+                # step end callback
+                handler.StepEnd()
+            ]),
+            # compute epoch metrics with the accumulated outputs
+            handler.Accumulate('end'),
+            # end callback
+            handler.End()
+        ])
+
+    @InvocationDebug('Proxy.build_loss')
+    def build_loss(self, loss):
+        if loss is not None:
+            self.run.loss = check_nothing(loss, loss)
+
+    @InvocationDebug('Proxy.build_metrics')
+    def build_metrics(self, metrics):
+        if metrics is not None:
+            self.run.metrics = check_nothing(metrics, MetricContainer(metrics))
+
+    @InvocationDebug('Proxy.build_data_parser')
+    def build_data_parser(self, data_parser):
+        if data_parser is not None:
+            self.run.data_parser = check_nothing(data_parser, data_parser, IndexParser())
+
+    @InvocationDebug('Proxy.build_callbacks')
+    def build_callbacks(self, callbacks):
+        if callbacks is not None:
+            # keep the options(e.g., max_pending) of a given container
+            self.run.callbacks = callbacks if isinstance(callbacks, CallbackContainer) else \
+                check_nothing(callbacks, CallbackContainer(callbacks))
+
+    @InvocationDebug('Proxy.build_optimizer')
+    def build_optimizer(self, optimizer, lr, optimizer_options):
+        if optimizer is not None:
+            if isinstance(optimizer, Optimizer):
+                self.run.optimizer = optimizer
+            elif isinstance(optimizer, str):
+                from .optim import build_optimizer
+                self.run.optimizer = build_optimizer(self.model, optimizer, lr, optimizer_options)
+
+    @InvocationDebug('Proxy.build_lr_decay')
+    def build_lr_decay(self, lr_decay, lr_decay_options):
+        if lr_decay is not None:
+            if isinstance(lr_decay, str) is False:
+                self.run.lr_decay = lr_decay
+
+    @InvocationDebug('Proxy.build_total_epochs')
+    def build_total_epochs(self, total_epochs):
+        self.epoch.total = total_epochs if isinstance(total_epochs, int) else NOTHING
+
+    @InvocationDebug('Proxy.build_dataset')
+    def build_dataset(self, dataset, mode: str):
+        if dataset is not None:
+            if is_nothing(dataset):
+                dataset = NOTHING
+            else:
+                dataset = dataset if isinstance(dataset, DataProvider) else ConstantProvider(dataset)
+
+            if mode == 'train':
+                self.run.train_provider = dataset
+            elif mode == 'eval':
+                self.run.eval_provider = dataset
+            else:
+                logger.warn('build_dataset mode not supported.')
+
+    @InvocationDebug('Proxy.build_grad_acc')
+    def build_grad_acc(self, grad_acc: int):
+        if grad_acc is not None:
+            self.run.grad_acc = grad_acc
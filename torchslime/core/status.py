@@ -32,6 +32,9 @@ class Status:
     def get_avg_inner_ctx(self, ctx: Context, INNER_KEY):
         pass
 
+    def merge_metrics(self, ctx: Context, metrics):
+        pass
+
     def clear_avg_info(self, ctx: Context, INNER_KEY):
         if is_nothing(ctx.inner[INNER_KEY]):
             ctx.inner[INNER_KEY] = {}
@@ -81,6 +84,10 @@ class TrainStatus(Status):
     def get_avg_inner_ctx(self, ctx: Context, INNER_KEY):
         return ctx.inner[INNER_KEY].get('train', NOTHING)
 
+    def merge_metrics(self, ctx: Context, metrics):
+        _metrics = ctx.epoch.train_metrics if is_nothing(ctx.epoch.train_metrics) is False else {}
+        ctx.epoch.train_metrics = dict(_metrics, **metrics)
+
     def clear_avg_info(self, ctx: Context, INNER_KEY):
         super().clear_avg_info(ctx, INNER_KEY)
         ctx.inner[INNER_KEY]['train'] = self._get_avg_inner_init_item()
@@ -124,6 +131,10 @@ class EvalStatus(Status):
     def get_avg_inner_ctx(self, ctx: Context, INNER_KEY):
         return ctx.inner[INNER_KEY].get('eval', NOTHING)
 
+    def merge_metrics(self, ctx: Context, metrics):
+        _metrics = ctx.epoch.eval_metrics if is_nothing(ctx.epoch.eval_metrics) is False else {}
+        ctx.epoch.eval_metrics = dict(_metrics, **metrics)
+
     def clear_avg_info(self, ctx: Context, INNER_KEY):
         super().clear_avg_info(ctx, INNER_KEY)
         ctx.inner[INNER_KEY]['eval'] = self._get_avg_inner_init_item()
@@ -147,6 +158,9 @@ class ValStatus(EvalStatus):
             _metrics['val_{0}'.format(key)] = value
         ctx.epoch.eval_metrics = _metrics
 
+    def merge_metrics(self, ctx: Context, metrics):
+        super().merge_metrics(ctx, {'val_{0}'.format(key): value for key, value in metrics.items()})
+
     def get_avg_loss_and_metrics(self, ctx: Context):
         data = []
         if is_nothing(ctx.epoch.eval_loss) is False:
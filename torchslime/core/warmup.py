@@ -0,0 +1,109 @@
+"""
+Warm up the dataset iterator of the next phase(train -> val, and val -> the next train epoch) during the tail of the
+current phase, so the worker startup and the first batches overlap with the remaining steps.
+"""
+from ..util import NOTHING, is_nothing
+from ..log import logger
+from .context import Context
+import operator
+
+
+class WarmLoader:
+    """
+    Loader whose first iterator has been created in advance. Other attributes are taken from the loader.
+    """
+
+    def __init__(self, loader, iterator):
+        self.loader = loader
+        self.iterator = iterator
+
+    def __iter__(self):
+        iterator, self.iterator = self.iterator, None
+        return iterator if iterator is not None else iter(self.loader)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __length_hint__(self) -> int:
+        return operator.length_hint(self.loader, 0)
+
+    def __getattr__(self, name):
+        if name in ['loader', 'iterator']:
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+class LoaderWarmup:
+    """
+    Create the iterator of the next phase when ``steps`` steps of the current phase remain.
+
+    The worker pools of DataLoaders with ``persistent_workers=True`` are reused across epochs when the provider
+    returns the same loader(e.g., ``ConstantProvider``). A loader is not warmed up while it is being iterated, e.g.,
+    when the same loader is used in training and validation, or if its provider sets ``warmup`` to False.
+
+    Args:
+        steps (int, optional): remaining steps of the current phase at which the next iterator is created.
+            Defaults to 1.
+    """
+
+    def __init__(self, steps: int = 1):
+        super().__init__()
+        self.steps = steps
+        # the prepared (status class, epoch, WarmLoader)
+        self.prepared = NOTHING
+
+    @staticmethod
+    def next_phase(ctx: Context):
+        """Get the status class and the epoch of the next phase in training, or NOTHING if there is no next phase.
+        """
+        from .status import TrainStatus, ValStatus
+        status = ctx.status
+        if isinstance(status, TrainStatus):
+            # the validation runs on its own context in the background mode
+            if ctx.ctx_check('run.eval_provider') is True and ctx.ctx_check('run.background_val') is False:
+                return ValStatus, ctx.epoch.current
+        elif isinstance(status, ValStatus) is False:
+            # eval and predict have no next phase
+            return NOTHING
+        if is_nothing(ctx.epoch.current) is False and ctx.epoch.current + 1 < ctx.epoch.total:
+            return TrainStatus, ctx.epoch.current + 1
+        return NOTHING
+
+    def prepare(self, ctx: Context):
+        phase = self.next_phase(ctx)
+        if is_nothing(phase) is True or is_nothing(self.prepared) is False:
+            return
+        from .status import TrainStatus
+        status, epoch = phase
+        provider = ctx.run.train_provider if status is TrainStatus else ctx.run.eval_provider
+        if is_nothing(provider) is True or getattr(provider, 'warmup', True) is False:
+            return
+        current = ctx.epoch.current
+        # the providers take the epoch from the context
+        ctx.epoch.current = epoch
+        try:
+            loader = provider(ctx)
+        finally:
+            ctx.epoch.current = current
+        dataset = ctx.dataset.loader if isinstance(ctx.dataset, WarmLoader) else ctx.dataset
+        if loader is dataset:
+            # creating the iterator would reset the one in use
+            return
+        self.prepared = (status, epoch, WarmLoader(loader, iter(loader)))
+        logger.debug('Dataset iterator of the next phase is warmed up: {0} (epoch {1}).'.format(
+            status.__name__, epoch + 1
+        ))
+
+    def take(self, ctx: Context):
+        """Take the prepared loader if it belongs to the current status and epoch, otherwise NOTHING.
+        """
+        if is_nothing(self.prepared) is True:
+            return NOTHING
+        status, epoch, loader = self.prepared
+        self.prepared = NOTHING
+        if type(ctx.status) is status and epoch == ctx.epoch.current:
+            return loader
+        return NOTHING
+
+    def clear(self):
+        self.prepared = NOTHING
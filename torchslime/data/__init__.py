@@ -1,13 +1,16 @@
 from abc import abstractmethod
 from torch.utils.data import DataLoader
 from ..core.context import Context
-from ..util import list_take
+from ..util import NOTHING, list_take
 from ..log import logger
-from typing import Sequence, Tuple, Any, Union
+from typing import NamedTuple, Sequence, Tuple, Any, Union
 
 
 class DataProvider:
 
+    # whether the loader warmup may get the loader of the next phase ahead of time(during the current phase)
+    warmup: bool = True
+
     def __init__(self):
         pass
 
@@ -32,6 +35,15 @@ class ConstantProvider(DataProvider):
         return self.dataset
 
 
+class IndexedBatch(NamedTuple):
+    """
+    Batch(or sample) together with the dataset indices of its samples. The DataParser parses the ``sample`` and
+    sets the indices to ``ctx.step.indices``.
+    """
+    sample: Any
+    indices: Any
+
+
 class DataParser:
 
     def __init__(self):
@@ -42,7 +54,18 @@ class DataParser:
         pass
 
     def __call__(self, ctx: Context) -> Tuple[Any, Any, Any]:
-        batch = self.get(ctx)
+        if isinstance(ctx.step.batch, IndexedBatch):
+            indexed = ctx.step.batch
+            ctx.step.indices = indexed.indices
+            # the parser takes the sample data only
+            ctx.step.batch = indexed.sample
+            try:
+                batch = self.get(ctx)
+            finally:
+                ctx.step.batch = indexed
+        else:
+            ctx.step.indices = NOTHING
+            batch = self.get(ctx)
         if isinstance(batch, tuple) is False or len(batch) != 3:
             logger.warn('DataParser returns a non-tuple object or the tuple length is not 3, this may cause value-unpack excpetions.')
         return batch
@@ -0,0 +1,189 @@
+"""
+Length-bucketed dynamic batching for variable-length inputs.
+"""
+from typing import Any, Callable, Dict, List, Sequence, Union
+from torch import Tensor
+from torch.utils.data import DataLoader, Dataset, Sampler
+from torch.utils.data.dataloader import default_collate
+import torch
+from . import DataProvider
+from ..core.context import Context
+from ..util import NOTHING, is_nothing
+
+
+def default_length(sample) -> int:
+    """Get the length of a sample (the first dim of its first field).
+    """
+    if isinstance(sample, dict):
+        sample = next(iter(sample.values()))
+    elif isinstance(sample, (list, tuple)):
+        sample = sample[0]
+    return sample.shape[0] if isinstance(sample, Tensor) and sample.dim() > 0 else len(sample)
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that groups samples of similar length, and each batch contains at most ``max_tokens`` elements
+    (the max length in the batch multiplied by the number of samples) rather than a fixed number of samples.
+
+    Every epoch the indices are shuffled with ``seed + epoch``, split into buckets of ``bucket_size`` samples and
+    sorted by length in each bucket. Batches are then built greedily in each bucket, and the batch order is
+    shuffled again.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        max_tokens: int,
+        max_batch_size: int = None,
+        bucket_size: int = None,
+        shuffle: bool = True,
+        seed: int = 0
+    ):
+        self.lengths = [int(length) for length in lengths]
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        # sort the whole dataset by length if the bucket size is not set
+        self.bucket_size = bucket_size if bucket_size is not None else len(self.lengths)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.batches = None
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        if self.shuffle is True:
+            indices = torch.randperm(len(self.lengths), generator=generator).tolist()
+        else:
+            indices = list(range(len(self.lengths)))
+
+        batches = []
+        for start in range(0, len(indices), max(self.bucket_size, 1)):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda index: self.lengths[index])
+            batch, max_length = [], 0
+            for index in bucket:
+                length = max(max_length, self.lengths[index])
+                if len(batch) > 0 and (
+                    length * (len(batch) + 1) > self.max_tokens or
+                    (self.max_batch_size is not None and len(batch) >= self.max_batch_size)
+                ):
+                    batches.append(batch)
+                    batch, length = [], self.lengths[index]
+                batch.append(index)
+                max_length = length
+            if len(batch) > 0:
+                batches.append(batch)
+
+        if self.shuffle is True:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator).tolist()]
+        self.batches = batches
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+
+class PadCollate:
+    """
+    Collate function that pads variable-length tensors only to the max length in the batch.
+
+    Args:
+        pad_value (Any, optional): padding value. Defaults to 0.
+        return_lengths (bool, optional): append the lengths of the first tensor field to tuple batches (or
+            add a 'lengths' key to dict batches), so it can be taken by IndexParser as extra data. Defaults to False.
+    """
+
+    def __init__(self, pad_value: Any = 0, return_lengths: bool = False):
+        self.pad_value = pad_value
+        self.return_lengths = return_lengths
+
+    def __call__(self, samples: List):
+        lengths = []
+        first = samples[0]
+        if isinstance(first, dict):
+            batch = {key: self.collate([sample[key] for sample in samples], lengths) for key in first}
+            if self.return_lengths is True:
+                batch['lengths'] = lengths[0]
+            return batch
+        elif isinstance(first, (list, tuple)):
+            batch = [self.collate([sample[i] for sample in samples], lengths) for i in range(len(first))]
+            if self.return_lengths is True:
+                batch.append(lengths[0])
+            return tuple(batch)
+        return self.collate(samples, lengths)
+
+    def collate(self, items: List, lengths: List):
+        if isinstance(items[0], Tensor) and items[0].dim() > 0:
+            item_lengths = torch.tensor([item.shape[0] for item in items])
+            lengths.append(item_lengths)
+            if all(item.shape == items[0].shape for item in items):
+                return torch.stack(items)
+            output = items[0].new_full((len(items), int(item_lengths.max()), *items[0].shape[1:]), self.pad_value)
+            for i, item in enumerate(items):
+                output[i, :item.shape[0]] = item
+            return output
+        return default_collate(items)
+
+
+class BucketProvider(DataProvider):
+    """
+    Data provider that builds length-bucketed dynamic batches with a token (element) budget.
+
+    The batch sizes are uneven, and the AverageHandler weights each step by its number of samples, so the average
+    loss and metrics stay correct.
+
+    Args:
+        dataset (Dataset): map-style dataset.
+        max_tokens (int): max elements (max length multiplied by the number of samples) in a batch.
+        lengths (Union[Sequence[int], Callable[[Any], int]], optional): length of each sample, or a function that
+            computes the length of a sample. The dataset is iterated once to compute the lengths if it is a
+            function. Defaults to ``default_length``.
+        max_batch_size (int, optional): max samples in a batch. Defaults to None.
+        bucket_size (int, optional): number of samples in each sorting bucket. Defaults to None(the whole dataset).
+        shuffle (bool, optional): shuffle the samples and batches every epoch. Defaults to True.
+        seed (int, optional): shuffle seed. Defaults to 0.
+        collate_fn (Callable, optional): collate function. Defaults to ``PadCollate()``.
+        loader_options (Dict, optional): other DataLoader options, e.g., ``num_workers`` and ``pin_memory``.
+    """
+
+    # the loader is shared across epochs, and rebuilding the batches of the next epoch ahead would change the
+    # length of the current one
+    warmup = False
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        max_tokens: int,
+        lengths: Union[Sequence[int], Callable[[Any], int]] = None,
+        max_batch_size: int = None,
+        bucket_size: int = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        collate_fn: Callable = None,
+        loader_options: Dict = None
+    ):
+        super().__init__()
+        self.dataset = dataset
+        lengths = default_length if lengths is None else lengths
+        if callable(lengths):
+            lengths = [lengths(dataset[i]) for i in range(len(dataset))]
+        self.batch_sampler = BucketBatchSampler(lengths, max_tokens, max_batch_size, bucket_size, shuffle, seed)
+        self.collate_fn = collate_fn if collate_fn is not None else PadCollate()
+        self.loader_options = loader_options if loader_options is not None else {}
+        self.loader = NOTHING
+
+    def get(self, ctx: Context) -> DataLoader:
+        if is_nothing(ctx.epoch.current) is False:
+            self.batch_sampler.set_epoch(ctx.epoch.current)
+        # the batches are rebuilt in place, so the loader(and its persistent workers) is reused across epochs
+        if is_nothing(self.loader) is True:
+            self.loader = DataLoader(
+                self.dataset,
+                batch_sampler=self.batch_sampler,
+                collate_fn=self.collate_fn,
+                **self.loader_options
+            )
+        return self.loader
@@ -0,0 +1,315 @@
+"""
+Caching data provider that materializes collated batches on the first pass and replays them in later epochs.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Union
+from torch import Tensor
+from torch.utils.data import DataLoader
+import torch
+import tempfile
+import shutil
+import os
+from . import DataProvider, ConstantProvider
+from ..core.context import Context
+from ..util import NOTHING, is_nothing
+from ..log import logger
+
+
+def batch_nbytes(batch) -> int:
+    """Compute the total bytes of the tensors in a (nested) batch.
+    """
+    if isinstance(batch, Tensor):
+        return batch.element_size() * batch.numel()
+    elif isinstance(batch, dict):
+        return sum(batch_nbytes(value) for value in batch.values())
+    elif isinstance(batch, (list, tuple)):
+        return sum(batch_nbytes(item) for item in batch)
+    return 0
+
+
+class BatchStore:
+    """
+    LRU batch store with a byte budget. The store is keyed by the batch index in the iteration.
+
+    The batches are replayed cyclically in the same order every epoch, where LRU evicts exactly the batch needed
+    next, so the caching provider puts the batches without eviction: the batches that fit in the budget stay, and
+    the others are recomputed every epoch.
+    """
+
+    def __init__(self, budget: int = None):
+        super().__init__()
+        # max bytes of the store. None means unlimited.
+        self.budget = budget
+        # current bytes of the store
+        self.nbytes = 0
+        # batch index -> bytes, ordered by recent usage
+        self._lru = OrderedDict()
+
+    def get(self, key: int):
+        if key not in self._lru:
+            return NOTHING
+        self._lru.move_to_end(key)
+        return self.load(key)
+
+    def put(self, key: int, batch, evict: bool = True) -> bool:
+        """Put the batch into the store. If ``evict`` is False, the batch is not cached when the budget is full.
+        """
+        nbytes = batch_nbytes(batch)
+        if self.budget is not None and nbytes > self.budget:
+            # a single batch that exceeds the whole budget is never cached
+            return False
+        if evict is False and self.budget is not None and \
+                self.nbytes - self._lru.get(key, 0) + nbytes > self.budget:
+            return False
+        self.remove(key)
+        # evict the least recently used batches
+        while self.budget is not None and self.nbytes + nbytes > self.budget and len(self._lru) > 0:
+            self.remove(next(iter(self._lru)))
+        self.save(key, batch)
+        self._lru[key] = nbytes
+        self.nbytes += nbytes
+        return True
+
+    def remove(self, key: int):
+        if key in self._lru:
+            self.nbytes -= self._lru.pop(key)
+            self.delete(key)
+
+    def clear(self):
+        for key in list(self._lru.keys()):
+            self.remove(key)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._lru
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def load(self, key: int):
+        pass
+
+    def save(self, key: int, batch):
+        pass
+
+    def delete(self, key: int):
+        pass
+
+
+class MemoryStore(BatchStore):
+    """
+    Keep cached batches in the process memory.
+    """
+
+    def __init__(self, budget: int = None):
+        super().__init__(budget)
+        self._batches = {}
+
+    def load(self, key: int):
+        return self._batches[key]
+
+    def save(self, key: int, batch):
+        self._batches[key] = batch
+
+    def delete(self, key: int):
+        self._batches.pop(key, None)
+
+
+class DiskStore(BatchStore):
+    """
+    Keep cached batches in files, which are memory-mapped back when replaying, so the OS page cache holds the data
+    instead of the python heap.
+    """
+
+    def __init__(self, budget: int = None, cache_dir: str = None):
+        super().__init__(budget)
+        # use a temporary directory if the cache dir is not specified
+        self._temp = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp(prefix='torchslime_cache_') if cache_dir is None else cache_dir
+        if os.path.exists(self.cache_dir) is False:
+            os.makedirs(self.cache_dir)
+
+    def path(self, key: int) -> str:
+        return os.path.join(self.cache_dir, 'batch_{0}.pt'.format(key))
+
+    def load(self, key: int):
+        try:
+            return torch.load(self.path(key), mmap=True, weights_only=False)
+        except TypeError:
+            # ``mmap`` is not supported in the current pytorch version
+            return torch.load(self.path(key))
+
+    def save(self, key: int, batch):
+        torch.save(batch, self.path(key))
+
+    def delete(self, key: int):
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+
+    def __del__(self):
+        if self._temp is True:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class CachedLoader:
+    """
+    Iterable that yields batches from the cache, and falls back to the source loader when the batch is missing
+    (never cached or evicted).
+    """
+
+    def __init__(self, provider: 'CachingProvider', recording: bool):
+        super().__init__()
+        self.provider = provider
+        # whether the source loader should be fully iterated and recorded
+        self.recording = recording
+
+    def __iter__(self):
+        provider = self.provider
+        if self.recording is True:
+            count = 0
+            for count, batch in enumerate(provider.loader, 1):
+                provider.store.put(count - 1, batch, evict=False)
+                yield batch
+            # the cache is complete only when the source loader is fully iterated
+            provider.length = count
+            return
+
+        # source iterator that is created only when cache misses happen
+        source, position = None, 0
+        for key in range(provider.length):
+            batch = provider.store.get(key)
+            if is_nothing(batch) is False:
+                yield batch
+                continue
+            batch = provider.fetch(key)
+            if is_nothing(batch) is True:
+                # the batch cannot be fetched by index, so iterate the source loader sequentially
+                if source is None:
+                    provider.warn_sequential()
+                if source is None or position > key:
+                    source, position = iter(provider.loader), 0
+                while position <= key:
+                    batch = next(source)
+                    position += 1
+            # only free space is used(e.g., after the budget is raised), so the cached batches are kept
+            provider.store.put(key, batch, evict=False)
+            yield batch
+
+    def __len__(self):
+        if self.recording is True or self.provider.length is None:
+            return len(self.provider.loader)
+        return self.provider.length
+
+
+class CachingProvider(DataProvider):
+    """
+    Data provider that records the collated batches of the source provider on the first pass and replays them
+    from memory or disk in later epochs, so deterministic preprocessing is not recomputed every epoch.
+
+    The batch order of the first pass is replayed, so it is mainly designed for the eval provider (or train data
+    without shuffling). Under the byte budget, the first batches that fit are kept, and the others are recomputed
+    every epoch from the dataset with the batch indices recorded in the first pass when the source is a map-style
+    DataLoader(the source loader is iterated again otherwise, which assumes a deterministic order).
+
+    Args:
+        provider (Union[DataLoader, DataProvider]): the source data.
+        version (Union[Any, Callable[[Context], Any]], optional): user-supplied version key (or a function that
+            computes the key from the context). The cache is considered stale and rebuilt when the key changes.
+        budget (int, optional): max bytes of the cache. None means unlimited. Defaults to None.
+        store (str, optional): 'memory' or 'disk'. Defaults to 'memory'.
+        cache_dir (str, optional): directory of the disk store. A temporary directory is used if None.
+    """
+
+    def __init__(
+        self,
+        provider: Union[DataLoader, DataProvider],
+        version: Union[Any, Callable[[Context], Any]] = None,
+        budget: int = None,
+        store: str = 'memory',
+        cache_dir: str = None
+    ):
+        super().__init__()
+        self.provider = provider if isinstance(provider, DataProvider) else ConstantProvider(provider)
+        self.version = version
+        store_supported = ['memory', 'disk']
+        if store not in store_supported:
+            logger.warn('An unsupported cache store is set, and it is set to \'memory\' instead.')
+            store = 'memory'
+        self.store = MemoryStore(budget) if store == 'memory' else DiskStore(budget, cache_dir)
+        # the source loader of the first pass
+        self.loader = NOTHING
+        # number of batches. None means the first pass is not finished yet.
+        self.length = None
+        # the version key that the cache is built with
+        self._cached_version = NOTHING
+        # sample indices of each batch, used to recompute the uncached batches
+        self._batch_indices = None
+        self._warned = False
+
+    def get(self, ctx: Context) -> CachedLoader:
+        version = self.version(ctx) if callable(self.version) else self.version
+        if is_nothing(self._cached_version) is False and version != self._cached_version:
+            logger.info('CachingProvider version changed from {0} to {1}, and the cache is rebuilt.'.format(
+                self._cached_version, version
+            ))
+            self.invalidate()
+        self._cached_version = version
+
+        if is_nothing(self.loader) is True or self.length is None:
+            self.loader = self.fix_batches(self.provider(ctx))
+            return CachedLoader(self, recording=True)
+        return CachedLoader(self, recording=False)
+
+    def __call__(self, ctx: Context) -> CachedLoader:
+        # the cached loader is not a DataLoader, so the type check warning is skipped.
+        return self.get(ctx)
+
+    def fix_batches(self, loader):
+        """Draw the batch indices of the recording pass in advance and record them, so the batches that are not
+        cached under the budget are recomputed with the same samples even if the source loader shuffles.
+        """
+        if self.store.budget is None or isinstance(loader, DataLoader) is False or loader.batch_sampler is None:
+            return loader
+        try:
+            _ = len(loader.dataset)
+        except Exception:
+            # iterable-style dataset
+            return loader
+        self._batch_indices = [list(indices) for indices in loader.batch_sampler]
+        names = [
+            'num_workers', 'collate_fn', 'pin_memory', 'timeout', 'worker_init_fn', 'multiprocessing_context',
+            'generator', 'prefetch_factor', 'persistent_workers', 'pin_memory_device', 'in_order'
+        ]
+        options = {name: getattr(loader, name) for name in names if hasattr(loader, name)}
+        return DataLoader(loader.dataset, batch_sampler=self._batch_indices, **options)
+
+    def warn_sequential(self):
+        if self._warned is False:
+            self._warned = True
+            logger.warn('The batches missing from the cache cannot be fetched by index, and the source loader is '
+                        'iterated again to recompute them, which assumes the source yields the same batch order.')
+
+    def fetch(self, key: int):
+        """Recompute a single batch through the dataset and the batch sampler of the source DataLoader.
+        Return NOTHING if the source is not a map-style DataLoader.
+        """
+        loader = self.loader
+        if isinstance(loader, DataLoader) is False or loader.batch_sampler is None:
+            return NOTHING
+        try:
+            _ = len(loader.dataset)
+        except Exception:
+            # iterable-style dataset
+            return NOTHING
+        if self._batch_indices is None:
+            self._batch_indices = list(loader.batch_sampler)
+        if key >= len(self._batch_indices):
+            return NOTHING
+        return loader.collate_fn([loader.dataset[i] for i in self._batch_indices[key]])
+
+    def invalidate(self):
+        """Clear the cache, and the source data will be recorded again in the next epoch.
+        """
+        self.store.clear()
+        self.loader = NOTHING
+        self.length = None
+        self._batch_indices = None
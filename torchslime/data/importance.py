@@ -0,0 +1,293 @@
+"""
+Loss-aware importance sampling: the samples of an epoch are drawn in proportion to their most recent training losses,
+and the loss is reweighted by the inverse sampling probability, so the gradient stays an unbiased estimate of the
+full-dataset gradient while the easy samples are visited less often.
+"""
+from typing import Any, Callable, Dict, List
+from torch import Tensor
+from torch.utils.data import DataLoader, Dataset, Sampler
+from torch.utils.data.dataloader import default_collate
+import copy
+import math
+import torch
+from . import DataProvider, IndexedBatch
+from ..core.context import Context
+from ..util import NOTHING, is_nothing
+from ..log import logger
+
+
+class IndexedDataset(Dataset):
+    """
+    Map-style dataset that returns each sample together with its index.
+    """
+
+    def __init__(self, dataset: Dataset):
+        super().__init__()
+        self.dataset = dataset
+
+    def __getitem__(self, index: int) -> IndexedBatch:
+        return IndexedBatch(self.dataset[index], index)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+
+class IndexedCollate:
+    """
+    Collate the samples with ``collate_fn`` and their indices into a tensor.
+    """
+
+    def __init__(self, collate_fn: Callable = None):
+        self.collate_fn = collate_fn if collate_fn is not None else default_collate
+
+    def __call__(self, samples: List[IndexedBatch]) -> IndexedBatch:
+        return IndexedBatch(
+            self.collate_fn([sample.sample for sample in samples]),
+            torch.tensor([sample.indices for sample in samples], dtype=torch.long)
+        )
+
+
+class ImportanceSampler(Sampler):
+    """
+    Sampler that draws ``fraction`` of the dataset every epoch(with replacement) with probabilities proportional to
+    ``loss ** alpha``, mixed with the uniform distribution by ``smoothing``, so every sample keeps a chance to be
+    visited and its loss to be updated. The first ``warmup_epochs`` epochs are full shuffled passes that record the
+    losses of all samples, and the samples without a recorded loss take the max recorded loss.
+
+    The importance weight of sample i is ``1 / (N * p_i)`` (1 in uniform sampling), by which the LossHandler weights
+    the per-sample losses. The per-sample losses are recorded as they are computed and applied when the next epoch
+    is sampled, so the training does not synchronize with the device.
+
+    Args:
+        size (int): number of samples in the dataset.
+        fraction (float, optional): samples drawn every epoch, as a fraction of the dataset. Defaults to 1.0.
+        alpha (float, optional): exponent of the losses. 0 is uniform sampling. Defaults to 1.0.
+        smoothing (float, optional): weight of the uniform distribution in the mixture. Defaults to 0.1.
+        max_weight (float, optional): upper bound of the importance weights, which bounds the variance at the cost
+            of a small bias. Defaults to None.
+        warmup_epochs (int, optional): epochs of uniform full passes at the beginning. Defaults to 1.
+        sample_loss (Callable, optional): function that computes the per-sample losses from ``y_pred`` and
+            ``y_true``. Defaults to None(the loss function of the run with ``reduction='none'``).
+        seed (int, optional): sampling seed. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        fraction: float = 1.0,
+        alpha: float = 1.0,
+        smoothing: float = 0.1,
+        max_weight: float = None,
+        warmup_epochs: int = 1,
+        sample_loss: Callable[[Any, Any], Tensor] = None,
+        seed: int = 0
+    ):
+        if fraction <= 0 or fraction > 1:
+            raise ValueError('Fraction of the importance sampling should be in (0, 1], but got {0}.'.format(fraction))
+        if smoothing < 0 or smoothing > 1:
+            raise ValueError('Smoothing of the importance sampling should be in [0, 1], but got {0}.'.format(
+                smoothing
+            ))
+        self.size = size
+        self.fraction = fraction
+        self.alpha = alpha
+        self.smoothing = smoothing
+        self.max_weight = max_weight
+        self.warmup_epochs = warmup_epochs
+        self.sample_loss = sample_loss
+        self.seed = seed
+        # the most recent loss of each sample
+        self.losses = torch.zeros(size)
+        self.seen = torch.zeros(size, dtype=torch.bool)
+        # (indices, losses) recorded since the last sampling
+        self.pending = []
+        # importance weights and the drawn indices of the current epoch
+        self.weights = torch.ones(size)
+        self.indices: Tensor = NOTHING
+        self.epoch = NOTHING
+        # per-epoch sampling records
+        self.history: List[Dict] = []
+        # the loss function of the run and its unreduced copy
+        self._loss_func = NOTHING
+        self._unreduced = NOTHING
+
+    def set_epoch(self, epoch: int):
+        self.flush()
+        if epoch == self.epoch:
+            return
+        self.epoch = epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        if epoch < self.warmup_epochs:
+            self.indices = torch.randperm(self.size, generator=generator)
+            self.weights = torch.ones(self.size)
+        else:
+            probs = self.probabilities()
+            samples = max(math.ceil(self.fraction * self.size), 1)
+            self.indices = torch.multinomial(probs, samples, replacement=True, generator=generator)
+            self.weights = 1 / (self.size * probs)
+            if self.max_weight is not None:
+                self.weights.clamp_(max=self.max_weight)
+
+        record = {
+            'epoch': epoch,
+            'samples': len(self.indices),
+            'fraction': len(self.indices) / self.size,
+            'coverage': len(torch.unique(self.indices)) / self.size,
+            'max_weight': float(self.weights[self.indices].max()) if len(self.indices) > 0 else 1.0
+        }
+        self.history.append(record)
+        logger.info('Importance sampling of epoch {0}: {1} samples({2:.1%} of the dataset), coverage {3:.1%}, '
+                    'max weight {4:.2f}.'.format(
+                        epoch + 1, record['samples'], record['fraction'], record['coverage'], record['max_weight']
+                    ))
+
+    def probabilities(self) -> Tensor:
+        if self.seen.any().item() is False:
+            return torch.full((self.size,), 1 / self.size)
+        # the samples without a recorded loss are treated as the hardest ones
+        scores = torch.where(self.seen, self.losses, self.losses[self.seen].max()).clamp_(min=0)
+        scores = scores.pow(self.alpha) if self.alpha != 1 else scores
+        total = scores.sum()
+        probs = scores / total if total > 0 else torch.full((self.size,), 1 / self.size)
+        return (1 - self.smoothing) * probs + self.smoothing / self.size
+
+    def __iter__(self):
+        return iter(self.indices.tolist())
+
+    def __len__(self) -> int:
+        return len(self.indices) if is_nothing(self.indices) is False else self.size
+
+    def per_sample(self, loss_func: Callable, y_pred: Any, y_true: Any) -> Tensor:
+        """Compute the per-sample losses with ``sample_loss``, or with an unreduced copy of ``loss_func``.
+        """
+        if self.sample_loss is not None:
+            losses = self.sample_loss(y_pred, y_true)
+        else:
+            if loss_func is not self._loss_func:
+                if hasattr(loss_func, 'reduction') is False:
+                    raise ValueError('The loss function has no "reduction" option, set "sample_loss" of the importance '
+                                     'sampling to compute the per-sample losses.')
+                # the copy shares the parameters and buffers(e.g., class weights) of the loss function
+                self._unreduced = copy.copy(loss_func)
+                self._unreduced.reduction = 'none'
+                self._loss_func = loss_func
+            losses = self._unreduced(y_pred, y_true)
+        if losses.dim() == 0:
+            raise ValueError('The per-sample losses should have the batch dim, but got a scalar.')
+        return losses.reshape(losses.shape[0], -1).mean(dim=1) if losses.dim() > 1 else losses
+
+    def weighted_loss(self, loss_func: Callable, y_pred: Any, y_true: Any, indices: Tensor) -> Tensor:
+        """Compute the importance-weighted loss of the batch, and record the per-sample losses.
+        """
+        losses = self.per_sample(loss_func, y_pred, y_true)
+        self.record(indices, losses)
+        weights = self.weights[indices.cpu()].to(device=losses.device, dtype=losses.dtype)
+        return (losses * weights).mean()
+
+    def record(self, indices: Tensor, losses: Tensor):
+        self.pending.append((indices, losses.detach()))
+
+    def flush(self):
+        """Apply the recorded per-sample losses.
+        """
+        if len(self.pending) == 0:
+            return
+        indices = torch.cat([item[0].cpu() for item in self.pending])
+        losses = torch.cat([item[1].float().cpu() for item in self.pending])
+        self.pending = []
+        # the later losses of the samples drawn more than once are kept
+        self.losses[indices] = losses
+        self.seen[indices] = True
+
+    @property
+    def stats(self) -> Dict:
+        """The sampling record of the current epoch, and the samples drawn in all epochs(also as a number of full
+        passes, which is compared with uniform training to measure the time-to-accuracy gain).
+        """
+        if len(self.history) == 0:
+            return {}
+        total = sum(record['samples'] for record in self.history)
+        return dict(self.history[-1], total_samples=total, total_passes=total / self.size)
+
+
+class ImportanceProvider(DataProvider):
+    """
+    Data provider of the loss-aware importance sampling. The batches are ``IndexedBatch``, whose sample indices are
+    set to ``ctx.step.indices`` by the DataParser, and the sampler is set to ``ctx.run.importance``, with which the
+    LossHandler weights the training loss and records the per-sample losses.
+
+    Args:
+        dataset (Dataset): map-style dataset.
+        batch_size (int): batch size.
+        fraction (float, optional): samples drawn every epoch, as a fraction of the dataset. Defaults to 1.0.
+        alpha (float, optional): exponent of the losses. Defaults to 1.0.
+        smoothing (float, optional): weight of the uniform distribution in the mixture. Defaults to 0.1.
+        max_weight (float, optional): upper bound of the importance weights. Defaults to None.
+        warmup_epochs (int, optional): epochs of uniform full passes at the beginning. Defaults to 1.
+        sample_loss (Callable, optional): function that computes the per-sample losses. Defaults to None.
+        seed (int, optional): sampling seed. Defaults to 0.
+        drop_last (bool, optional): drop the last incomplete batch. Defaults to False.
+        collate_fn (Callable, optional): collate function of the samples. Defaults to None(``default_collate``).
+        loader_options (Dict, optional): other DataLoader options, e.g., ``num_workers`` and ``pin_memory``.
+    """
+
+    # the next epoch is sampled when its loader is requested, after the losses of the current epoch are recorded
+    warmup = False
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        batch_size: int,
+        fraction: float = 1.0,
+        alpha: float = 1.0,
+        smoothing: float = 0.1,
+        max_weight: float = None,
+        warmup_epochs: int = 1,
+        sample_loss: Callable[[Any, Any], Tensor] = None,
+        seed: int = 0,
+        drop_last: bool = False,
+        collate_fn: Callable = None,
+        loader_options: Dict = None
+    ):
+        super().__init__()
+        self.dataset = IndexedDataset(dataset)
+        self.sampler = ImportanceSampler(
+            len(dataset), fraction, alpha, smoothing, max_weight, warmup_epochs, sample_loss, seed
+        )
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.collate_fn = IndexedCollate(collate_fn)
+        self.loader_options = loader_options if loader_options is not None else {}
+        self.loader = NOTHING
+        # epoch counter when the epoch context is not set
+        self._epoch = 0
+
+    def get(self, ctx: Context) -> DataLoader:
+        if is_nothing(ctx.epoch.current) is False:
+            self.sampler.set_epoch(ctx.epoch.current)
+        else:
+            self.sampler.set_epoch(self._epoch)
+            self._epoch += 1
+        ctx.run.importance = self.sampler
+        # the indices are drawn in place, so the loader(and its persistent workers) is reused across epochs
+        if is_nothing(self.loader) is True:
+            self.loader = DataLoader(
+                self.dataset,
+                batch_size=self.batch_size,
+                sampler=self.sampler,
+                collate_fn=self.collate_fn,
+                drop_last=self.drop_last,
+                **self.loader_options
+            )
+        return self.loader
+
+    @property
+    def effective_fraction(self) -> float:
+        """Samples drawn in the current epoch as a fraction of the dataset.
+        """
+        return self.sampler.stats.get('fraction', 1.0)
+
+    @property
+    def stats(self) -> Dict:
+        return self.sampler.stats
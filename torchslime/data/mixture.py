@@ -0,0 +1,409 @@
+"""
+Multi-source data provider that interleaves the batches(or samples) of several sources by weight.
+
+Every source is prefetched by a background thread, so a slow source only blocks the steps that draw from it. The
+draws are seeded by ``seed`` and the epoch, and the per-source throughput and stall time are reported at the end of
+every epoch.
+"""
+from typing import Any, Dict, List, Sequence, Union
+from torch.utils.data import DataLoader, Dataset, IterableDataset
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+from collections import Counter
+from time import time
+import operator
+import random
+import math
+import torch
+from torch import Tensor
+from . import DataProvider
+from .stream import StreamLoader
+from ..core.context import Context
+from ..core.microbatch import concat_outputs
+from ..util import NOTHING, is_nothing, get_batch_size
+from ..log import logger
+
+MIXTURE_MODES = ['batch', 'sample']
+STOP_POLICIES = ['first', 'all']
+# end mark of a source iteration
+_END = object()
+
+
+class _SourceError:
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def slice_batch(batch, start: int, end: int, total: int):
+    """Slice the tensors whose first dim is ``total`` in a (nested) batch. Other objects are kept as they are.
+    """
+    if isinstance(batch, Tensor) and batch.dim() > 0 and batch.size(0) == total:
+        return batch[start:end]
+    elif isinstance(batch, dict):
+        return type(batch)((key, slice_batch(value, start, end, total)) for key, value in batch.items())
+    elif isinstance(batch, tuple) and hasattr(batch, '_fields'):
+        # namedtuple
+        return type(batch)(*(slice_batch(item, start, end, total) for item in batch))
+    elif isinstance(batch, (list, tuple)):
+        return type(batch)(slice_batch(item, start, end, total) for item in batch)
+    return batch
+
+
+class SourcePrefetcher:
+    """
+    Iterate a source loader in a background thread, and keep up to ``prefetch`` batches ready.
+    """
+
+    def __init__(self, name: str, loader, prefetch: int = 2):
+        self.name = name
+        self.loader = loader
+        self.queue = Queue(maxsize=max(prefetch, 1))
+        self.stop_event = Event()
+        self.thread = None
+        # statistics
+        self.batches = 0
+        self.samples = 0
+        self.fetch_time = 0.
+        self.stall_time = 0.
+        # batches since the last (re)start, used to detect empty sources
+        self.pass_batches = 0
+        # current batch and offset of the sample mode
+        self.buffer = NOTHING
+        self.offset = 0
+        self.size = 0
+
+    def start(self):
+        self.pass_batches = 0
+        self.thread = Thread(target=self.run, name='mixture-{0}'.format(self.name), daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            iterator = iter(self.loader)
+            while self.stop_event.is_set() is False:
+                start = time()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                self.fetch_time += time() - start
+                self.put(batch)
+        except Exception as e:
+            # re-raised in the main thread
+            self.put(_SourceError(e))
+            return
+        self.put(_END)
+
+    def put(self, item):
+        while self.stop_event.is_set() is False:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def ready(self) -> bool:
+        return self.queue.empty() is False
+
+    def get(self):
+        start = time()
+        item = self.queue.get()
+        self.stall_time += time() - start
+        if item is _END:
+            return _END
+        if isinstance(item, _SourceError):
+            raise item.error
+        batch_size = get_batch_size(item)
+        self.batches += 1
+        self.pass_batches += 1
+        self.samples += batch_size if is_nothing(batch_size) is False else 0
+        return item
+
+    def close(self):
+        self.stop_event.set()
+        # unblock the thread
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+
+    def summary(self, elapsed: float) -> Dict:
+        return {
+            'batches': self.batches,
+            'samples': self.samples,
+            # throughput of the source itself, excluding the time waiting for the queue space
+            'samples_per_sec': self.samples / self.fetch_time if self.fetch_time > 0 else NOTHING,
+            'stall_time': self.stall_time,
+            # fraction of the epoch time that the main thread is blocked by this source
+            'stall': self.stall_time / elapsed if elapsed > 0 else 0.
+        }
+
+
+class MixtureDataset(IterableDataset):
+    """
+    Iterable dataset that yields the interleaved batches of the source loaders. It is iterated in the main process,
+    and the source loaders use their own workers.
+    """
+
+    def __init__(
+        self,
+        loaders: Sequence,
+        names: Sequence[str],
+        weights: Sequence[float],
+        mode: str = 'batch',
+        batch_size: int = None,
+        epoch_steps: int = None,
+        stop: str = 'first',
+        seed: int = 0,
+        epoch: int = 0,
+        prefetch: int = 2,
+        skip_stalled: bool = False
+    ):
+        super().__init__()
+        self.loaders = list(loaders)
+        self.names = list(names)
+        self.weights = list(weights)
+        self.mode = mode
+        self.batch_size = batch_size
+        self.epoch_steps = epoch_steps
+        self.stop = stop
+        self.seed = seed
+        self.epoch = epoch
+        self.prefetch = prefetch
+        self.skip_stalled = skip_stalled
+        self.stats: Dict = {}
+
+    def __len__(self):
+        if self.epoch_steps is None:
+            raise TypeError('The steps of the mixture are unknown, and length_hint is an estimation.')
+        return self.epoch_steps
+
+    def __length_hint__(self) -> int:
+        if self.epoch_steps is not None:
+            return self.epoch_steps
+        lengths = [operator.length_hint(loader, 0) for loader in self.loaders]
+        if self.mode == 'sample':
+            # number of samples of the sources
+            lengths = [
+                length * (getattr(loader, 'batch_size', None) or 0) for length, loader in zip(lengths, self.loaders)
+            ]
+        if any(length == 0 for length in lengths):
+            return 0
+        total = sum(self.weights)
+        if self.stop == 'all':
+            steps = sum(lengths)
+        else:
+            # expected draws before the first source is exhausted
+            steps = min(length * total / weight for length, weight in zip(lengths, self.weights) if weight > 0)
+        return math.ceil(steps / self.batch_size) if self.mode == 'sample' else int(steps)
+
+    def __iter__(self):
+        # the sources start prefetching when the iterator is created rather than at the first batch
+        sources = [SourcePrefetcher(name, loader, self.prefetch) for name, loader in zip(self.names, self.loaders)]
+        for source in sources:
+            source.start()
+        return self.iterate(sources)
+
+    def iterate(self, sources: List[SourcePrefetcher]):
+        rng = random.Random('{0}-{1}'.format(self.seed, self.epoch))
+        start = time()
+        try:
+            yield from (self.iter_batches(sources, rng) if self.mode == 'batch' else self.iter_samples(sources, rng))
+        finally:
+            for source in sources:
+                source.close()
+            self.report(sources, time() - start)
+
+    def draw(self, rng: random.Random, active: List[int], k: int = 1) -> List[int]:
+        return rng.choices(active, weights=[self.weights[index] for index in active], k=k)
+
+    def exhausted(self, source: SourcePrefetcher, active: List[int], index: int) -> bool:
+        """Handle an exhausted source. Return True if the epoch ends.
+        """
+        if self.epoch_steps is not None and source.pass_batches > 0:
+            # restart the source until the epoch steps are reached
+            source.start()
+            return False
+        if self.epoch_steps is None and self.stop == 'first':
+            return True
+        active.remove(index)
+        return len(active) == 0
+
+    def iter_batches(self, sources: List[SourcePrefetcher], rng: random.Random):
+        active = [index for index, weight in enumerate(self.weights) if weight > 0]
+        # the drawn sources in order. With ``skip_stalled``, a lookahead window of draws is kept, and the first draw
+        # whose source is ready is served before the stalled ones, so only the order of the draws changes
+        window = max(self.prefetch, 1) * len(sources) if self.skip_stalled is True else 1
+        pending = []
+        step = 0
+        while len(active) > 0 and (self.epoch_steps is None or step < self.epoch_steps):
+            pending.extend(self.draw(rng, active, window - len(pending)))
+            position = 0
+            if self.skip_stalled is True:
+                position = next((i for i, index in enumerate(pending) if sources[index].ready()), 0)
+            index = pending.pop(position)
+            batch = sources[index].get()
+            if batch is _END:
+                if self.exhausted(sources[index], active, index) is True:
+                    return
+                pending = [item for item in pending if item in active]
+                continue
+            step += 1
+            yield batch
+
+    def take(self, source: SourcePrefetcher, count: int, pieces: List) -> int:
+        """Take up to ``count`` samples of the source. Return the number of samples taken, which is less than
+        ``count`` only if the source is exhausted.
+        """
+        taken = 0
+        while taken < count:
+            if is_nothing(source.buffer) is True or source.offset >= source.size:
+                batch = source.get()
+                if batch is _END:
+                    source.buffer = NOTHING
+                    return taken
+                source.buffer, source.offset, source.size = batch, 0, get_batch_size(batch)
+            end = min(source.offset + count - taken, source.size)
+            pieces.append(slice_batch(source.buffer, source.offset, end, source.size))
+            taken += end - source.offset
+            source.offset = end
+        return taken
+
+    def iter_samples(self, sources: List[SourcePrefetcher], rng: random.Random):
+        active = [index for index, weight in enumerate(self.weights) if weight > 0]
+        step = 0
+        while len(active) > 0 and (self.epoch_steps is None or step < self.epoch_steps):
+            pieces = []
+            remaining = self.batch_size
+            end = False
+            while remaining > 0 and len(active) > 0 and end is False:
+                counts = Counter(self.draw(rng, active, remaining))
+                for index in sorted(counts.keys()):
+                    taken = self.take(sources[index], counts[index], pieces)
+                    remaining -= taken
+                    if taken < counts[index] and self.exhausted(sources[index], active, index) is True:
+                        end = True
+                        break
+            if len(pieces) == 0:
+                return
+            step += 1
+            # the last incomplete batch is yielded as well
+            yield concat_outputs(pieces) if len(pieces) > 1 else pieces[0]
+            if end is True:
+                return
+
+    def report(self, sources: List[SourcePrefetcher], elapsed: float):
+        self.stats = {source.name: source.summary(elapsed) for source in sources}
+        for name, summary in self.stats.items():
+            speed = summary['samples_per_sec']
+            speed = '{0:.1f}'.format(speed) if is_nothing(speed) is False else '--'
+            message = 'Mixture source {0}: {1} batches, {2} samples/s, stall {3:.1%}'.format(
+                name, summary['batches'], speed, summary['stall']
+            )
+            if summary['stall'] > 0.2:
+                logger.warn(message + ' (slow source)')
+            else:
+                logger.info(message)
+
+
+class MixtureProvider(DataProvider):
+    """
+    Data provider that interleaves several sources by sampling weights.
+
+    Args:
+        sources (Union[Sequence, Dict[str, Any]]): DataProviders, DataLoaders or Datasets, or a dict of them with
+            the source names as keys.
+        weights (Sequence[float], optional): sampling weights of the sources. Defaults to None(equal weights).
+        mode (str, optional): 'batch' draws a source for each batch, and 'sample' draws a source for each sample,
+            so every batch is a mixture. Defaults to 'batch'.
+        batch_size (int, optional): batch size of the 'sample' mode, and of the Dataset sources. Defaults to None.
+        epoch_steps (int, optional): steps of an epoch. The exhausted sources are restarted if it is set.
+            Defaults to None.
+        stop (str, optional): if ``epoch_steps`` is not set, 'first' ends the epoch when any source is exhausted,
+            and 'all' continues with the other sources until all of them are exhausted. Defaults to 'first'.
+        seed (int, optional): seed of the draws and the Dataset shuffling. Defaults to 0.
+        prefetch (int, optional): batches prefetched for each source. Defaults to 2.
+        skip_stalled (bool, optional): in the 'batch' mode, serve a later draw whose batch is ready when the drawn
+            source is stalled, out of the next ``prefetch * len(sources)`` draws. The sources are still drawn by the
+            weights, but the order of the batches is no longer deterministic. Defaults to False.
+        shuffle (bool, optional): shuffle the Dataset sources. Defaults to True.
+        loader_options (Dict, optional): DataLoader options of the Dataset sources, e.g., ``num_workers``.
+    """
+
+    def __init__(
+        self,
+        sources: Union[Sequence, Dict[str, Any]],
+        weights: Sequence[float] = None,
+        mode: str = 'batch',
+        batch_size: int = None,
+        epoch_steps: int = None,
+        stop: str = 'first',
+        seed: int = 0,
+        prefetch: int = 2,
+        skip_stalled: bool = False,
+        shuffle: bool = True,
+        loader_options: Dict = None
+    ):
+        super().__init__()
+        if mode not in MIXTURE_MODES:
+            raise ValueError('Unsupported mixture mode: {0}, which should be one of {1}.'.format(mode, MIXTURE_MODES))
+        if stop not in STOP_POLICIES:
+            raise ValueError('Unsupported stop policy: {0}, which should be one of {1}.'.format(stop, STOP_POLICIES))
+        if mode == 'sample' and batch_size is None:
+            raise ValueError('batch_size should be set in the sample mode.')
+        if isinstance(sources, dict):
+            self.names, self.sources = list(sources.keys()), list(sources.values())
+        else:
+            self.sources = list(sources)
+            self.names = ['source_{0}'.format(i) for i in range(len(self.sources))]
+        self.weights = list(weights) if weights is not None else [1.] * len(self.sources)
+        if len(self.weights) != len(self.sources) or any(weight < 0 for weight in self.weights) or \
+                sum(self.weights) <= 0:
+            raise ValueError('The weights should be non-negative, not all zero, and one for each source.')
+        self.mode = mode
+        self.batch_size = batch_size
+        self.epoch_steps = epoch_steps
+        self.stop = stop
+        self.seed = seed
+        self.prefetch = prefetch
+        self.skip_stalled = skip_stalled
+        self.shuffle = shuffle
+        self.loader_options = loader_options if loader_options is not None else {}
+        self.dataset = NOTHING
+        # epoch counter of the evaluation, where the epoch context is not set
+        self._epoch = 0
+
+    @property
+    def stats(self) -> Dict:
+        """Per-source statistics of the last epoch.
+        """
+        return self.dataset.stats if is_nothing(self.dataset) is False else {}
+
+    def build_loader(self, ctx: Context, index: int, epoch: int):
+        source = self.sources[index]
+        if isinstance(source, DataProvider):
+            return source(ctx)
+        elif isinstance(source, Dataset):
+            options = dict(self.loader_options)
+            if self.shuffle is True and isinstance(source, IterableDataset) is False:
+                generator = torch.Generator()
+                generator.manual_seed(self.seed + epoch * len(self.sources) + index)
+                options.update(shuffle=True, generator=generator)
+            return DataLoader(source, batch_size=self.batch_size if self.batch_size is not None else 1, **options)
+        return source
+
+    def get(self, ctx: Context) -> DataLoader:
+        if is_nothing(ctx.epoch.current) is False:
+            epoch = ctx.epoch.current
+        else:
+            epoch = self._epoch
+            self._epoch += 1
+        self.dataset = MixtureDataset(
+            [self.build_loader(ctx, index, epoch) for index in range(len(self.sources))],
+            self.names, self.weights, self.mode, self.batch_size, self.epoch_steps, self.stop, self.seed, epoch,
+            self.prefetch, self.skip_stalled
+        )
+        # the batches are passed through as they are
+        return StreamLoader(self.dataset, batch_size=None)
@@ -0,0 +1,308 @@
+"""
+TorchSlime memory-mapped dataset format.
+
+A dataset is stored as a directory that contains a ``meta.json`` file and contiguous fixed-dtype ``.npy`` shards
+for each field. Variable-length fields (whose first dim varies from sample to sample) are stored as flattened values
+plus an offsets index. Shards are opened as memory maps, so samples and batches are zero-copy tensor views, and
+several worker processes share the same OS page cache.
+"""
+from bisect import bisect_right
+from typing import Any, Dict, Sequence, Union
+from torch import Tensor
+from torch.utils.data import DataLoader, Dataset, Sampler
+import torch
+import numpy as np
+import json
+import os
+from . import DataProvider
+from ..core.context import Context
+from ..util import is_nothing
+from ..log import logger
+
+META_FILE = 'meta.json'
+
+
+def _to_numpy(value) -> np.ndarray:
+    if isinstance(value, Tensor):
+        return value.detach().cpu().numpy()
+    return np.asarray(value)
+
+
+def _parse_sample(sample):
+    """Parse a sample into (sample type, field names, field values).
+    """
+    if isinstance(sample, dict):
+        return 'dict', list(sample.keys()), [_to_numpy(value) for value in sample.values()]
+    elif isinstance(sample, (list, tuple)):
+        return 'tuple', list(range(len(sample))), [_to_numpy(value) for value in sample]
+    else:
+        return 'single', [0], [_to_numpy(sample)]
+
+
+def _shard_file(path: str, field: int, shard: int, suffix: str = '') -> str:
+    return os.path.join(path, 'field{0}_shard{1}{2}.npy'.format(field, shard, suffix))
+
+
+def write_mmap_dataset(
+    dataset: Dataset,
+    path: str,
+    shard_size: int = 65536,
+    variable: Sequence[Union[str, int]] = None
+):
+    """Convert a map-style dataset into the TorchSlime memory-mapped dataset format.
+
+    Args:
+        dataset (Dataset): map-style dataset whose samples are tensors (or numbers), tuples or dicts of them.
+        path (str): output directory.
+        shard_size (int, optional): number of samples per shard. Defaults to 65536.
+        variable (Sequence[Union[str, int]], optional): names (dict samples) or indexes (tuple samples) of the
+            variable-length fields. If None, fields whose shapes vary in the first shard are treated as variable.
+    """
+    if os.path.exists(path) is False:
+        os.makedirs(path)
+    total = len(dataset)
+    meta = None
+    shard_sizes = []
+    for shard, start in enumerate(range(0, total, shard_size)):
+        # collect samples of the current shard
+        columns = None
+        for index in range(start, min(start + shard_size, total)):
+            sample_type, names, values = _parse_sample(dataset[index])
+            if columns is None:
+                columns = [[] for _ in values]
+            for column, value in zip(columns, values):
+                column.append(value)
+
+        if meta is None:
+            if variable is None:
+                variable = [
+                    name for name, column in zip(names, columns) if len(set(value.shape for value in column)) > 1
+                ]
+            meta = {
+                'type': sample_type,
+                'fields': [
+                    {
+                        'name': name,
+                        'dtype': column[0].dtype.str,
+                        'variable': name in variable,
+                        'shape': list(column[0].shape[1:] if name in variable else column[0].shape)
+                    } for name, column in zip(names, columns)
+                ]
+            }
+
+        for field, (info, column) in enumerate(zip(meta['fields'], columns)):
+            dtype = np.dtype(info['dtype'])
+            if info['variable'] is True:
+                lengths = [value.shape[0] if value.ndim > 0 else 1 for value in column]
+                offsets = np.zeros(len(column) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+                values = np.concatenate([value.reshape(-1, *info['shape']) for value in column]).astype(dtype)
+                np.save(_shard_file(path, field, shard), values)
+                np.save(_shard_file(path, field, shard, '.offsets'), offsets)
+            else:
+                if any(list(value.shape) != info['shape'] for value in column):
+                    raise ValueError(
+                        'Field {0} has inconsistent shapes. Pass it to the "variable" argument to store it as a '
+                        'variable-length field.'.format(info['name'])
+                    )
+                np.save(_shard_file(path, field, shard), np.stack(column).astype(dtype))
+        shard_sizes.append(len(columns[0]))
+
+    if meta is None:
+        logger.warn('An empty dataset is written to the memory-mapped format.')
+        meta = {'type': 'tuple', 'fields': []}
+    meta['shards'] = shard_sizes
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+class MmapDataset(Dataset):
+    """
+    Reader of the TorchSlime memory-mapped dataset format.
+
+    ``dataset[i]`` returns a zero-copy sample, and ``dataset[start:stop]`` returns a batch sliced from the contiguous
+    shards (a copy is made only when the range crosses shard boundaries). Variable-length fields in a batch are
+    padded to the batch maximum with ``pad_value`` if it is set, otherwise they are returned as
+    ``(values, offsets)`` tuples.
+    """
+
+    def __init__(self, path: str, pad_value: Any = None):
+        super().__init__()
+        self.path = path
+        self.pad_value = pad_value
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.fields = self.meta['fields']
+        # start index of each shard
+        self.starts = [0]
+        for size in self.meta['shards']:
+            self.starts.append(self.starts[-1] + size)
+        # memory maps are opened lazily in each process
+        self._shards = None
+
+    def __getstate__(self) -> Dict:
+        # memory maps are not pickled to worker processes, and they are reopened there instead.
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    @property
+    def shards(self):
+        if self._shards is None:
+            self._shards = []
+            for shard in range(len(self.meta['shards'])):
+                arrays = []
+                for field, info in enumerate(self.fields):
+                    # copy-on-write mode makes the arrays writable for ``torch.from_numpy`` without copying data.
+                    values = np.load(_shard_file(self.path, field, shard), mmap_mode='c')
+                    offsets = np.load(
+                        _shard_file(self.path, field, shard, '.offsets'), mmap_mode='c'
+                    ) if info['variable'] is True else None
+                    arrays.append((values, offsets))
+                self._shards.append(arrays)
+        return self._shards
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise IndexError('MmapDataset only supports contiguous slices.')
+            return self.get_batch(start, stop)
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('MmapDataset index out of range.')
+        shard = bisect_right(self.starts, index) - 1
+        local = index - self.starts[shard]
+        sample = []
+        for values, offsets in self.shards[shard]:
+            if offsets is None:
+                sample.append(torch.from_numpy(values[local, ...]))
+            else:
+                sample.append(torch.from_numpy(values[offsets[local]:offsets[local + 1]]))
+        return self._pack(sample)
+
+    def get_batch(self, start: int, stop: int):
+        """Get a batch of samples in the index range [start, stop).
+        """
+        columns = [[] for _ in self.fields]
+        first = bisect_right(self.starts, start) - 1
+        for shard in range(first, len(self.meta['shards'])):
+            if self.starts[shard] >= stop:
+                break
+            local_start = max(start, self.starts[shard]) - self.starts[shard]
+            local_stop = min(stop, self.starts[shard + 1]) - self.starts[shard]
+            for column, (values, offsets) in zip(columns, self.shards[shard]):
+                if offsets is None:
+                    column.append((torch.from_numpy(values[local_start:local_stop]), None))
+                else:
+                    _offsets = offsets[local_start:local_stop + 1]
+                    column.append((
+                        torch.from_numpy(values[_offsets[0]:_offsets[-1]]),
+                        torch.from_numpy(_offsets - _offsets[0])
+                    ))
+
+        batch = []
+        for info, column in zip(self.fields, columns):
+            if info['variable'] is False:
+                batch.append(column[0][0] if len(column) == 1 else torch.cat([item[0] for item in column]))
+                continue
+            if len(column) == 1:
+                values, offsets = column[0]
+            else:
+                values = torch.cat([item[0] for item in column])
+                # shift the offsets of each shard by the total length of the previous shards
+                offsets, base = [column[0][1][:1]], 0
+                for item in column:
+                    offsets.append(item[1][1:] + base)
+                    base += int(item[1][-1])
+                offsets = torch.cat(offsets)
+            batch.append((values, offsets) if self.pad_value is None else self.pad(values, offsets))
+        return self._pack(batch)
+
+    def pad(self, values: Tensor, offsets: Tensor) -> Tensor:
+        """Pad flattened variable-length values to the batch maximum length.
+        """
+        lengths = offsets[1:] - offsets[:-1]
+        max_length = int(lengths.max()) if lengths.numel() > 0 else 0
+        output = values.new_full((lengths.numel(), max_length, *values.shape[1:]), self.pad_value)
+        mask = torch.arange(max_length).unsqueeze(0) < lengths.unsqueeze(1)
+        output[mask] = values
+        return output
+
+    def _pack(self, items):
+        if self.meta['type'] == 'dict':
+            return {info['name']: item for info, item in zip(self.fields, items)}
+        elif self.meta['type'] == 'single':
+            return items[0]
+        return tuple(items)
+
+
+class ContiguousBatchSampler(Sampler):
+    """
+    Batch sampler that yields contiguous index ranges (as slices). When shuffle is True, the order of the ranges is
+    shuffled deterministically with ``seed + epoch``.
+    """
+
+    def __init__(self, length: int, batch_size: int, shuffle: bool = False, drop_last: bool = False, seed: int = 0):
+        self.length = length
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        starts = list(range(0, len(self) * self.batch_size, self.batch_size))
+        if self.shuffle is True:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            starts = [starts[i] for i in torch.randperm(len(starts), generator=generator).tolist()]
+        for start in starts:
+            yield slice(start, min(start + self.batch_size, self.length))
+
+    def __len__(self) -> int:
+        if self.drop_last is True:
+            return self.length // self.batch_size
+        return (self.length + self.batch_size - 1) // self.batch_size
+
+
+class MmapProvider(DataProvider):
+    """
+    Data provider of the memory-mapped dataset format. Batches are sliced from contiguous index ranges instead of
+    being collated sample by sample.
+
+    Args:
+        dataset (Union[str, MmapDataset]): dataset path or the dataset object.
+        batch_size (int): batch size.
+        shuffle (bool, optional): shuffle the batch ranges every epoch. Defaults to False.
+        drop_last (bool, optional): drop the last incomplete batch. Defaults to False.
+        seed (int, optional): shuffle seed. Defaults to 0.
+        loader_options (Dict, optional): other DataLoader options, e.g., ``num_workers`` and ``pin_memory``.
+    """
+
+    def __init__(
+        self,
+        dataset: Union[str, MmapDataset],
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+        seed: int = 0,
+        loader_options: Dict = None
+    ):
+        super().__init__()
+        self.dataset = dataset if isinstance(dataset, MmapDataset) else MmapDataset(dataset)
+        self.sampler = ContiguousBatchSampler(len(self.dataset), batch_size, shuffle, drop_last, seed)
+        self.loader_options = loader_options if loader_options is not None else {}
+
+    def get(self, ctx: Context) -> DataLoader:
+        if is_nothing(ctx.epoch.current) is False:
+            self.sampler.set_epoch(ctx.epoch.current)
+        # ``batch_size=None`` disables auto collation, and each slice is fetched as a whole batch.
+        return DataLoader(self.dataset, batch_size=None, sampler=self.sampler, **self.loader_options)
@@ -0,0 +1,235 @@
+"""
+Streaming data provider for datasets that are larger than RAM or local disk caches.
+
+Samples are read from sharded files by the DataLoader workers in parallel. Shards are assigned to the readers
+(distributed ranks x workers) deterministically(and shared by striding when there are more readers than shards),
+samples pass through a bounded shuffle buffer, and an epoch can be defined by a sample count instead of a full pass
+over the shards.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, Sequence
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+import itertools
+import math
+import random
+from . import DataProvider
+from ..core.context import Context
+from ..util import is_nothing
+
+
+class ShardedStream(IterableDataset):
+    """
+    Iterable dataset that streams samples from sharded files.
+
+    Args:
+        shards (Sequence[str]): shard paths(or any shard descriptors that the reader takes).
+        reader (Callable[[str], Iterable]): function that yields the samples of a shard.
+        shuffle_buffer (int, optional): size of the shuffle buffer. 0 disables sample shuffling. Defaults to 0.
+        shuffle_shards (bool, optional): shuffle the shard order every epoch. Defaults to True.
+        seed (int, optional): shuffle seed. Defaults to 0.
+        epoch_samples (int, optional): number of samples of an epoch. The shards are cycled if they have fewer
+            samples. Defaults to None(one pass over the shards).
+        batch_size (int, optional): batch size of the DataLoader, with which the epoch samples are split among the
+            readers by whole batches, so every batch is full except the last one. Defaults to None.
+        length_hint (int, optional): estimated number of samples of one pass, used for progress and ETA when
+            ``epoch_samples`` is not set. Defaults to None.
+        rank (int, optional): distributed rank. Defaults to 0.
+        world_size (int, optional): distributed world size. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[str],
+        reader: Callable[[str], Iterable],
+        shuffle_buffer: int = 0,
+        shuffle_shards: bool = True,
+        seed: int = 0,
+        epoch_samples: int = None,
+        batch_size: int = None,
+        length_hint: int = None,
+        rank: int = 0,
+        world_size: int = 1
+    ):
+        super().__init__()
+        self.shards = list(shards)
+        self.reader = reader
+        self.shuffle_buffer = shuffle_buffer
+        self.shuffle_shards = shuffle_shards
+        self.seed = seed
+        self.epoch_samples = epoch_samples
+        self.batch_size = batch_size
+        self.length_hint = length_hint
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.epoch_samples is None:
+            raise TypeError('The length of the stream is unknown, and length_hint is an estimation.')
+        # samples of this rank
+        return self.reader_quota(self.rank, self.world_size)
+
+    def __length_hint__(self) -> int:
+        if self.epoch_samples is not None:
+            return len(self)
+        return math.ceil(self.length_hint / self.world_size) if self.length_hint is not None else 0
+
+    def shard_order(self) -> Sequence[int]:
+        order = list(range(len(self.shards)))
+        if self.shuffle_shards is True:
+            random.Random('{0}-{1}'.format(self.seed, self.epoch)).shuffle(order)
+        return order
+
+    def reader_quota(self, index: int, readers: int):
+        """Number of samples of the reader in an epoch. Return None if the epoch is a full pass.
+        """
+        if self.epoch_samples is None:
+            return None
+        if self.batch_size is None:
+            return self.epoch_samples // readers + (1 if index < self.epoch_samples % readers else 0)
+        # split by whole batches, and the last(incomplete) batch belongs to the reader of its batch index
+        batches = math.ceil(self.epoch_samples / self.batch_size)
+        quota = (batches // readers + (1 if index < batches % readers else 0)) * self.batch_size
+        remainder = self.epoch_samples % self.batch_size
+        if remainder > 0 and (batches - 1) % readers == index:
+            quota -= self.batch_size - remainder
+        return quota
+
+    def __iter__(self) -> Iterator[Any]:
+        info = get_worker_info()
+        num_workers, worker = (info.num_workers, info.id) if info is not None else (1, 0)
+        # readers across the distributed ranks and the DataLoader workers
+        readers = self.world_size * num_workers
+        index = self.rank * num_workers + worker
+        if self.batch_size is not None and self.epoch_samples is not None:
+            # the DataLoader batches the samples of each worker separately, so the rank quota is split by workers
+            quota = self.split_quota(worker, num_workers)
+        else:
+            quota = self.reader_quota(index, readers)
+
+        order = self.shard_order()
+        if readers <= len(self.shards):
+            shards = [self.shards[i] for i in order[index::readers]]
+            samples = self.read(shards, cycle=quota is not None)
+        else:
+            # more readers than shards: the readers of a shard take every k-th sample of it, so every reader yields
+            # its quota(and a full pass yields each sample once)
+            count = len(self.shards)
+            sharing = (readers - index % count + count - 1) // count
+            samples = itertools.islice(
+                self.read([self.shards[order[index % count]]], cycle=quota is not None), index // count, None, sharing
+            )
+        if self.shuffle_buffer > 1:
+            samples = self.shuffle(samples, random.Random('{0}-{1}-{2}'.format(self.seed, self.epoch, index)))
+        if quota is not None:
+            samples = itertools.islice(samples, quota)
+        yield from samples
+
+    def split_quota(self, worker: int, num_workers: int) -> int:
+        """Split the quota of this rank among the workers by whole batches.
+        """
+        total = self.reader_quota(self.rank, self.world_size)
+        batches = math.ceil(total / self.batch_size)
+        quota = (batches // num_workers + (1 if worker < batches % num_workers else 0)) * self.batch_size
+        remainder = total % self.batch_size
+        if remainder > 0 and (batches - 1) % num_workers == worker:
+            quota -= self.batch_size - remainder
+        return quota
+
+    def read(self, shards: Sequence[str], cycle: bool = False) -> Iterator[Any]:
+        # the start shard rotates every epoch, so the cycled epochs cover different samples
+        start = self.epoch % len(shards) if cycle is True else 0
+        shards = shards[start:] + shards[:start]
+        while True:
+            count = 0
+            for shard in shards:
+                for sample in self.reader(shard):
+                    count += 1
+                    yield sample
+            # stop cycling empty shards
+            if cycle is False or count == 0:
+                return
+
+    def shuffle(self, samples: Iterator[Any], rng: random.Random) -> Iterator[Any]:
+        """Bounded shuffle buffer: a random sample of the buffer is yielded and replaced by the next sample.
+        """
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            index = rng.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+class StreamLoader(DataLoader):
+    """
+    DataLoader of the stream, which gives an estimated length through ``__length_hint__`` if the real length is
+    unknown.
+    """
+
+    def __length_hint__(self) -> int:
+        hint = self.dataset.__length_hint__()
+        if self.batch_size is None or hint == 0:
+            return hint
+        return hint // self.batch_size if self.drop_last else math.ceil(hint / self.batch_size)
+
+
+class StreamProvider(DataProvider):
+    """
+    Data provider of the sharded stream.
+
+    Args:
+        shards (Sequence[str]): shard paths.
+        reader (Callable[[str], Iterable]): function that yields the samples of a shard.
+        batch_size (int): batch size.
+        shuffle_buffer (int, optional): size of the shuffle buffer. Defaults to 0.
+        shuffle_shards (bool, optional): shuffle the shard order every epoch. Defaults to True.
+        seed (int, optional): shuffle seed. Defaults to 0.
+        epoch_samples (int, optional): number of samples of an epoch. Defaults to None(one pass over the shards).
+        length_hint (int, optional): estimated number of samples of one pass. Defaults to None.
+        drop_last (bool, optional): drop the last incomplete batch. Defaults to False.
+        rank (int, optional): distributed rank. Defaults to 0.
+        world_size (int, optional): distributed world size. Defaults to 1.
+        loader_options (Dict, optional): other DataLoader options, e.g., ``num_workers`` and ``collate_fn``.
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[str],
+        reader: Callable[[str], Iterable],
+        batch_size: int,
+        shuffle_buffer: int = 0,
+        shuffle_shards: bool = True,
+        seed: int = 0,
+        epoch_samples: int = None,
+        length_hint: int = None,
+        drop_last: bool = False,
+        rank: int = 0,
+        world_size: int = 1,
+        loader_options: Dict = None
+    ):
+        super().__init__()
+        self.dataset = ShardedStream(
+            shards, reader, shuffle_buffer, shuffle_shards, seed, epoch_samples, batch_size, length_hint,
+            rank, world_size
+        )
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.loader_options = loader_options if loader_options is not None else {}
+        # epoch counter of the evaluation, where the epoch context is not set
+        self._epoch = 0
+
+    def get(self, ctx: Context) -> DataLoader:
+        if is_nothing(ctx.epoch.current) is False:
+            self.dataset.set_epoch(ctx.epoch.current)
+        else:
+            self.dataset.set_epoch(self._epoch)
+            self._epoch += 1
+        # the loader is built every epoch, so the workers get the current epoch
+        return StreamLoader(self.dataset, batch_size=self.batch_size, drop_last=self.drop_last, **self.loader_options)
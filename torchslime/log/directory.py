@@ -6,6 +6,7 @@ NAMESPACE = NOTHING
 LOG_PATH = 'runtime.log'
 METRIC_PATH = 'metrics.json'
 CHECKPOINT_PATH = 'checkpoint'
+BENCHMARK_PATH = 'benchmark.json'
 
 
 def join_path(*args):
@@ -49,3 +50,7 @@ def get_metric_path():
 
 def get_checkpoint_path():
     return join_path(get_namespace_path(), CHECKPOINT_PATH)
+
+
+def get_benchmark_path():
+    return join_path(get_namespace_path(), BENCHMARK_PATH)
@@ -3,7 +3,6 @@ A convenient module register util that helps you parameterize network structure.
 """
 from ..util import NOTHING, MultiConst, Singleton, SingleConst
 from typing import Type, Any, Iterable
-import torch.nn as nn
 from .config import load_json
 
 
@@ -35,6 +34,8 @@ class Registry:
         return self.build(item['name'], *item.get('args', []), **item.get('kwargs', {}))
 
     def build_sequential(self, list_like: Iterable):
+        # import torch lazily, so the registry can be used without torch
+        import torch.nn as nn
         blocks = []
         for item in list_like:
             for _ in range(item.get('num', 1)):
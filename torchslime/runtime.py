@@ -0,0 +1,135 @@
+"""
+Lightweight predict runtime of the models exported by ``Proxy.export``.
+
+It only depends on torch (and onnxruntime for ONNX models) and does not import the training framework, so serving
+processes start faster. The model inputs are taken from the batches with the IndexParser indexes recorded at export
+time, which is the same as ``Proxy.predict``.
+"""
+from typing import Any, Callable, Iterable, List, Sequence
+from .util import NOTHING, list_take
+import json
+
+# file suffix of the export metadata
+META_SUFFIX = '.meta.json'
+
+
+def meta_path(path: str) -> str:
+    return path + META_SUFFIX
+
+
+def flatten_input(x) -> List:
+    """Flatten the model input to the list of positional graph inputs.
+    """
+    return list(x) if isinstance(x, (list, tuple)) else [x]
+
+
+class PredictEngine:
+    """
+    Run the exported TorchScript or ONNX graph on batches.
+
+    Args:
+        path (str): path of the exported model.
+        device (str, optional): device of the TorchScript model. ONNX models run on the CPU execution provider unless
+            ``providers`` is set. Defaults to 'cpu'.
+        parser (Callable, optional): function that takes the model input from a batch, which overrides the recorded
+            IndexParser indexes(e.g., for custom DataParsers). Defaults to None.
+        providers (Sequence[str], optional): onnxruntime execution providers. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        device: str = 'cpu',
+        parser: Callable[[Any], Any] = None,
+        providers: Sequence[str] = None
+    ):
+        super().__init__()
+        with open(meta_path(path)) as f:
+            self.meta = json.load(f)
+        self.format = self.meta['format']
+        self.device = device
+        self.parser = parser
+        if parser is None and self.meta.get('x', None) is None:
+            raise ValueError('The model is exported with a custom DataParser, and the parser should be given.')
+
+        import torch
+        self._torch = torch
+        self.dtype = getattr(torch, self.meta['dtype']) if self.meta.get('dtype', None) is not None else None
+        self.channels_last = self.meta.get('channels_last', False)
+        if self.format == 'torchscript':
+            self.module = torch.jit.load(path, map_location=device).eval()
+        elif self.format == 'onnx':
+            try:
+                import onnxruntime
+            except ImportError:
+                raise ImportError('onnxruntime is needed to run ONNX models, install it with "pip install onnxruntime".')
+            self.session = onnxruntime.InferenceSession(
+                path, providers=providers if providers is not None else ['CPUExecutionProvider']
+            )
+            self.input_names = [item.name for item in self.session.get_inputs()]
+        else:
+            raise ValueError('Unsupported export format: {0}.'.format(self.format))
+
+    def parse(self, batch):
+        """Take the model input from the batch.
+        """
+        if self.parser is not None:
+            return self.parser(batch)
+        x = self.meta['x']
+        return list_take(batch, tuple(x) if isinstance(x, list) else x)
+
+    def convert(self, tensor):
+        torch = self._torch
+        if isinstance(tensor, torch.Tensor) is False:
+            return tensor
+        return tensor.to(
+            device=self.device,
+            dtype=self.dtype if self.dtype is not None and tensor.is_floating_point() else None,
+            memory_format=torch.channels_last if self.channels_last is True and tensor.dim() == 4 \
+                else torch.preserve_format
+        )
+
+    def forward(self, x):
+        """Run the graph on the model input.
+        """
+        torch = self._torch
+        inputs = [self.convert(item) for item in flatten_input(x)]
+        if self.format == 'torchscript':
+            with torch.inference_mode():
+                return self.module(*inputs)
+        outputs = self.session.run(None, {
+            name: item.detach().cpu().numpy() if isinstance(item, torch.Tensor) else item
+            for name, item in zip(self.input_names, inputs)
+        })
+        outputs = [torch.from_numpy(output) for output in outputs]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+    def __call__(self, x):
+        return self.forward(x)
+
+    def predict(self, dataset: Iterable, callback: Callable[[Any, Any], None] = None) -> List:
+        """Run the graph on each batch of the dataset(e.g., a DataLoader).
+
+        Args:
+            dataset (Iterable): batches.
+            callback (Callable, optional): called with the batch and the prediction of each step. If it is set, the
+                predictions are not collected. Defaults to None.
+
+        Returns:
+            List: predictions of the batches.
+        """
+        results = []
+        for batch in dataset:
+            y_pred = self.forward(self.parse(batch))
+            if callback is not None:
+                callback(batch, y_pred)
+            else:
+                results.append(y_pred)
+        return results if callback is None else NOTHING
+
+
+def load(path: str, device: str = 'cpu', parser: Callable[[Any], Any] = None, **kwargs) -> PredictEngine:
+    """Load the exported model as a PredictEngine.
+    """
+    return PredictEngine(path, device, parser, **kwargs)
+
@@ -1,9 +1,8 @@
 # TODO: refactor the util package
-from typing import Dict, Union, Tuple, Sequence
+from typing import Dict, Union, Sequence
 from collections.abc import Iterator, Iterable
-from .type import T_M_SEQ, T_M
-from torch import Tensor
-from torch.nn import Module
+import importlib
+import operator
 import threading
 from functools import wraps
 from time import time
@@ -346,64 +345,6 @@ class BaseList(list):
             super().__init__(list_like if isinstance(list_like, Iterable) else [list_like])
 
 
-def get_device(obj: T_M):
-    """Get the device of the model or tensor.
-
-    Args:
-        obj (T_M): model or tensor
-
-    Returns:
-        device: the device
-    """
-    if isinstance(obj, Module):
-        parameter = next(obj.parameters(), None)
-        return parameter.device if parameter is not None else None
-    elif isinstance(obj, Tensor):
-        return obj.device
-    else:
-        return None
-
-
-def get_dtype(obj: T_M):
-    """Get the data type of the model or tensor
-
-    Args:
-        obj (T_M): model or tensor
-
-    Returns:
-        data type: the data type
-    """
-    if isinstance(obj, Module):
-        parameter = next(obj.parameters(), None)
-        return parameter.dtype if parameter is not None else None
-    elif isinstance(obj, Tensor):
-        return obj.dtype
-    else:
-        return None
-
-
-def type_cast(obj: T_M_SEQ, device=None, dtype=None) -> Union[Tuple[Tensor, Module], Tensor, Module, None]:
-    """Apply type cast to the model or tensor.
-
-    Args:
-        obj (T_M_SEQ): tensor, model, list of tensor or list of model
-        device ([type], optional): device. Defaults to None.
-        dtype ([type], optional): dtype. Defaults to None.
-
-    Returns:
-        Union[Tuple[Tensor, Module], Tensor, Module, None]: [description]
-    """
-    obj = obj if isinstance(obj, (list, tuple)) else ((obj, ) if isinstance(obj, (Tensor, Module)) else obj)
-    if isinstance(obj, (list, tuple)) is False:
-        return obj
-    if device is not None:
-        obj = [item.to(device=device) for item in obj]
-    if dtype is not None:
-        obj = [item.to(dtype=dtype) for item in obj]
-    obj = tuple(obj)
-    return obj if len(obj) > 1 else obj[0]
-
-
 def list_take(list_like, index: Union[Sequence[int], int]):
     """Get item or sub list of the list_like object through index(es).
 
@@ -486,14 +427,25 @@ class IterTool(Iter):
         return item if len(func_set_res) == 0 else (item, *func_set_res)
 
     def __len__(self):
+        length = self.length()
+        return length if is_nothing(length) is False else 0
+
+    def length(self):
+        """Get the length of the iterable item, or NOTHING if it is unknown(e.g., streams).
+        """
         try:
             return len(self._iterable)
-        except Exception:
-            logger.error('The iterable item has no __len__.')
-            return 0
+        except (TypeError, NotImplementedError):
+            return NOTHING
+
+    def length_hint(self):
+        """Get the estimated length of the iterable item, or NOTHING if it cannot be estimated.
+        """
+        hint = operator.length_hint(self._iterable, 0)
+        return hint if hint > 0 else NOTHING
 
     def progress(self):
-        return self._index, self.__len__()
+        return self._index, self.length()
 
     def time(self):
         return time()
@@ -502,19 +454,21 @@ class IterTool(Iter):
         return self._index
 
     def total(self):
-        return self.__len__()
-
-
-def count_params(model: Module, format: str = None, decimal: int = 2):
-    format_dict = {
-        None: 1,
-        'K': 1000,
-        'M': 1000000
-    }
-    divisor = format_dict.get(format, 1)
-
-    num = 0
-    for param in model.parameters():
-        num += param.numel()
-    result = num / divisor
-    return result if format is None else ('{0:.' + str(decimal) + 'f}{1}').format(result, format)
+        return self.length()
+
+
+# torch-dependent utils that are loaded lazily (PEP 562), so the light utils can be imported without torch.
+_LAZY_ATTRS = {
+    'get_device': '.tensor',
+    'get_dtype': '.tensor',
+    'type_cast': '.tensor',
+    'get_batch_size': '.tensor',
+    'detach': '.tensor',
+    'count_params': '.tensor'
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        return getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -52,6 +52,9 @@ def progress_format(
     Format a progress bar output.
     """
     current, total = progress[0] + 1, progress[1]
+    if isinstance(total, (int, float)) is False or total <= 0:
+        # unknown total steps(streaming datasets)
+        return '{0}/?'.format(int(current)) + ('\n' if newline else '')
     p_style = progress_style[style] if isinstance(style, str) else style
     output = ''
     if percentage is True:
@@ -0,0 +1,35 @@
+"""
+Process memory utils.
+"""
+from . import NOTHING
+import sys
+import os
+
+
+def peak_rss():
+    """Get the peak resident set size (in bytes) of the current process during its whole life time.
+    Return NOTHING if it is not supported on the platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return NOTHING
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def current_rss():
+    """Get the current resident set size (in bytes) of the current process.
+    Return NOTHING if it is not supported on the platform.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return NOTHING
@@ -0,0 +1,122 @@
+"""
+Torch-dependent utils.
+"""
+from typing import Union, Tuple
+from torch import Tensor
+from torch.nn import Module
+from .type import T_M_SEQ, T_M
+from . import NOTHING, is_nothing
+
+
+def get_device(obj: T_M):
+    """Get the device of the model or tensor.
+
+    Args:
+        obj (T_M): model or tensor
+
+    Returns:
+        device: the device
+    """
+    if isinstance(obj, Module):
+        parameter = next(obj.parameters(), None)
+        return parameter.device if parameter is not None else None
+    elif isinstance(obj, Tensor):
+        return obj.device
+    else:
+        return None
+
+
+def get_dtype(obj: T_M):
+    """Get the data type of the model or tensor
+
+    Args:
+        obj (T_M): model or tensor
+
+    Returns:
+        data type: the data type
+    """
+    if isinstance(obj, Module):
+        parameter = next(obj.parameters(), None)
+        return parameter.dtype if parameter is not None else None
+    elif isinstance(obj, Tensor):
+        return obj.dtype
+    else:
+        return None
+
+
+def type_cast(obj: T_M_SEQ, device=None, dtype=None) -> Union[Tuple[Tensor, Module], Tensor, Module, None]:
+    """Apply type cast to the model or tensor.
+
+    Args:
+        obj (T_M_SEQ): tensor, model, list of tensor or list of model
+        device ([type], optional): device. Defaults to None.
+        dtype ([type], optional): dtype. Defaults to None.
+
+    Returns:
+        Union[Tuple[Tensor, Module], Tensor, Module, None]: [description]
+    """
+    obj = obj if isinstance(obj, (list, tuple)) else ((obj, ) if isinstance(obj, (Tensor, Module)) else obj)
+    if isinstance(obj, (list, tuple)) is False:
+        return obj
+    if device is not None or dtype is not None:
+        # single ``.to()`` pass for both device and dtype
+        obj = [item.to(device=device, dtype=dtype) for item in obj]
+    obj = tuple(obj)
+    return obj if len(obj) > 1 else obj[0]
+
+
+def get_batch_size(obj):
+    """Get the batch size (the first dim of the first tensor found) of a (nested) batch.
+
+    Args:
+        obj (Any): tensor, or list, tuple or dict that contains tensors.
+
+    Returns:
+        int: the batch size, or NOTHING if no tensor with batch dim is found.
+    """
+    if isinstance(obj, Tensor):
+        return obj.shape[0] if obj.dim() > 0 else NOTHING
+    elif isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        for item in obj:
+            batch_size = get_batch_size(item)
+            if is_nothing(batch_size) is False:
+                return batch_size
+    return NOTHING
+
+
+def detach(obj):
+    """Detach the tensors in a (nested) list, tuple or dict from the autograd graph.
+
+    Args:
+        obj (Any): tensor, or list, tuple or dict that contains tensors.
+
+    Returns:
+        Any: object with the same structure.
+    """
+    if isinstance(obj, Tensor):
+        return obj.detach()
+    elif isinstance(obj, dict):
+        return type(obj)((key, detach(value)) for key, value in obj.items())
+    elif isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        # namedtuple
+        return type(obj)(*(detach(item) for item in obj))
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(detach(item) for item in obj)
+    return obj
+
+
+def count_params(model: Module, format: str = None, decimal: int = 2):
+    format_dict = {
+        None: 1,
+        'K': 1000,
+        'M': 1000000
+    }
+    divisor = format_dict.get(format, 1)
+
+    num = 0
+    for param in model.parameters():
+        num += param.numel()
+    result = num / divisor
+    return result if format is None else ('{0:.' + str(decimal) + 'f}{1}').format(result, format)
@@ -0,0 +1,103 @@
+"""
+Structure-aware tensor transfer engine.
+
+It walks arbitrary nested batch structures (lists, tuples, namedtuples, dicts and dataclasses) and converts the
+device, dtype and memory format of each tensor in a single ``.to()`` call. Conversion plans are cached per type, so
+the types of the batch schema are inspected only once.
+"""
+from copy import copy
+from typing import Any, Callable, Dict
+import dataclasses
+import torch
+from torch import Tensor
+from torch.nn import Module
+
+
+class TensorTransfer:
+    """
+    Transfer (nested) tensors and modules to the target device, dtype and memory format.
+
+    Args:
+        dtype (optional): target dtype, which is applied to floating point tensors only, so labels and indexes keep
+            their integer types. Defaults to None.
+        memory_format (optional): target memory format, e.g., ``torch.channels_last`` (applied to 4-D tensors) or
+            ``torch.channels_last_3d`` (applied to 5-D tensors). Defaults to None.
+        non_blocking (bool, optional): asynchronous copy with respect to the host if possible, e.g., copying pinned
+            CPU tensors to CUDA. Defaults to False.
+    """
+
+    def __init__(self, dtype=None, memory_format=None, non_blocking: bool = False):
+        super().__init__()
+        self.dtype = dtype
+        self.memory_format = memory_format
+        self.non_blocking = non_blocking
+        # type -> conversion plan
+        self._plans: Dict[type, Callable[[Any, Any], Any]] = {}
+
+    def __call__(self, obj, device=None):
+        return self.convert(obj, device)
+
+    def convert(self, obj, device=None):
+        cls = type(obj)
+        plan = self._plans.get(cls, None)
+        if plan is None:
+            plan = self._plans[cls] = self.build_plan(cls)
+        return plan(obj, device)
+
+    def build_plan(self, cls: type) -> Callable[[Any, Any], Any]:
+        """Build the conversion plan of a type.
+        """
+        convert = self.convert
+        if issubclass(cls, Tensor):
+            return self.convert_tensor
+        elif issubclass(cls, Module):
+            return self.convert_module
+        elif issubclass(cls, tuple) and hasattr(cls, '_fields'):
+            # namedtuple
+            return lambda obj, device: cls(*(convert(item, device) for item in obj))
+        elif cls is list or issubclass(cls, tuple):
+            return lambda obj, device: cls(convert(item, device) for item in obj)
+        elif issubclass(cls, list):
+            # list subclasses whose constructor may differ, such as BaseList
+            def convert_list(obj, device):
+                result = copy(obj)
+                for index, item in enumerate(obj):
+                    result[index] = convert(item, device)
+                return result
+            return convert_list
+        elif cls is dict:
+            return lambda obj, device: {key: convert(value, device) for key, value in obj.items()}
+        elif issubclass(cls, dict):
+            # dict subclasses such as OrderedDict and defaultdict
+            def convert_dict(obj, device):
+                result = copy(obj)
+                for key, value in obj.items():
+                    result[key] = convert(value, device)
+                return result
+            return convert_dict
+        elif dataclasses.is_dataclass(cls):
+            names = [field.name for field in dataclasses.fields(cls) if field.init]
+            return lambda obj, device: dataclasses.replace(
+                obj, **{name: convert(getattr(obj, name), device) for name in names}
+            )
+        # other objects are returned as they are
+        return lambda obj, _: obj
+
+    def convert_tensor(self, tensor: Tensor, device=None) -> Tensor:
+        memory_format = self.memory_format
+        if (memory_format is torch.channels_last and tensor.dim() != 4) or \
+                (memory_format is torch.channels_last_3d and tensor.dim() != 5) or memory_format is None:
+            memory_format = torch.preserve_format
+        # single ``.to()`` call, and no copy is made if nothing changes
+        return tensor.to(
+            device=device,
+            dtype=self.dtype if tensor.is_floating_point() else None,
+            non_blocking=self.non_blocking,
+            memory_format=memory_format
+        )
+
+    def convert_module(self, module: Module, device=None) -> Module:
+        module = module.to(device=device, dtype=self.dtype, non_blocking=self.non_blocking)
+        if self.memory_format is not None:
+            module = module.to(memory_format=self.memory_format)
+        return module